@@ -1,7 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
-from django.conf import settings
+from kombu import Exchange, Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_exchanger.settings')
@@ -12,21 +12,105 @@ app = Celery('backend_exchanger')
 # the configuration object to child processes.
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Worker profiles, one worker deployment per queue so a backlog in one queue cannot starve another.
+# I/O-bound queues run on a thread pool with high concurrency, CPU/DB-heavy queues on prefork.
+# acks_late is applied to every task routed to the queue: such tasks must be idempotent.
+QUEUE_PROFILES = {
+    'default': {
+        'pool': 'prefork',
+        'concurrency': int(os.getenv('CELERY_DEFAULT_CONCURRENCY', 2)),
+        'prefetch_multiplier': 1,
+        'acks_late': False,
+    },
+    'send_notification': {
+        'pool': 'threads',
+        'concurrency': int(os.getenv('CELERY_NOTIFICATION_CONCURRENCY', 50)),
+        'prefetch_multiplier': 4,
+        'acks_late': False,
+    },
+    'outbox': {
+        'pool': 'threads',
+        'concurrency': int(os.getenv('CELERY_OUTBOX_CONCURRENCY', 4)),
+        'prefetch_multiplier': 1,
+        'acks_late': True,
+    },
+    'update_exchange_rates': {
+        'pool': 'prefork',
+        'concurrency': 1,
+        'prefetch_multiplier': 1,
+        'acks_late': True,
+    },
+    'payments': {
+        'pool': 'prefork',
+        'concurrency': int(os.getenv('CELERY_PAYMENTS_CONCURRENCY', 4)),
+        'prefetch_multiplier': 1,
+        'acks_late': True,
+    },
+    # the import hashes passwords in its own process pool, which prefork's daemonic children cannot start
+    'user_import': {
+        'pool': 'threads',
+        'concurrency': 1,
+        'prefetch_multiplier': 1,
+        'acks_late': False,
+    },
+}
+
+# Task registry: every task is routed to exactly one queue.
+TASK_QUEUES = {
+    'finance.tasks.send_notification': 'send_notification',
+    'finance.tasks.relay_outbox': 'outbox',
+    'finance.tasks.update_exchange_rates': 'update_exchange_rates',
+    'finance.tasks.process_webhook_events': 'payments',
+    'finance.tasks.reconcile_applications': 'payments',
+    'finance.tasks.process_payouts': 'payments',
+    'users.tasks.import_users': 'user_import',
+}
+
+app.conf.update(
+    task_default_queue='default',
+    task_queues=[Queue(queue, Exchange(queue), routing_key=queue) for queue in QUEUE_PROFILES],
+    task_routes={task: {'queue': queue} for task, queue in TASK_QUEUES.items()},
+    task_annotations={
+        task: {'acks_late': QUEUE_PROFILES[queue]['acks_late'], 'reject_on_worker_lost': True}
+        for task, queue in TASK_QUEUES.items() if QUEUE_PROFILES[queue]['acks_late']
+    },
+)
+
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
+# Task latency / queue lag metrics, served by every worker on CELERY_METRICS_PORT.
+import common.celery_metrics  # noqa: E402,F401
+
 # Configure Celery Beat schedule
 app.conf.beat_schedule = {
-    'update-currency-rates': {
-        'task': 'finance.tasks.update_currency_rates',
-        'schedule': crontab(minute='*/30'),  # Every 30 minutes
+    'update_exchange_rates': {
+        'task': 'finance.tasks.update_exchange_rates',
+        'schedule': crontab(hour=12, minute=30),
+    },
+    'process_webhook_events': {
+        'task': 'finance.tasks.process_webhook_events',
+        'schedule': float(os.getenv('WEBHOOK_POLL_INTERVAL', 10)),
     },
-    'cleanup-old-transactions': {
-        'task': 'finance.tasks.cleanup_old_transactions',
-        'schedule': crontab(hour=0, minute=0),  # Daily at midnight
+    'relay_outbox': {
+        'task': 'finance.tasks.relay_outbox',
+        'schedule': float(os.getenv('OUTBOX_POLL_INTERVAL', 2)),
+    },
+    'reconcile_applications': {
+        'task': 'finance.tasks.reconcile_applications',
+        'schedule': crontab(minute='*/15'),
+    },
+    'process_payouts': {
+        'task': 'finance.tasks.process_payouts',
+        'schedule': float(os.getenv('PAYOUT_POLL_INTERVAL', 30)),
+    },
+    'cleanup_old_data': {
+        'task': 'common.tasks.cleanup_old_data',
+        'schedule': crontab(hour=3, minute=0),
     },
 }
 
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}') 
\ No newline at end of file
+    print(f'Request: {self.request!r}')
@@ -0,0 +1,18 @@
+"""
+gunicorn configuration for the ASGI application: uvicorn workers, each serving requests on one event loop.
+
+    gunicorn backend_exchanger.asgi:application -c backend_exchanger/gunicorn_asgi.py
+
+Sync views (all DRF views) still run in a thread per request; get_rates and webhook_handler are served
+by native async views (ASYNC_VIEWS).
+"""
+import os
+import multiprocessing
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2))
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+raw_env = ['ASYNC_VIEWS=True']
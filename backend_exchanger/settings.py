@@ -14,7 +14,7 @@ import os, logging, sentry_sdk
 from pathlib import Path
 from sentry_sdk.integrations.django import DjangoIntegration
 from sentry_sdk.integrations.celery import CeleryIntegration
-from sentry_sdk.integrations.logging import LoggingIntegration
+from sentry_sdk.integrations.logging import LoggingIntegration, ignore_logger
 from sentry_sdk.integrations.redis import RedisIntegration
 from datetime import timedelta
 
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -60,6 +61,7 @@ INSTALLED_APPS = [
     'django_prometheus',
     'cacheops',
 
+    'common',
     'users',
     'finance',
 ]
@@ -93,22 +95,34 @@ sentry_sdk.init(
     environment=os.getenv('SENTRY_ENV', 'development'),
     profiles_sample_rate=float(os.getenv('SENTRY_PROFILES_SAMPLE_RATE', '0.1')),
 )
+# access log entries as Sentry breadcrumbs only add per-request cost
+ignore_logger('access')
 
 MIDDLEWARE = [
-    'django_prometheus.middleware.PrometheusBeforeMiddleware',
-    'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # async-capable variants of Django middlewares from common.middleware: under ASGI their hooks run in the
+    # event loop instead of a thread per hook
+    'common.middleware.PrometheusBeforeMiddleware',
+    'common.middleware.RouteMetricsMiddleware',
+    'common.middleware.RequestLoggingMiddleware',
+    'common.middleware.SecurityMiddleware',
+    'common.middleware.AsyncWhiteNoiseMiddleware',
+    'common.middleware.CompressionMiddleware',
+    'common.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
-    'django_prometheus.middleware.PrometheusAfterMiddleware',
+    'common.middleware.CommonMiddleware',
+    'common.middleware.ConditionalGetMiddleware',
+    'common.middleware.CacheControlMiddleware',
+    'common.middleware.CsrfViewMiddleware',
+    'common.middleware.AuthenticationMiddleware',
+    'common.middleware.RateLimitMiddleware',
+    'common.middleware.MessageMiddleware',
+    'common.middleware.XFrameOptionsMiddleware',
+    'common.middleware.PrometheusAfterMiddleware',
 ]
 
+if DEBUG:
+    MIDDLEWARE.insert(-1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'backend_exchanger.urls'
 
 TEMPLATES = [
@@ -188,7 +202,12 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Celery results settings
-CELERY_RESULT_BACKEND = 'django-db'
+# Results are ignored unless a task sets ignore_result=False; those go to Redis with a TTL, zlib-compressed
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/2')
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_STORE_ERRORS_EVEN_IF_IGNORED = True
+CELERY_RESULT_EXPIRES = int(os.getenv('CELERY_RESULT_EXPIRES', 24 * 60 * 60))
+CELERY_RESULT_COMPRESSION = 'zlib'
 
 # Celery settings
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'amqp://localhost')
@@ -202,6 +221,84 @@ CELERY_TASK_TIME_LIMIT = 30 * 60
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
+# Task locks settings
+LOCK_REDIS_URL = os.getenv('LOCK_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/1'))
+
+# Data retention settings: periods in days, 0 keeps rows forever
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 1000))
+# share of wall time the purge may spend in DELETE statements, in (0, 1]
+RETENTION_TARGET_LOAD = float(os.getenv('RETENTION_TARGET_LOAD', '0.25'))
+RETENTION_MAX_RUNTIME = float(os.getenv('RETENTION_MAX_RUNTIME', 600))
+RETENTION_APPLICATION_LOG_DAYS = int(os.getenv('RETENTION_APPLICATION_LOG_DAYS', 365))
+RETENTION_TASK_RESULT_DAYS = int(os.getenv('RETENTION_TASK_RESULT_DAYS', 7))
+RETENTION_TRANSACTION_DAYS = int(os.getenv('RETENTION_TRANSACTION_DAYS', 0))
+RETENTION_OUTBOX_MESSAGE_DAYS = int(os.getenv('RETENTION_OUTBOX_MESSAGE_DAYS', 7))
+RETENTION_WEBHOOK_EVENT_DAYS = int(os.getenv('RETENTION_WEBHOOK_EVENT_DAYS', 30))
+
+# Yookassa client settings
+YOOKASSA_API_URL = os.getenv('YOOKASSA_API_URL', 'https://api.yookassa.ru/v3')
+YOOKASSA_ACCOUNT_ID = os.getenv('YOOKASSA_ACCOUNT_ID', os.getenv('YOOKASSA_SHOP_ID'))
+YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
+YOOKASSA_CONNECT_TIMEOUT = float(os.getenv('YOOKASSA_CONNECT_TIMEOUT', '3.05'))
+YOOKASSA_READ_TIMEOUT = float(os.getenv('YOOKASSA_READ_TIMEOUT', '10'))
+YOOKASSA_POOL_SIZE = int(os.getenv('YOOKASSA_POOL_SIZE', '20'))
+YOOKASSA_MAX_RETRIES = int(os.getenv('YOOKASSA_MAX_RETRIES', '3'))
+# повторы в запросах пользователя (создание платежа): ответ не должен ждать всю серию повторов
+YOOKASSA_VIEW_MAX_RETRIES = int(os.getenv('YOOKASSA_VIEW_MAX_RETRIES', '0'))
+YOOKASSA_RETRY_BACKOFF = float(os.getenv('YOOKASSA_RETRY_BACKOFF', '0.5'))
+YOOKASSA_BREAKER_FAILURE_THRESHOLD = int(os.getenv('YOOKASSA_BREAKER_FAILURE_THRESHOLD', '5'))
+YOOKASSA_BREAKER_RECOVERY_TIME = float(os.getenv('YOOKASSA_BREAKER_RECOVERY_TIME', '30'))
+
+# Yookassa webhook inbox settings
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', '100'))
+WEBHOOK_MAX_BATCHES = int(os.getenv('WEBHOOK_MAX_BATCHES', '50'))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '10'))
+WEBHOOK_RETRY_DELAY = int(os.getenv('WEBHOOK_RETRY_DELAY', '30'))
+WEBHOOK_RETRY_MAX_DELAY = int(os.getenv('WEBHOOK_RETRY_MAX_DELAY', '3600'))
+WEBHOOK_LEASE_TIME = int(os.getenv('WEBHOOK_LEASE_TIME', '300'))
+# адреса, с которых Yookassa отправляет уведомления: вебхуки с других адресов не сохраняются
+WEBHOOK_ALLOWED_IPS = os.getenv(
+    'WEBHOOK_ALLOWED_IPS',
+    '185.71.76.0/27,185.71.77.0/27,77.75.153.0/25,77.75.156.11,77.75.156.35,77.75.154.128/25,2a02:5180::/32',
+).split(',')
+
+# Transactional outbox settings
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '500'))
+OUTBOX_MAX_BATCHES = int(os.getenv('OUTBOX_MAX_BATCHES', '20'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_DELAY = int(os.getenv('OUTBOX_RETRY_DELAY', '5'))
+OUTBOX_RETRY_MAX_DELAY = int(os.getenv('OUTBOX_RETRY_MAX_DELAY', '600'))
+OUTBOX_STREAM_MAXLEN = int(os.getenv('OUTBOX_STREAM_MAXLEN', '100000'))
+
+# Pending applications reconciliation settings
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '500'))
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', '16'))
+RECONCILE_STALE_AFTER = int(os.getenv('RECONCILE_STALE_AFTER', '900'))
+
+# Withdrawal payouts settings
+PAYOUT_BATCH_SIZE = int(os.getenv('PAYOUT_BATCH_SIZE', '200'))
+PAYOUT_MAX_WAIT = int(os.getenv('PAYOUT_MAX_WAIT', '300'))
+PAYOUT_CONCURRENCY = int(os.getenv('PAYOUT_CONCURRENCY', '8'))
+PAYOUT_RESUBMIT_AFTER = int(os.getenv('PAYOUT_RESUBMIT_AFTER', '120'))
+PAYOUT_RESUBMIT_WINDOW = int(os.getenv('PAYOUT_RESUBMIT_WINDOW', '43200'))
+
+# SMS notifications settings
+SMS_REDIS_URL = os.getenv('SMS_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/1'))
+SMS_COALESCE_WINDOW = int(os.getenv('SMS_COALESCE_WINDOW', '60'))
+SMS_RATE_LIMIT = int(os.getenv('SMS_RATE_LIMIT', '10'))
+SMS_POOL_SIZE = int(os.getenv('SMS_POOL_SIZE', '10'))
+SMS_TIMEOUT = float(os.getenv('SMS_TIMEOUT', '3'))
+SMS_MESSAGE_COST = float(os.getenv('SMS_MESSAGE_COST', '3.5'))
+# celery - сводки отправляет задача send_notification, asyncio - воркер run_notification_worker
+SMS_WORKER_MODE = os.getenv('SMS_WORKER_MODE', 'celery')
+SMS_WORKER_CONCURRENCY = int(os.getenv('SMS_WORKER_CONCURRENCY', '1000'))
+SMS_WORKER_BATCH_SIZE = int(os.getenv('SMS_WORKER_BATCH_SIZE', '500'))
+SMS_WORKER_POLL_INTERVAL = float(os.getenv('SMS_WORKER_POLL_INTERVAL', '0.5'))
+SMS_WORKER_REDIS_CONNECTIONS = int(os.getenv('SMS_WORKER_REDIS_CONNECTIONS', '50'))
+SMS_PROVIDER_CONCURRENCY = int(os.getenv('SMS_PROVIDER_CONCURRENCY', '200'))
+SMS_MAX_RETRIES = int(os.getenv('SMS_MAX_RETRIES', '3'))
+SMS_RETRY_BACKOFF = float(os.getenv('SMS_RETRY_BACKOFF', '0.5'))
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST')
@@ -242,6 +339,51 @@ CACHES = {
     }
 }
 
+# Rate limit settings: token buckets in Redis, rate is '<count>/<s|m|h|d>', the first matching rule applies
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/1'))
+# reverse proxies in front of the app: the client IP is taken this many entries from the right of
+# X-Forwarded-For, 0 uses REMOTE_ADDR (the header is set by the client and ignored)
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
+RATE_LIMIT_RULES = [
+    # уведомления Yookassa не должны отбрасываться, адреса отправителя проверяет сам обработчик (WEBHOOK_ALLOWED_IPS)
+    {'name': 'webhook', 'pattern': r'^/api/user_application/webhook_handler/', 'methods': ['POST'], 'rate': None},
+    {
+        'name': 'transfer',
+        'pattern': r'^/api/(user_transaction/transfer_funds|user_application)/',
+        'methods': ['POST'],
+        'rate': os.getenv('RATE_LIMIT_TRANSFER', '10/m'),
+        'burst': int(os.getenv('RATE_LIMIT_TRANSFER_BURST', 5)),
+    },
+    {
+        'name': 'write',
+        'pattern': r'^/api/',
+        'methods': ['POST', 'PUT', 'PATCH', 'DELETE'],
+        'rate': os.getenv('RATE_LIMIT_WRITE', '60/m'),
+    },
+    {
+        'name': 'read',
+        'pattern': r'^/api/',
+        'methods': ['GET', 'HEAD', 'OPTIONS'],
+        'rate': os.getenv('RATE_LIMIT_READ', '300/m'),
+    },
+]
+
+# Response compression: brotli quality 0-11, gzip level 1-9
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSION_SKIP_TYPES = ['image/', 'video/', 'audio/', 'application/zip', 'application/gzip', 'application/pdf']
+
+# HTTP cache policy: public endpoints are cached by clients / CDN for max-age and in the server-side cache
+RATES_CACHE_MAX_AGE = int(os.getenv('RATES_CACHE_MAX_AGE', 60))
+SCHEMA_CACHE_MAX_AGE = int(os.getenv('SCHEMA_CACHE_MAX_AGE', 3600))
+
+# ASGI: get_rates and webhook_handler are served by native async views (finance.async_views)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+RATES_REDIS_URL = os.getenv(
+    'RATES_REDIS_URL', f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', '6379')}/0",
+)
+
 # Cacheops settings
 CACHEOPS_REDIS = os.getenv('REDIS_URL', 'redis://localhost:6379/1')
 CACHEOPS_DEFAULTS = {
@@ -255,7 +397,7 @@ CACHEOPS = {
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -300,10 +442,37 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# JWT user resolution cache (users.authentication): saving a user bumps the version of its Redis entry,
+# the process-local copy lives at most USER_CACHE_LOCAL_TTL seconds in other processes.
+# The lookup bypasses cacheops, which keeps caching users.User for the other queries
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))
+USER_CACHE_LOCAL_TTL = float(os.getenv('USER_CACHE_LOCAL_TTL', 5))
+USER_CACHE_LOCAL_SIZE = int(os.getenv('USER_CACHE_LOCAL_SIZE', 10000))
+
+# Revoked JWT (users.revocation): jti are kept in Redis until the token expires, each process checks them
+# against a Bloom filter and asks Redis only on a match. The filter picks up new revocations every
+# REVOKED_TOKENS_REFRESH_INTERVAL seconds and is rebuilt without expired tokens every REVOKED_TOKENS_REBUILD_INTERVAL
+REVOKED_TOKENS_REDIS_URL = os.getenv('REVOKED_TOKENS_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/1'))
+REVOKED_TOKENS_REFRESH_INTERVAL = float(os.getenv('REVOKED_TOKENS_REFRESH_INTERVAL', 5))
+REVOKED_TOKENS_REBUILD_INTERVAL = float(os.getenv('REVOKED_TOKENS_REBUILD_INTERVAL', 600))
+REVOKED_TOKENS_FALSE_POSITIVE_RATE = float(os.getenv('REVOKED_TOKENS_FALSE_POSITIVE_RATE', 0.001))
+REVOKED_TOKENS_MIN_CAPACITY = int(os.getenv('REVOKED_TOKENS_MIN_CAPACITY', 10000))
+
+# Bulk user import (users.bulk_import): rows are inserted in batches, passwords are hashed by USER_IMPORT_WORKERS
+# processes. Uploads from the admin endpoint are kept in media storage until the user_import queue processes them
+USER_IMPORT_BATCH_SIZE = int(os.getenv('USER_IMPORT_BATCH_SIZE', 2000))
+USER_IMPORT_WORKERS = int(os.getenv('USER_IMPORT_WORKERS', os.cpu_count() or 1))
+USER_IMPORT_TIME_LIMIT = int(os.getenv('USER_IMPORT_TIME_LIMIT', 12 * 60 * 60))
+
 # Debug toolbar settings
 INTERNAL_IPS = ['127.0.0.1']
 
 # Logging configuration
+# Access log settings: errors and slow requests are always logged, the rest is sampled
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv('ACCESS_LOG_SAMPLE_RATE', '0.1'))
+ACCESS_LOG_SLOW_MS = float(os.getenv('ACCESS_LOG_SLOW_MS', 500))
+ACCESS_LOG_ERROR_STATUS = int(os.getenv('ACCESS_LOG_ERROR_STATUS', 500))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -312,21 +481,38 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'common.access_log.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        # file handlers write from a background thread, the logging call only enqueues the record
         'file': {
-            'class': 'logging.handlers.RotatingFileHandler',
+            'class': 'common.access_log.BackgroundRotatingFileHandler',
             'filename': BASE_DIR / 'logs/django.log',
             'maxBytes': 1024 * 1024 * 5,  # 5 MB
             'backupCount': 5,
             'formatter': 'verbose',
         },
+        'access_file': {
+            'class': 'common.access_log.BackgroundRotatingFileHandler',
+            'filename': BASE_DIR / 'logs/access.log',
+            'maxBytes': 1024 * 1024 * 50,  # 50 MB
+            'backupCount': 5,
+            'queue_size': int(os.getenv('ACCESS_LOG_QUEUE_SIZE', 10000)),
+            'formatter': 'json',
+        },
     },
     'loggers': {
+        'access': {
+            'handlers': ['access_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django': {
             'handlers': ['console', 'file'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
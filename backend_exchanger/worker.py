@@ -0,0 +1,32 @@
+"""
+Start a Celery worker for one queue with its profile from QUEUE_PROFILES.
+
+    python -m backend_exchanger.worker payments
+"""
+import sys
+
+from backend_exchanger.celery import app, QUEUE_PROFILES
+from common.celery_metrics import reset_multiproc_dir
+
+
+def worker_argv(queue: str) -> list:
+    """
+    Build worker command line arguments for the queue profile.
+    """
+    profile = QUEUE_PROFILES[queue]
+    return [
+        'worker',
+        '--loglevel=INFO',
+        f'--queues={queue}',
+        f'--hostname={queue}@%h',
+        f'--pool={profile["pool"]}',
+        f'--concurrency={profile["concurrency"]}',
+        f'--prefetch-multiplier={profile["prefetch_multiplier"]}',
+    ]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in QUEUE_PROFILES:
+        sys.exit(f'Usage: python -m backend_exchanger.worker <{"|".join(QUEUE_PROFILES)}>')
+    reset_multiproc_dir()
+    app.worker_main(argv=worker_argv(sys.argv[1]))
@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.urls import path, re_path
 from drf_yasg.generators import OpenAPISchemaGenerator
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from common.cache_policy import CachePolicy, cache_policy
+
+SCHEMA_CACHE_POLICY = CachePolicy(public=True, max_age=settings.SCHEMA_CACHE_MAX_AGE, vary=())
+
 
 class BothHttpAndHttpsSchemaGenerator(OpenAPISchemaGenerator):
     def get_schema(self, request=None, public=False):
@@ -24,8 +29,21 @@ schema_view = get_schema_view(
     permission_classes=(permissions.AllowAny,),
 )
 
+# the schema is public: rendered responses are kept in the server-side cache (cache_page) and by CDN
 urlpatterns = [
-    re_path('swagger(?P<format>\.json|\.yaml)', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    re_path(
+        'swagger(?P<format>\.json|\.yaml)',
+        cache_policy(SCHEMA_CACHE_POLICY)(schema_view.without_ui(cache_timeout=settings.SCHEMA_CACHE_MAX_AGE)),
+        name='schema-json',
+    ),
+    path(
+        'swagger/',
+        cache_policy(SCHEMA_CACHE_POLICY)(schema_view.with_ui('swagger', cache_timeout=settings.SCHEMA_CACHE_MAX_AGE)),
+        name='schema-swagger-ui',
+    ),
+    path(
+        'redoc/',
+        cache_policy(SCHEMA_CACHE_POLICY)(schema_view.with_ui('redoc', cache_timeout=settings.SCHEMA_CACHE_MAX_AGE)),
+        name='schema-redoc',
+    ),
 ]
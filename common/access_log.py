@@ -0,0 +1,90 @@
+import os
+import json
+import atexit
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+
+from prometheus_client import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total',
+    'Log records dropped because the background handler queue was full',
+    ['handler'],
+)
+
+# attributes every LogRecord has, the rest came from ``extra``
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message and everything passed in ``extra``.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BackgroundRotatingFileHandler(logging.handlers.QueueHandler):
+    """
+    RotatingFileHandler that writes from a background thread.
+
+    The logging call only puts the record on a bounded in-memory queue; formatting and file I/O happen
+    in a QueueListener thread. When the queue is full the record is dropped (and counted) instead of
+    blocking the request.
+    """
+
+    def __init__(self, filename, maxBytes: int = 0, backupCount: int = 0, queue_size: int = 10000, **kwargs) -> None:
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        self.target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount, **kwargs,
+        )
+        self.start_listener()
+        atexit.register(self.stop_listener)
+        # threads do not survive fork (prefork Celery workers, gunicorn --preload): restart in the child
+        os.register_at_fork(after_in_child=self.restart_listener)
+
+    def start_listener(self) -> None:
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def stop_listener(self) -> None:
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def restart_listener(self) -> None:
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.start_listener()
+
+    def setFormatter(self, formatter: logging.Formatter) -> None:
+        # records are formatted by the file handler in the background thread
+        self.target.setFormatter(formatter)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the record never leaves the process, so it does not need to be pickle-safe
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(self.target.baseFilename).inc()
+
+    def close(self) -> None:
+        self.stop_listener()
+        self.target.close()
+        super().close()
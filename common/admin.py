@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import DeadLetterTask
+
+
+@admin.register(DeadLetterTask)
+class DeadLetterTaskAdmin(admin.ModelAdmin):
+    list_display = ('task_name', 'task_id', 'exception', 'retries', 'status', 'created', 'replayed_at')
+    list_filter = ('status', 'task_name')
+    search_fields = ('task_id', 'error')
+    readonly_fields = ('task_name', 'task_id', 'args', 'kwargs', 'exception', 'error', 'traceback', 'retries')
@@ -0,0 +1,24 @@
+import asyncio
+import weakref
+import functools
+
+
+def per_event_loop(factory):
+    """
+    Cache the result of ``factory`` per running event loop, the asyncio counterpart of ``lru_cache``
+    for client factories.
+
+    redis.asyncio connections belong to the loop they were opened in: one client is shared by all
+    requests of a uvicorn worker, while each ``async_to_sync`` call or async test gets its own.
+    """
+    instances = weakref.WeakKeyDictionary()
+
+    @functools.wraps(factory)
+    def wrapper():
+        loop = asyncio.get_running_loop()
+        instance = instances.get(loop)
+        if instance is None:
+            instance = instances[loop] = factory()
+        return instance
+
+    return wrapper
@@ -0,0 +1,116 @@
+import hashlib
+import functools
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.utils.cache import patch_vary_headers
+from prometheus_client import Counter
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+SHARED_CACHE_REQUESTS = Counter(
+    'shared_response_cache_requests_total',
+    'Server-side response cache lookups',
+    ['view', 'result'],
+)
+
+SHARED_CACHE_KEY = 'response:{}:{}'
+
+
+class CachePolicy:
+    """
+    HTTP caching rules of a view.
+
+    ``public`` responses may be stored by proxies and CDNs, private ones only by the client; ``no_store``
+    forbids caching at all. ``max_age=0`` on a cacheable response means "revalidate every time".
+    ``stale_while_revalidate`` lets caches serve a stale copy while they fetch a fresh one.
+    ``vary`` lists request headers the response depends on. ``shared_timeout`` additionally keeps
+    the response data in the server-side cache for that many seconds, for data that is the same
+    for every client.
+    """
+
+    def __init__(
+        self,
+        public: bool = False,
+        max_age: int = 0,
+        stale_while_revalidate: int = 0,
+        no_store: bool = False,
+        vary: Iterable[str] = ('Authorization', 'Cookie'),
+        shared_timeout: int = 0,
+    ) -> None:
+        if shared_timeout and not public:
+            raise ValueError('Only public responses can be shared between clients')
+        self.public = public
+        self.max_age = max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self.no_store = no_store
+        self.vary = tuple(vary)
+        self.shared_timeout = shared_timeout
+
+    @property
+    def header(self) -> str:
+        if self.no_store:
+            return 'no-store'
+        directives = ['public' if self.public else 'private']
+        if self.max_age:
+            directives.append(f'max-age={self.max_age}')
+        else:
+            directives.append('no-cache')
+        if self.stale_while_revalidate:
+            directives.append(f'stale-while-revalidate={self.stale_while_revalidate}')
+        return ', '.join(directives)
+
+    def apply(self, response) -> None:
+        response['Cache-Control'] = self.header
+        if self.vary:
+            patch_vary_headers(response, self.vary)
+
+
+# authenticated data: the client may keep it but must revalidate before reuse
+PRIVATE_REVALIDATE = CachePolicy()
+NO_STORE = CachePolicy(no_store=True, vary=())
+
+
+def get_request(args) -> Optional[Request]:
+    for arg in args:
+        if isinstance(arg, (HttpRequest, Request)):
+            return arg
+    return None
+
+
+def cache_policy(policy: CachePolicy):
+    """
+    Declare the cache policy of a view function or a DRF view method (action).
+
+    On DRF methods the shared cache is consulted inside the handler, i.e. after authentication and
+    permission checks, and stores ``response.data`` so any renderer can be used.
+    """
+    def decorator(view):
+        view_name = f'{view.__module__}.{view.__qualname__}'
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request = get_request(args)
+            shared = policy.shared_timeout and request is not None and request.method in ('GET', 'HEAD')
+
+            if shared:
+                key = SHARED_CACHE_KEY.format(view_name, hashlib.sha1(request.get_full_path().encode()).hexdigest())
+                data = cache.get(key)
+                if data is not None:
+                    SHARED_CACHE_REQUESTS.labels(view_name, 'hit').inc()
+                    response = Response(data)
+                    response.cache_policy = policy
+                    return response
+                SHARED_CACHE_REQUESTS.labels(view_name, 'miss').inc()
+
+            response = view(*args, **kwargs)
+            response.cache_policy = policy
+            if shared and isinstance(response, Response) and response.status_code == 200:
+                cache.set(key, response.data, policy.shared_timeout)
+            return response
+
+        wrapper.cache_policy = policy
+        return wrapper
+
+    return decorator
@@ -0,0 +1,145 @@
+"""
+Prometheus metrics for Celery tasks, collected from Celery signals.
+
+Publishers stamp every message with a ``published_at`` header, so workers can measure the time a task
+spent waiting in its queue. Each worker serves the metrics over HTTP on CELERY_METRICS_PORT. Prefork
+workers run tasks in child processes, so they must be started with PROMETHEUS_MULTIPROC_DIR set: the
+children write their samples to that directory and the exporter in the main process aggregates them.
+"""
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Optional
+
+from celery import signals
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess, start_http_server
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+TASK_QUEUE_WAIT = Histogram(
+    'celery_task_queue_wait_seconds',
+    'Time from publishing (or the ETA) to the start of execution',
+    ['task', 'queue'],
+    buckets=LATENCY_BUCKETS,
+)
+TASK_RUNTIME = Histogram(
+    'celery_task_runtime_seconds',
+    'Task execution time',
+    ['task', 'queue', 'state'],
+    buckets=LATENCY_BUCKETS,
+)
+TASK_RETRIED = Counter(
+    'celery_task_retried_total',
+    'Task retries by any cause',
+    ['task', 'queue'],
+)
+TASK_FAILED = Counter(
+    'celery_task_failed_total',
+    'Tasks finished with an exception',
+    ['task', 'queue', 'exception'],
+)
+TASKS_IN_FLIGHT = Gauge(
+    'celery_tasks_in_flight',
+    'Tasks being executed right now',
+    ['queue'],
+    multiprocess_mode='livesum',
+)
+
+PUBLISHED_AT_HEADER = 'published_at'
+
+_started = {}
+
+
+def get_queue(request) -> str:
+    delivery_info = getattr(request, 'delivery_info', None) or {}
+    return delivery_info.get('routing_key') or 'default'
+
+
+def queue_wait(request, now: float) -> Optional[float]:
+    """
+    Seconds the task waited in the queue, None if the message was not stamped.
+    """
+    published_at = getattr(request, PUBLISHED_AT_HEADER, None)
+    if published_at is None:
+        return None
+    ready_at = float(published_at)
+    # a task with a countdown/ETA is expected to wait until then
+    eta = getattr(request, 'eta', None)
+    if eta:
+        ready_at = max(ready_at, datetime.fromisoformat(eta).timestamp() if isinstance(eta, str) else eta.timestamp())
+    return max(0.0, now - ready_at)
+
+
+@signals.before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs) -> None:
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@signals.task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs) -> None:
+    queue = get_queue(task.request)
+    wait = queue_wait(task.request, time.time())
+    if wait is not None:
+        TASK_QUEUE_WAIT.labels(task.name, queue).observe(wait)
+    TASKS_IN_FLIGHT.labels(queue).inc()
+    _started[task_id] = time.monotonic()
+
+
+@signals.task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs) -> None:
+    started = _started.pop(task_id, None)
+    if started is None:
+        return
+    queue = get_queue(task.request)
+    TASKS_IN_FLIGHT.labels(queue).dec()
+    TASK_RUNTIME.labels(task.name, queue, state or 'UNKNOWN').observe(time.monotonic() - started)
+
+
+@signals.task_retry.connect
+def task_retried(sender=None, request=None, **kwargs) -> None:
+    TASK_RETRIED.labels(sender.name, get_queue(request)).inc()
+
+
+@signals.task_failure.connect
+def task_failed(sender=None, exception=None, **kwargs) -> None:
+    TASK_FAILED.labels(sender.name, get_queue(sender.request), type(exception).__name__).inc()
+
+
+@signals.worker_init.connect
+def start_metrics_server(**kwargs) -> None:
+    """
+    Serve worker metrics from the main worker process.
+    """
+    port = int(os.getenv('CELERY_METRICS_PORT', 0))
+    if not port:
+        return
+
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    start_http_server(port, registry=registry)
+    logger.info(f'Celery metrics are served on port {port}')
+
+
+def reset_multiproc_dir() -> None:
+    """
+    Remove samples of the previous worker run, they would be summed with the new ones.
+    """
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir and os.path.isdir(multiproc_dir):
+        for name in os.listdir(multiproc_dir):
+            os.remove(os.path.join(multiproc_dir, name))
+    elif multiproc_dir:
+        os.makedirs(multiproc_dir)
+
+
+@signals.worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs) -> None:
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,84 @@
+import threading
+import time
+from typing import Callable, Optional
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker that fails fast while a downstream service is degraded.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and every call is rejected
+    for ``recovery_timeout`` seconds. After that a single trial call is let through (half-open):
+    success closes the circuit, failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        on_state_change: Optional[Callable[[str, str], None]] = None,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.on_state_change = on_state_change
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        if state != self._state:
+            self._state = state
+            if self.on_state_change:
+                self.on_state_change(self.name, state)
+
+    def before_call(self) -> None:
+        """
+        Check whether a call may proceed, raise CircuitOpenError otherwise.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    raise CircuitOpenError(f'Circuit {self.name} is open')
+                self._set_state(self.HALF_OPEN)
+            if self._trial_in_flight:
+                raise CircuitOpenError(f'Circuit {self.name} is half-open, trial call in progress')
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        """
+        Register a successful call.
+        """
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        """
+        Register a failed call and open the circuit when the threshold is reached.
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
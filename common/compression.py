@@ -0,0 +1,100 @@
+import re
+import zlib
+from typing import AsyncIterator, Iterator, Optional
+
+import brotli
+from prometheus_client import Counter
+
+COMPRESSION_BYTES = Counter(
+    'http_compression_bytes_total',
+    'Response bytes before and after compression',
+    ['encoding', 'stage'],
+)
+
+ACCEPT_ENCODING_PART = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+
+# preferred first: brotli compresses JSON better at a comparable CPU cost
+SUPPORTED_ENCODINGS = ('br', 'gzip')
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Best supported encoding accepted by the client, taking q-values into account.
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_PART.fullmatch(part)
+        if not match:
+            continue
+        try:
+            accepted[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class Compressor:
+    """
+    Incremental gzip / brotli compressor.
+    """
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int) -> None:
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=brotli_quality)
+        else:
+            # wbits 16 + MAX_WBITS: gzip header and trailer
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) if self.encoding == 'br' else self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """
+        Emit everything compressed so far, so a streamed chunk reaches the client without waiting for the next.
+        """
+        return self.compressor.flush() if self.encoding == 'br' else self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.finish() if self.encoding == 'br' else self.compressor.flush(zlib.Z_FINISH)
+
+    def compress_all(self, data: bytes) -> bytes:
+        compressed = self.compress(data) + self.finish()
+        self.count(len(data), len(compressed))
+        return compressed
+
+    def compress_stream(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        size = compressed_size = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data = self.compress(chunk) + self.flush()
+            size += len(chunk)
+            compressed_size += len(data)
+            yield data
+        data = self.finish()
+        self.count(size, compressed_size + len(data))
+        yield data
+
+    async def compress_async_stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        size = compressed_size = 0
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            data = self.compress(chunk) + self.flush()
+            size += len(chunk)
+            compressed_size += len(data)
+            yield data
+        data = self.finish()
+        self.count(size, compressed_size + len(data))
+        yield data
+
+    def count(self, size: int, compressed_size: int) -> None:
+        COMPRESSION_BYTES.labels(self.encoding, 'in').inc(size)
+        COMPRESSION_BYTES.labels(self.encoding, 'out').inc(compressed_size)
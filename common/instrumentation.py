@@ -0,0 +1,147 @@
+"""
+Per-request accounting of time spent in the database and Redis.
+
+``install()`` (called from CommonConfig.ready) adds an execute wrapper to every database connection and wraps
+``Redis.execute_command`` / ``Pipeline.execute`` of both redis and redis.asyncio. The wrappers add to the RequestStats
+of the current request, kept in a context variable, and cost a single lookup outside of requests (Celery tasks,
+management commands).
+"""
+import time
+import functools
+from contextvars import ContextVar
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from django.db import connections
+from django.db.backends.signals import connection_created
+from prometheus_client import Histogram
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+ROUTE_LATENCY = Histogram(
+    'http_route_duration_seconds', 'Request latency by URL name', ['route', 'method'], buckets=TIME_BUCKETS,
+)
+ROUTE_DB_TIME = Histogram(
+    'http_route_db_seconds', 'Database time per request by URL name', ['route', 'method'], buckets=TIME_BUCKETS,
+)
+ROUTE_DB_QUERIES = Histogram(
+    'http_route_db_queries', 'Database queries per request by URL name', ['route', 'method'], buckets=COUNT_BUCKETS,
+)
+ROUTE_REDIS_TIME = Histogram(
+    'http_route_redis_seconds', 'Redis time per request by URL name', ['route', 'method'], buckets=TIME_BUCKETS,
+)
+ROUTE_REDIS_COMMANDS = Histogram(
+    'http_route_redis_commands', 'Redis commands per request by URL name', ['route', 'method'], buckets=COUNT_BUCKETS,
+)
+ROUTE_RENDER_TIME = Histogram(
+    'http_route_render_seconds', 'Response rendering (serialization) time by URL name', ['route', 'method'],
+    buckets=TIME_BUCKETS,
+)
+
+current_stats: ContextVar[Optional['RequestStats']] = ContextVar('current_request_stats', default=None)
+
+
+class RequestStats:
+    """
+    Database and Redis usage of one request.
+    """
+    __slots__ = ('db_queries', 'db_time', 'redis_commands', 'redis_time', 'render_started', 'render_time', 'token')
+
+    def __init__(self) -> None:
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+        self.render_started = 0.0
+        self.render_time = 0.0
+        self.token = None
+
+
+def start_request_stats(request) -> RequestStats:
+    """
+    Stats of the request, created on the first call. Middlewares sharing them may run in any order.
+    """
+    stats = getattr(request, 'stats', None)
+    if stats is None:
+        stats = request.stats = RequestStats()
+        stats.token = current_stats.set(stats)
+    return stats
+
+
+def finish_request_stats(request) -> None:
+    stats = getattr(request, 'stats', None)
+    if stats is not None and stats.token is not None:
+        current_stats.reset(stats.token)
+        stats.token = None
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def add_db_execute_wrapper(sender, connection, **kwargs) -> None:
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+def wrap_redis_call(method, count_commands):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        stats = current_stats.get()
+        if stats is None:
+            return method(self, *args, **kwargs)
+        commands = count_commands(self)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            stats.redis_commands += commands
+            stats.redis_time += time.perf_counter() - started
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def wrap_async_redis_call(method, count_commands):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        stats = current_stats.get()
+        if stats is None:
+            return await method(self, *args, **kwargs)
+        commands = count_commands(self)
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            stats.redis_commands += commands
+            stats.redis_time += time.perf_counter() - started
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def install() -> None:
+    connection_created.connect(add_db_execute_wrapper, dispatch_uid='common.instrumentation')
+    for connection in connections.all(initialized_only=True):
+        add_db_execute_wrapper(None, connection)
+    if not getattr(redis.Redis.execute_command, 'instrumented', False):
+        redis.Redis.execute_command = wrap_redis_call(redis.Redis.execute_command, lambda client: 1)
+        # a pipeline is one round trip for all queued commands
+        redis.client.Pipeline.execute = wrap_redis_call(
+            redis.client.Pipeline.execute, lambda pipeline: len(pipeline.command_stack),
+        )
+    if not getattr(aioredis.Redis.execute_command, 'instrumented', False):
+        aioredis.Redis.execute_command = wrap_async_redis_call(aioredis.Redis.execute_command, lambda client: 1)
+        aioredis.client.Pipeline.execute = wrap_async_redis_call(
+            aioredis.client.Pipeline.execute, lambda pipeline: len(pipeline.command_stack),
+        )
@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import Optional
+
+import redis
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+
+LOCK_ACQUIRE = Counter(
+    'task_lock_acquire_total',
+    'Task lock acquisition attempts',
+    ['name', 'outcome'],
+)
+LOCK_LOST = Counter(
+    'task_lock_lost_total',
+    'Task locks lost before release (lease expired or taken over)',
+    ['name'],
+)
+LOCK_HELD = Histogram(
+    'task_lock_held_seconds',
+    'Time a task lock was held',
+    ['name'],
+)
+
+
+@lru_cache(maxsize=None)
+def get_lock_redis() -> redis.StrictRedis:
+    """
+    Redis client for task locks and retry state, one per process.
+    """
+    return redis.StrictRedis.from_url(settings.LOCK_REDIS_URL)
+
+
+# Delete / extend the lock only while it still holds our value.
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """
+    Distributed lock on a single Redis key with fencing tokens and lease renewal.
+
+    Every successful acquisition gets a fencing token from a monotonically increasing counter
+    (``<key>:fence``, kept without expiry so tokens never go back), and protected writes carry it:
+    a resource rejects writes with a token lower than the last one it accepted, so a holder whose
+    lease has already expired cannot overwrite the work of the next one. While the lock is held,
+    a background thread extends the lease every ``ttl / 3`` seconds; if the lease cannot be extended,
+    ``lost`` is set and the holder must stop before its next unit of work (tasks check it between
+    batches). Release is a compare-and-delete, so a holder never deletes a lock acquired by someone else.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, ttl: float = 60.0, name: Optional[str] = None) -> None:
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.name = name or key
+        self.fencing_token: Optional[int] = None
+        self._value: Optional[str] = None
+        self._lost = threading.Event()
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+        self._acquired_at = 0.0
+        self._release_script = client.register_script(RELEASE_SCRIPT)
+        self._renew_script = client.register_script(RENEW_SCRIPT)
+
+    @property
+    def lost(self) -> bool:
+        return self._lost.is_set()
+
+    def acquire(self) -> bool:
+        """
+        Try to acquire the lock without waiting.
+        """
+        token = self.client.incr(f'{self.key}:fence')
+        value = f'{token}:{uuid.uuid4().hex}'
+        if not self.client.set(self.key, value, nx=True, px=int(self.ttl * 1000)):
+            LOCK_ACQUIRE.labels(self.name, 'busy').inc()
+            return False
+
+        LOCK_ACQUIRE.labels(self.name, 'acquired').inc()
+        self.fencing_token = token
+        self._value = value
+        self._acquired_at = time.monotonic()
+        self._lost.clear()
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew_loop, name=f'lock-renewer:{self.key}', daemon=True)
+        self._renewer.start()
+        return True
+
+    def release(self) -> bool:
+        """
+        Release the lock if it is still ours. Returns False if the lock was lost meanwhile.
+        """
+        if self._value is None:
+            return False
+
+        self._stop.set()
+        if self._renewer:
+            self._renewer.join()
+        released = bool(self._release_script(keys=[self.key], args=[self._value]))
+        if not released and not self.lost:
+            self._mark_lost()
+        LOCK_HELD.labels(self.name).observe(time.monotonic() - self._acquired_at)
+        self._value = None
+        return released
+
+    def _renew_loop(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renewed = self._renew_script(keys=[self.key], args=[self._value, int(self.ttl * 1000)])
+            except redis.RedisError:
+                # a transient error is retried on the next tick, the lease is still valid for a while
+                continue
+            if not renewed:
+                self._mark_lost()
+                return
+
+    def _mark_lost(self) -> None:
+        self._lost.set()
+        LOCK_LOST.labels(self.name).inc()
+
+    def __enter__(self) -> 'RedisLock':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
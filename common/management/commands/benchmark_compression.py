@@ -0,0 +1,52 @@
+import json
+import time
+import uuid
+import random
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from common.compression import Compressor
+
+
+class Command(BaseCommand):
+    help = 'Замер сжатия ответов: время CPU и экономия трафика на типичных JSON-страницах транзакций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Транзакций на странице')
+        parser.add_argument('--repeat', type=int, default=50, help='Повторов на каждый замер')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"page":>6} {"raw, B":>9} {"encoding":>9} {"out, B":>9} {"ratio":>6} {"us/resp":>9}')
+        for size in options['sizes']:
+            body = json.dumps(self.transactions_page(size)).encode()
+            for encoding, level in [('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 11)]:
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    compressed = Compressor(encoding, level, level).compress_all(body)
+                elapsed = (time.perf_counter() - started) / options['repeat']
+                self.stdout.write(
+                    f'{size:>6} {len(body):>9} {f"{encoding}-{level}":>9} {len(compressed):>9} '
+                    f'{len(compressed) / len(body):>6.2f} {elapsed * 1e6:>9.0f}'
+                )
+
+    def transactions_page(self, size: int) -> dict:
+        """Страница списка транзакций в формате TransactionSerializer"""
+
+        accounts = [str(uuid.uuid4()) for _ in range(20)]
+        created = datetime(2024, 1, 1)
+        results = []
+        for number in range(size):
+            created += timedelta(seconds=random.randint(1, 3600))
+            results.append({
+                'id': number + 1,
+                'created': created.isoformat() + 'Z',
+                'last_updated': created.isoformat() + 'Z',
+                'description': random.choice(['Перевод между своими счетами', 'Перевод контрагенту', 'Пополнение']),
+                'amount': f'{random.uniform(1, 100000):.2f}',
+                'transaction_type': random.choice(['debit', 'credit']),
+                'sender_account': random.choice(accounts),
+                'reciever_account': random.choice(accounts),
+                'currency': random.randint(1, 4),
+            })
+        return {'count': size, 'next': None, 'previous': None, 'results': results}
@@ -0,0 +1,63 @@
+import time
+import asyncio
+
+import aiohttp
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный замер HTTP-эндпоинта: запросов в секунду и перцентили задержки при заданной конкурентности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Адрес эндпоинта')
+        parser.add_argument('--method', default='GET', help='HTTP-метод')
+        parser.add_argument('--data', default=None, help='Тело запроса')
+        parser.add_argument('--header', action='append', default=[], help='Заголовок "Имя: значение", можно повторять')
+        parser.add_argument('--concurrency', type=int, default=32, help='Одновременных запросов')
+        parser.add_argument('--duration', type=float, default=20, help='Длительность замера, секунд')
+        parser.add_argument('--warmup', type=float, default=3, help='Прогрев перед замером, секунд')
+
+    def handle(self, *args, **options):
+        headers = dict(header.split(': ', 1) for header in options['header'])
+        if options['warmup']:
+            asyncio.run(self.load(options, headers, options['warmup']))
+        latencies, errors, elapsed = asyncio.run(self.load(options, headers, options['duration']))
+
+        latencies.sort()
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f'{len(latencies) / elapsed:.0f} rps, {len(latencies)} ok, {errors} errors, '
+            f'p50 {percentile(0.5):.1f} ms, p90 {percentile(0.9):.1f} ms, p99 {percentile(0.99):.1f} ms'
+        )
+
+    async def load(self, options: dict, headers: dict, duration: float) -> tuple:
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker(session):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    async with session.request(options['method'], options['url'], data=options['data']) as response:
+                        await response.read()
+                        if response.status >= 400:
+                            errors += 1
+                            continue
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        connector = aiohttp.TCPConnector(limit=options['concurrency'])
+        async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(session) for _ in range(options['concurrency'])))
+            elapsed = time.perf_counter() - started
+        return latencies, errors, elapsed
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from common.retention import RetentionPolicy, RetentionPurger
+
+
+class Command(BaseCommand):
+    help = 'Пакетное удаление результатов задач Celery, накопленных в базе (django_celery_results)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=0, help='Удалять результаты старше N дней')
+        parser.add_argument('--batch-size', type=int, help='Размер пачки удаления')
+        parser.add_argument('--target-load', type=float, help='Доля времени, которую удаление может занимать в БД')
+
+    def handle(self, *args, **options):
+        overrides = {'max_runtime': float('inf')}
+        if options['batch_size']:
+            overrides['batch_size'] = options['batch_size']
+        if options['target_load']:
+            overrides['target_load'] = options['target_load']
+
+        policy = RetentionPolicy('django_celery_results.TaskResult', 'date_done', timedelta(days=options['older_than']))
+        report = RetentionPurger.from_settings(**overrides).purge([policy])[policy.model]
+        self.stdout.write(
+            f'Удалено результатов: {report["deleted"]} за {report["seconds"]} с ({report["rows_per_second"]} строк/с)'
+        )
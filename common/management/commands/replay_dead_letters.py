@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from backend_exchanger.celery import app
+from common.models import DeadLetterTask
+
+
+class Command(BaseCommand):
+    help = 'Повторная отправка задач из dead-letter queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task', help='Имя задачи, например finance.tasks.update_exchange_rates')
+        parser.add_argument('--id', type=int, nargs='+', dest='ids', help='Id записей dead-letter queue')
+        parser.add_argument('--limit', type=int, default=100, help='Максимум задач за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать задачи, не отправляя их')
+
+    def handle(self, *args, **options):
+        queryset = DeadLetterTask.objects.filter(status=DeadLetterTask.NEW).order_by('id')
+        if options['task']:
+            queryset = queryset.filter(task_name=options['task'])
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+
+        replayed = 0
+        with transaction.atomic():
+            for dead_letter in queryset.select_for_update(skip_locked=True)[:options['limit']]:
+                self.stdout.write(str(dead_letter))
+                if options['dry_run']:
+                    continue
+                # маршрут берется из task_routes, задача получает новый id и заново проходит политику повторов
+                app.send_task(dead_letter.task_name, args=dead_letter.args, kwargs=dead_letter.kwargs)
+                dead_letter.status = DeadLetterTask.REPLAYED
+                dead_letter.replayed_at = timezone.now()
+                dead_letter.save(update_fields=['status', 'replayed_at', 'last_updated'])
+                replayed += 1
+
+        self.stdout.write(f'Отправлено повторно: {replayed}')
@@ -1,63 +1,350 @@
 import time
+import math
+import types
+import random
 import logging
+from typing import Optional
+
+import django.contrib.auth.middleware
+import django.contrib.messages.middleware
+import django.contrib.sessions.middleware
+import django.middleware.clickjacking
+import django.middleware.common
+import django.middleware.csrf
+import django.middleware.http
+import django.middleware.security
+import django_prometheus.middleware
+import redis
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
-from django.core.cache import cache
-from django.http import HttpResponseTooManyRequests
+from django.utils.functional import SimpleLazyObject, empty
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from common.cache_policy import NO_STORE, PRIVATE_REVALIDATE
+from common.compression import Compressor, choose_encoding
+from common.instrumentation import (
+    ROUTE_DB_QUERIES, ROUTE_DB_TIME, ROUTE_LATENCY, ROUTE_REDIS_COMMANDS, ROUTE_REDIS_TIME, ROUTE_RENDER_TIME,
+    finish_request_stats, start_request_stats,
+)
+from common.ratelimit import (
+    RATE_LIMIT_DECISIONS, RateLimitRule, TokenBucketLimiter, get_async_rate_limit_redis, get_client_ip,
+    get_rate_limit_redis,
+)
+from whitenoise.middleware import WhiteNoiseMiddleware
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+
+
+class AsyncCapableMiddleware(MiddlewareMixin):
+    """
+    MiddlewareMixin whose hooks run in the event loop under ASGI.
+
+    In async mode MiddlewareMixin calls every hook through sync_to_async, a thread hop per hook per request.
+    Hooks of subclasses are called directly unless listed in ``thread_hooks``, so they must not block;
+    a hook that needs I/O either has a coroutine ``aprocess_request`` counterpart used instead of
+    ``process_request`` or stays in ``thread_hooks``.
+    """
+    thread_hooks = ()
 
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if iscoroutinefunction(self):
+            # the handler collects these hooks after construction and would wrap sync ones in sync_to_async
+            for name in ('process_view', 'process_template_response'):
+                hook = getattr(self, name, None)
+                if hook is not None and name not in self.thread_hooks:
+                    setattr(self, name, self.in_event_loop(hook))
 
-class RequestLoggingMiddleware(MiddlewareMixin):
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'aprocess_request'):
+            response = await self.aprocess_request(request)
+        elif hasattr(self, 'process_request'):
+            response = await self.call_hook('process_request', request)
+        response = response or await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = await self.call_hook('process_response', request, response)
+        return response
+
+    async def call_hook(self, name: str, *args):
+        if name in self.thread_hooks:
+            return await sync_to_async(getattr(self, name), thread_sensitive=True)(*args)
+        return getattr(self, name)(*args)
+
+    def in_event_loop(self, hook):
+        # a bound method: the handler names the middleware by ``hook.__self__`` in errors
+        async def wrapper(middleware, *args):
+            return hook(*args)
+        return types.MethodType(wrapper, self)
+
+
+def async_capable(middleware_class, thread_hooks=()):
+    """
+    Variant of a third-party MiddlewareMixin middleware for the async stack, see AsyncCapableMiddleware.
     """
-    Middleware for logging request information.
+    return type(
+        middleware_class.__name__,
+        (AsyncCapableMiddleware, middleware_class),
+        {'__module__': __name__, 'thread_hooks': tuple(thread_hooks)},
+    )
+
+
+# Django and django-prometheus middlewares. Sessions and messages are created lazily in process_request,
+# but process_response may save the session, so only that hook is run in a thread.
+PrometheusBeforeMiddleware = async_capable(django_prometheus.middleware.PrometheusBeforeMiddleware)
+PrometheusAfterMiddleware = async_capable(django_prometheus.middleware.PrometheusAfterMiddleware)
+SecurityMiddleware = async_capable(django.middleware.security.SecurityMiddleware)
+SessionMiddleware = async_capable(django.contrib.sessions.middleware.SessionMiddleware, ['process_response'])
+CommonMiddleware = async_capable(django.middleware.common.CommonMiddleware)
+ConditionalGetMiddleware = async_capable(django.middleware.http.ConditionalGetMiddleware)
+CsrfViewMiddleware = async_capable(django.middleware.csrf.CsrfViewMiddleware)
+AuthenticationMiddleware = async_capable(django.contrib.auth.middleware.AuthenticationMiddleware)
+MessageMiddleware = async_capable(django.contrib.messages.middleware.MessageMiddleware, ['process_response'])
+XFrameOptionsMiddleware = async_capable(django.middleware.clickjacking.XFrameOptionsMiddleware)
+
+
+def get_user_id(request) -> Optional[int]:
+    """
+    Id of the authenticated user, if authentication has already happened.
+
+    A lazy ``request.user`` nobody asked for is left alone: evaluating it queries the session, which is not
+    allowed in the event loop and not worth a query just for logging.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return None
+    return user.pk if user.is_authenticated else None
+
+
+class RequestLoggingMiddleware(AsyncCapableMiddleware):
+    """
+    JSON access log with sampling.
+
+    Errors (status >= ACCESS_LOG_ERROR_STATUS) and slow requests (>= ACCESS_LOG_SLOW_MS) are always logged,
+    the rest with probability ACCESS_LOG_SAMPLE_RATE. The sampling decision is made before the entry is built,
+    so a skipped request costs only the timers. Entries carry the user, route name, query count and DB time
+    and are written by the background handler configured for the ``access`` logger.
     """
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.sample_rate = settings.ACCESS_LOG_SAMPLE_RATE
+        self.slow_ms = settings.ACCESS_LOG_SLOW_MS
+        self.error_status = settings.ACCESS_LOG_ERROR_STATUS
+
     def process_request(self, request):
-        request.start_time = time.time()
+        request.start_time = time.perf_counter()
+        start_request_stats(request)
 
     def process_response(self, request, response):
-        if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            logger.info(
-                f"Request: {request.method} {request.path} "
-                f"Status: {response.status_code} "
-                f"Duration: {duration:.2f}s"
-            )
+        if not hasattr(request, 'start_time'):
+            return response
+
+        duration_ms = (time.perf_counter() - request.start_time) * 1000
+        stats = request.stats
+        finish_request_stats(request)
+
+        status_code = response.status_code
+        if status_code < self.error_status and duration_ms < self.slow_ms and random.random() >= self.sample_rate:
+            return response
+
+        resolver_match = request.resolver_match
+        access_logger.log(
+            logging.WARNING if status_code >= 500 else logging.INFO,
+            'request',
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'route': resolver_match.view_name if resolver_match else None,
+                'status': status_code,
+                'duration_ms': round(duration_ms, 2),
+                'db_queries': stats.db_queries,
+                'db_ms': round(stats.db_time * 1000, 2),
+                'redis_commands': stats.redis_commands,
+                'redis_ms': round(stats.redis_time * 1000, 2),
+                'user_id': get_user_id(request),
+                'ip': request.META.get('REMOTE_ADDR'),
+                'sampled': status_code < self.error_status and duration_ms < self.slow_ms,
+            },
+        )
         return response
 
 
-class RateLimitMiddleware(MiddlewareMixin):
+class RouteMetricsMiddleware(AsyncCapableMiddleware):
     """
-    Middleware for rate limiting requests.
+    Latency, DB, Redis and rendering time per resolved URL name as Prometheus histograms.
+
+    Labels are the URL pattern name (e.g. ``Transaction-transfer-funds``) and the HTTP method, both bounded
+    by the URLconf; unresolved requests share one label.
     """
+    METHODS = {'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
     def process_request(self, request):
-        if not hasattr(request, 'user') or not request.user.is_authenticated:
+        request.metrics_start_time = time.perf_counter()
+        start_request_stats(request)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (serialized to JSON) after the view returns
+        stats = request.stats
+        stats.render_started = time.perf_counter()
+        response.add_post_render_callback(self.rendered(stats))
+        return response
+
+    @staticmethod
+    def rendered(stats):
+        def callback(response):
+            stats.render_time = time.perf_counter() - stats.render_started
+        return callback
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'metrics_start_time'):
+            return response
+
+        duration = time.perf_counter() - request.metrics_start_time
+        stats = request.stats
+        finish_request_stats(request)
+
+        resolver_match = request.resolver_match
+        route = (resolver_match.view_name or resolver_match.route) if resolver_match else '<unresolved>'
+        method = request.method if request.method in self.METHODS else 'other'
+
+        ROUTE_LATENCY.labels(route, method).observe(duration)
+        ROUTE_DB_TIME.labels(route, method).observe(stats.db_time)
+        ROUTE_DB_QUERIES.labels(route, method).observe(stats.db_queries)
+        ROUTE_REDIS_TIME.labels(route, method).observe(stats.redis_time)
+        ROUTE_REDIS_COMMANDS.labels(route, method).observe(stats.redis_commands)
+        ROUTE_RENDER_TIME.labels(route, method).observe(stats.render_time)
+        return response
+
+
+class RateLimitMiddleware(AsyncCapableMiddleware):
+    """
+    Per-route token bucket rate limiting in Redis.
+
+    Rules from RATE_LIMIT_RULES are matched in order, the first match wins. Clients are identified by
+    user id (session or a valid JWT, decoded without a DB query since DRF authenticates only in the view)
+    or by IP. Responses carry RateLimit-Limit / RateLimit-Remaining /
+    RateLimit-Reset headers, rejections also Retry-After. If Redis is unavailable requests are let through.
+    """
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.rules = [RateLimitRule(**rule) for rule in settings.RATE_LIMIT_RULES]
+        self.limiter = None
+
+    def get_limiter(self) -> TokenBucketLimiter:
+        if self.limiter is None:
+            self.limiter = TokenBucketLimiter(get_rate_limit_redis())
+        return self.limiter
+
+    def get_rule(self, request) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.matches(request.method, request.path):
+                return rule if rule.rate else None
+        return None
+
+    def get_identity(self, request) -> str:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return self.get_credentials_identity(request)
+
+    async def aget_identity(self, request) -> str:
+        # the session is only loaded when there is one, API clients authenticate with tokens
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and hasattr(request, 'auser'):
+            user = await request.auser()
+            if user.is_authenticated:
+                return f'user:{user.pk}'
+        return self.get_credentials_identity(request)
+
+    def get_credentials_identity(self, request) -> str:
+        auth_type, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if auth_type == 'Bearer' and credentials:
+            try:
+                return f'user:{AccessToken(credentials)[api_settings.USER_ID_CLAIM]}'
+            except (TokenError, KeyError):
+                pass
+
+        # DRF tokens cannot be checked without a DB query and random strings would get fresh buckets
+        return f'ip:{get_client_ip(request)}'
+
+    def process_request(self, request):
+        rule = self.get_rule(request)
+        if rule is None:
             return None
 
-        # Get the client IP
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
+        key = f'ratelimit:{rule.name}:{self.get_identity(request)}'
+        blocked_for = self.get_limiter().blocked_for(key)
+        if blocked_for:
+            return self.rejected_locally(rule, blocked_for)
+
+        try:
+            result = self.get_limiter().hit(key, rule)
+        except redis.RedisError as error:
+            return self.unavailable(rule, error)
+        return self.decided(request, rule, *result)
+
+    async def aprocess_request(self, request):
+        rule = self.get_rule(request)
+        if rule is None:
+            return None
+
+        key = f'ratelimit:{rule.name}:{await self.aget_identity(request)}'
+        blocked_for = self.get_limiter().blocked_for(key)
+        if blocked_for:
+            return self.rejected_locally(rule, blocked_for)
 
-        # Create a unique key for the user/IP
-        key = f'rate_limit:{ip}'
+        try:
+            result = await self.get_limiter().ahit(get_async_rate_limit_redis(), key, rule)
+        except redis.RedisError as error:
+            return self.unavailable(rule, error)
+        return self.decided(request, rule, *result)
 
-        # Get the current count
-        count = cache.get(key, 0)
+    def rejected_locally(self, rule: RateLimitRule, blocked_for: float) -> JsonResponse:
+        RATE_LIMIT_DECISIONS.labels(rule.name, 'local_reject').inc()
+        return self.throttled(rule, blocked_for)
 
-        # Check if the rate limit is exceeded
-        if count >= settings.RATE_LIMIT:
-            return HttpResponseTooManyRequests()
+    def unavailable(self, rule: RateLimitRule, error: redis.RedisError) -> None:
+        RATE_LIMIT_DECISIONS.labels(rule.name, 'error').inc()
+        logger.warning(f'Rate limiter is unavailable: {error}')
+        return None
 
-        # Increment the count
-        cache.set(key, count + 1, settings.RATE_LIMIT_WINDOW)
+    def decided(self, request, rule: RateLimitRule, allowed: bool, remaining: int, retry_after: float, reset: float):
+        if not allowed:
+            RATE_LIMIT_DECISIONS.labels(rule.name, 'rejected').inc()
+            return self.throttled(rule, retry_after, reset)
 
+        RATE_LIMIT_DECISIONS.labels(rule.name, 'allowed').inc()
+        request.rate_limit = (rule, remaining, reset)
         return None
 
+    def process_response(self, request, response):
+        if hasattr(request, 'rate_limit'):
+            rule, remaining, reset = request.rate_limit
+            self.set_headers(response, rule, remaining, reset)
+        return response
+
+    def throttled(self, rule: RateLimitRule, retry_after: float, reset: Optional[float] = None) -> JsonResponse:
+        wait = max(1, math.ceil(retry_after))
+        response = JsonResponse(
+            {'detail': f'Request was throttled. Expected available in {wait} seconds.'},
+            status=429,
+        )
+        response['Retry-After'] = str(wait)
+        self.set_headers(response, rule, 0, reset if reset is not None else retry_after)
+        return response
+
+    def set_headers(self, response, rule: RateLimitRule, remaining: int, reset: float) -> None:
+        response['RateLimit-Limit'] = str(rule.capacity)
+        response['RateLimit-Remaining'] = str(remaining)
+        response['RateLimit-Reset'] = str(math.ceil(reset))
+
 
-class SecurityHeadersMiddleware(MiddlewareMixin):
+class SecurityHeadersMiddleware(AsyncCapableMiddleware):
     """
     Middleware for adding security headers to responses.
     """
@@ -90,15 +377,116 @@ class ExceptionLoggingMiddleware(MiddlewareMixin):
         return None
 
 
-class CacheControlMiddleware(MiddlewareMixin):
+class CacheControlMiddleware(AsyncCapableMiddleware):
     """
-    Middleware for adding cache control headers.
+    Cache-Control by the cache policy declared on the view (common.cache_policy.cache_policy).
+
+    Views without a policy get the safe defaults: successful GET/HEAD responses are private and must be
+    revalidated (ConditionalGetMiddleware answers revalidation with 304 by ETag), everything else is
+    no-store. Headers already set by the view itself (never_cache, cache_page, admin) are kept.
     """
+    CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 304, 308}
+
     def process_response(self, request, response):
-        if request.method == 'GET':
-            response['Cache-Control'] = 'public, max-age=31536000'
-        else:
-            response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        policy = getattr(response, 'cache_policy', None)
+        if policy is None and response.has_header('Cache-Control'):
+            return response
+
+        cacheable = request.method in ('GET', 'HEAD') and response.status_code in self.CACHEABLE_STATUSES
+        if not cacheable:
+            policy = NO_STORE
+        elif policy is None:
+            policy = PRIVATE_REVALIDATE
+
+        policy.apply(response)
+        if policy.no_store:
             response['Pragma'] = 'no-cache'
             response['Expires'] = '0'
-        return response 
\ No newline at end of file
+        return response
+
+
+class CompressionMiddleware(AsyncCapableMiddleware):
+    """
+    Brotli / gzip compression negotiated by Accept-Encoding, including streaming responses chunk by chunk.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE, responses that already have a Content-Encoding and
+    content types that are compressed by themselves (COMPRESSION_SKIP_TYPES) are sent as is.
+    """
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.min_size = settings.COMPRESSION_MIN_SIZE
+        self.gzip_level = settings.COMPRESSION_GZIP_LEVEL
+        self.brotli_quality = settings.COMPRESSION_BROTLI_QUALITY
+        self.skip_types = tuple(settings.COMPRESSION_SKIP_TYPES)
+
+    def should_compress(self, response) -> bool:
+        """
+        Whether the response body is worth compressing at all, before looking at Accept-Encoding.
+        """
+        if response.has_header('Content-Encoding'):
+            return False
+        if response.get('Content-Type', '').startswith(self.skip_types):
+            return False
+        return response.streaming or len(response.content) >= self.min_size
+
+    def process_response(self, request, response):
+        if not self.should_compress(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressor = Compressor(encoding, self.gzip_level, self.brotli_quality)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compressor.compress_async_stream(response.streaming_content)
+            else:
+                response.streaming_content = compressor.compress_stream(response.streaming_content)
+            # the length of a compressed stream is not known in advance
+            del response['Content-Length']
+        else:
+            compressed = compressor.compress_all(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(response.content))
+
+        # the compressed body is a different representation: a strong ETag must not match the original one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that can run in async mode.
+
+    WhiteNoise is sync-only: under ASGI Django would call it in a thread and run the rest of the stack,
+    views included, through async_to_sync. Looking a file up is a dict lookup (a stat with autorefresh
+    in development) and serving only opens the file, so both are done in the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
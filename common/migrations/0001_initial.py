@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('task_name', models.CharField(db_index=True, max_length=255, verbose_name='Задача')),
+                ('task_id', models.CharField(max_length=255, verbose_name='Id задачи')),
+                ('args', models.JSONField(default=list, verbose_name='Позиционные аргументы')),
+                ('kwargs', models.JSONField(default=dict, verbose_name='Именованные аргументы')),
+                ('exception', models.CharField(max_length=255, verbose_name='Исключение')),
+                ('error', models.TextField(verbose_name='Ошибка')),
+                ('traceback', models.TextField(blank=True, verbose_name='Трассировка')),
+                ('retries', models.PositiveSmallIntegerField(default=0, verbose_name='Количество повторов')),
+                ('status', models.CharField(choices=[('new', 'Ожидает разбора'), ('replayed', 'Отправлена повторно')], default='new', max_length=20, verbose_name='Статус')),
+                ('replayed_at', models.DateTimeField(blank=True, null=True, verbose_name='Время повторной отправки')),
+            ],
+            options={
+                'verbose_name': 'Задача в dead-letter queue',
+                'verbose_name_plural': 'Dead-letter queue',
+            },
+        ),
+    ]
@@ -7,3 +7,33 @@ class AbstarctBaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class DeadLetterTask(AbstarctBaseModel):
+    """Задача Celery, исчерпавшая повторы (dead-letter queue)"""
+
+    NEW = 'new'
+    REPLAYED = 'replayed'
+
+    STATUS = (
+        (NEW, 'Ожидает разбора'),
+        (REPLAYED, 'Отправлена повторно'),
+    )
+
+    task_name = models.CharField(verbose_name='Задача', max_length=255, db_index=True)
+    task_id = models.CharField(verbose_name='Id задачи', max_length=255)
+    args = models.JSONField(verbose_name='Позиционные аргументы', default=list)
+    kwargs = models.JSONField(verbose_name='Именованные аргументы', default=dict)
+    exception = models.CharField(verbose_name='Исключение', max_length=255)
+    error = models.TextField(verbose_name='Ошибка')
+    traceback = models.TextField(verbose_name='Трассировка', blank=True)
+    retries = models.PositiveSmallIntegerField(verbose_name='Количество повторов', default=0)
+    status = models.CharField(verbose_name='Статус', choices=STATUS, max_length=20, default=NEW)
+    replayed_at = models.DateTimeField(verbose_name='Время повторной отправки', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Задача в dead-letter queue'
+        verbose_name_plural = 'Dead-letter queue'
+
+    def __str__(self) -> str:
+        return f'{self.id} | task: {self.task_name} | exception: {self.exception} | status: {self.status}'
@@ -0,0 +1,170 @@
+import re
+import time
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from prometheus_client import Counter
+from redis.commands.core import AsyncScript
+
+from common.aio import per_event_loop
+
+RATE_LIMIT_DECISIONS = Counter(
+    'rate_limit_decisions_total',
+    'Rate limiter decisions',
+    ['rule', 'decision'],
+)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def get_client_ip(request) -> str:
+    """
+    Client address as seen by the outermost of RATE_LIMIT_TRUSTED_PROXIES proxies. Each proxy appends
+    its peer to X-Forwarded-For, so entries left of that are set by the client and cannot be trusted.
+    """
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+@lru_cache(maxsize=None)
+def get_rate_limit_redis() -> redis.StrictRedis:
+    """
+    Redis client for rate limit buckets, one per process.
+    """
+    return redis.StrictRedis.from_url(settings.RATE_LIMIT_REDIS_URL)
+
+
+@per_event_loop
+def get_async_rate_limit_redis() -> aioredis.Redis:
+    """
+    redis.asyncio client for rate limit buckets, one per event loop.
+    """
+    return aioredis.from_url(settings.RATE_LIMIT_REDIS_URL)
+
+
+# Token bucket in one round trip. The bucket is refilled for the time passed since the last request,
+# then one token is taken if available. The key expires once the bucket would be full again, so idle
+# clients leave nothing behind. Returns {allowed, tokens left, ms until a token is available, ms until full}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_per_ms)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+
+local full_in = math.ceil((capacity - tokens) / refill_per_ms)
+redis.call('pexpire', KEYS[1], full_in + 1000)
+
+local retry_in = 0
+if allowed == 0 then
+    retry_in = math.ceil((1 - tokens) / refill_per_ms)
+end
+return {allowed, math.floor(tokens), retry_in, full_in}
+"""
+
+
+class RateLimitRule:
+    """
+    Limit for requests whose path matches ``pattern`` and method is in ``methods``.
+
+    ``rate`` is ``'<count>/<s|m|h|d>'``: the bucket refills at that rate and holds ``burst`` tokens
+    (``count`` by default). A rule with ``rate=None`` exempts matching requests.
+    """
+
+    def __init__(self, name: str, pattern: str, methods: List[str], rate: Optional[str], burst: Optional[int] = None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.methods = {method.upper() for method in methods}
+        self.rate = rate
+        if rate:
+            count, period = rate.split('/')
+            self.refill_per_second = int(count) / PERIODS[period[0]]
+            self.capacity = burst or int(count)
+
+    def matches(self, method: str, path: str) -> bool:
+        return method in self.methods and bool(self.pattern.match(path))
+
+
+class TokenBucketLimiter:
+    """
+    Redis token bucket limiter with a local cache of blocked clients.
+
+    A client rejected by Redis is remembered in process memory until its next token is due, so a
+    client hammering the API is rejected without a Redis round trip.
+    """
+
+    # blocked clients kept in memory, expired entries are dropped when the limit is reached
+    max_blocked = 10000
+
+    def __init__(self, client: redis.Redis) -> None:
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        # not bound to a client: redis.asyncio clients are per event loop and passed to ``ahit``
+        self.async_script = AsyncScript(None, TOKEN_BUCKET_SCRIPT.encode())
+        self.blocked = {}
+        self.blocked_lock = threading.Lock()
+
+    def blocked_for(self, key: str) -> float:
+        """
+        Seconds the client is still known to be blocked, 0 if it is not.
+        """
+        blocked_until = self.blocked.get(key)
+        if blocked_until is None:
+            return 0
+        remaining = blocked_until - time.monotonic()
+        if remaining <= 0:
+            self.blocked.pop(key, None)
+            return 0
+        return remaining
+
+    def hit(self, key: str, rule: RateLimitRule) -> Tuple[bool, int, float, float]:
+        """
+        Take a token: returns (allowed, remaining tokens, seconds until retry, seconds until the bucket is full).
+        """
+        result = self.script(keys=[key], args=[rule.capacity, rule.refill_per_second / 1000])
+        return self.taken(key, *result)
+
+    async def ahit(self, client: aioredis.Redis, key: str, rule: RateLimitRule) -> Tuple[bool, int, float, float]:
+        """
+        ``hit`` over a redis.asyncio client.
+        """
+        result = await self.async_script(
+            keys=[key], args=[rule.capacity, rule.refill_per_second / 1000], client=client,
+        )
+        return self.taken(key, *result)
+
+    def taken(
+        self, key: str, allowed: int, remaining: int, retry_in: int, full_in: int,
+    ) -> Tuple[bool, int, float, float]:
+        """
+        Script result in seconds; a rejected client is remembered as blocked.
+        """
+        retry_after = retry_in / 1000
+        if not allowed:
+            self.block(key, retry_after)
+        return bool(allowed), int(remaining), retry_after, full_in / 1000
+
+    def block(self, key: str, seconds: float) -> None:
+        with self.blocked_lock:
+            now = time.monotonic()
+            if len(self.blocked) >= self.max_blocked:
+                self.blocked = {k: until for k, until in self.blocked.items() if until > now}
+            self.blocked[key] = now + seconds
@@ -0,0 +1,261 @@
+import time
+import logging
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from prometheus_client import Counter, Histogram
+
+from common.locks import get_lock_redis
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DELETED = Counter(
+    'retention_deleted_rows_total',
+    'Rows deleted by the retention engine',
+    ['model'],
+)
+RETENTION_BATCH_SECONDS = Histogram(
+    'retention_batch_duration_seconds',
+    'Duration of one retention delete batch',
+    ['model'],
+)
+
+CHECKPOINT_KEY = 'retention:checkpoint:{}'
+
+# Write (or delete, for an empty value) the checkpoint unless a newer fencing token has written it.
+FENCED_WRITE_SCRIPT = """
+local stored = tonumber(redis.call('get', KEYS[2]))
+if stored and stored > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('set', KEYS[2], ARGV[1])
+if ARGV[2] == '' then
+    redis.call('del', KEYS[1])
+else
+    redis.call('set', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class RetentionPolicy:
+    """
+    How long rows of a model are kept.
+
+    Rows whose ``date_field`` is older than ``max_age`` are deleted. ``max_age`` of zero deletes
+    everything up to now (e.g. sessions by ``expire_date``); ``None`` disables the policy.
+    ``filters`` restricts the policy to rows with the given field values (e.g. only processed events).
+    """
+
+    def __init__(
+        self, model: str, date_field: str, max_age: Optional[timedelta], filters: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.model = model
+        self.date_field = date_field
+        self.max_age = max_age
+        self.filters = filters or {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age is not None
+
+    def get_model(self):
+        return apps.get_model(self.model)
+
+    def cutoff(self):
+        return timezone.now() - self.max_age
+
+
+def days(value: int) -> Optional[timedelta]:
+    """
+    Retention period from a number of days, 0 keeps rows forever.
+    """
+    return timedelta(days=value) if value else None
+
+
+def get_retention_policies() -> List[RetentionPolicy]:
+    return [
+        RetentionPolicy('sessions.Session', 'expire_date', timedelta(0)),
+        RetentionPolicy('finance.ApplicationLog', 'created', days(settings.RETENTION_APPLICATION_LOG_DAYS)),
+        RetentionPolicy('django_celery_results.TaskResult', 'date_done', days(settings.RETENTION_TASK_RESULT_DAYS)),
+        RetentionPolicy('finance.Transaction', 'created', days(settings.RETENTION_TRANSACTION_DAYS)),
+        RetentionPolicy(
+            'finance.OutboxMessage', 'sent_at', days(settings.RETENTION_OUTBOX_MESSAGE_DAYS), {'status': 'sent'},
+        ),
+        RetentionPolicy(
+            'finance.WebhookEvent', 'created', days(settings.RETENTION_WEBHOOK_EVENT_DAYS), {'status': 'processed'},
+        ),
+    ]
+
+
+class RetentionPurger:
+    """
+    Deletes expired rows in primary-key ordered batches.
+
+    Each batch is a single ``DELETE ... WHERE pk IN (SELECT ... ORDER BY pk LIMIT n) RETURNING pk``,
+    so no statement holds locks for long and no rows are loaded into Python. After a batch the
+    purger sleeps in proportion to the batch duration to keep its share of DB time at ``target_load``
+    (0.25 means at most a quarter of wall time is spent in deletes). The last deleted key is stored
+    in Redis as a checkpoint: a run stopped by ``max_runtime`` or by ``should_stop`` resumes from it
+    on the next call, and a policy that has been fully purged starts from the beginning again.
+
+    With a ``fencing_token`` (the task lock's), checkpoint writes are fenced: a write with a token
+    lower than the last accepted one is rejected, and the purger stops as ``stale``.
+    """
+
+    def __init__(
+        self, batch_size: int, target_load: float, max_runtime: float, fencing_token: Optional[int] = None,
+    ) -> None:
+        self.batch_size = batch_size
+        self.target_load = target_load
+        self.max_runtime = max_runtime
+        self.fencing_token = fencing_token
+        self.stale = False
+
+    @classmethod
+    def from_settings(cls, **overrides) -> 'RetentionPurger':
+        options = {
+            'batch_size': settings.RETENTION_BATCH_SIZE,
+            'target_load': settings.RETENTION_TARGET_LOAD,
+            'max_runtime': settings.RETENTION_MAX_RUNTIME,
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    def purge(
+        self, policies: List[RetentionPolicy], should_stop: Callable[[], bool] = lambda: False,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Apply the policies one after another within ``max_runtime``, returns a report per model.
+        ``should_stop`` is checked before every batch, e.g. to stop when the task lock is lost.
+        """
+        deadline = time.monotonic() + self.max_runtime
+        report = {}
+        for policy in policies:
+            if not policy.enabled:
+                continue
+            if time.monotonic() >= deadline or should_stop() or self.stale:
+                break
+            report[policy.model] = self.purge_model(policy, deadline, should_stop)
+        return report
+
+    def purge_model(
+        self, policy: RetentionPolicy, deadline: float, should_stop: Callable[[], bool] = lambda: False,
+    ) -> Dict[str, Any]:
+        model = policy.get_model()
+        cutoff = policy.cutoff()
+        checkpoint = self.load_checkpoint(policy)
+        deleted = 0
+        complete = False
+        started = time.monotonic()
+
+        while time.monotonic() < deadline and not should_stop() and not self.stale:
+            batch_started = time.monotonic()
+            keys = self.delete_batch(model, policy.date_field, cutoff, checkpoint, policy.filters)
+            duration = time.monotonic() - batch_started
+            RETENTION_BATCH_SECONDS.labels(policy.model).observe(duration)
+
+            if keys:
+                deleted += len(keys)
+                checkpoint = max(keys)
+                RETENTION_DELETED.labels(policy.model).inc(len(keys))
+            if len(keys) < self.batch_size:
+                complete = True
+                break
+            if not self.save_checkpoint(policy, checkpoint):
+                break
+            pause = duration * (1 - self.target_load) / self.target_load
+            time.sleep(max(0.0, min(pause, deadline - time.monotonic())))
+
+        if complete:
+            self.clear_checkpoint(policy)
+        elif not self.stale:
+            self.save_checkpoint(policy, checkpoint)
+
+        elapsed = time.monotonic() - started
+        result = {
+            'deleted': deleted,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(deleted / elapsed, 1) if elapsed else 0.0,
+            'complete': complete,
+        }
+        logger.info(f'Retention {policy.model}: {result}')
+        return result
+
+    def delete_batch(
+        self, model, date_field: str, cutoff, checkpoint, filters: Optional[Dict[str, Any]] = None,
+    ) -> list:
+        """
+        Delete up to batch_size expired rows matching the filters with primary keys above the checkpoint.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        pk = connection.ops.quote_name(model._meta.pk.column)
+        date_column = connection.ops.quote_name(model._meta.get_field(date_field).column)
+
+        conditions = [f'{date_column} < %s']
+        params = [cutoff]
+        for field, value in (filters or {}).items():
+            conditions.append(f'{connection.ops.quote_name(model._meta.get_field(field).column)} = %s')
+            params.append(value)
+        if checkpoint is not None:
+            conditions.append(f'{pk} > %s')
+            params.append(checkpoint)
+        params.append(self.batch_size)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {pk} IN ('
+                f'SELECT {pk} FROM {table} WHERE {" AND ".join(conditions)} ORDER BY {pk} LIMIT %s'
+                f') RETURNING {pk}',
+                params,
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def load_checkpoint(self, policy: RetentionPolicy):
+        try:
+            value = get_lock_redis().get(CHECKPOINT_KEY.format(policy.model))
+        except redis.RedisError:
+            return None
+        if value is None:
+            return None
+        return policy.get_model()._meta.pk.to_python(value.decode())
+
+    def save_checkpoint(self, policy: RetentionPolicy, checkpoint) -> bool:
+        """
+        Store the checkpoint, returns False if the write was rejected as stale.
+        """
+        if checkpoint is None:
+            return True
+        return self.write_checkpoint(policy, str(checkpoint))
+
+    def clear_checkpoint(self, policy: RetentionPolicy) -> bool:
+        return self.write_checkpoint(policy, '')
+
+    def write_checkpoint(self, policy: RetentionPolicy, value: str) -> bool:
+        """
+        Set (or delete, for an empty value) the checkpoint, fenced when the purger has a fencing token.
+        """
+        key = CHECKPOINT_KEY.format(policy.model)
+        client = get_lock_redis()
+        try:
+            if self.fencing_token is None:
+                if value:
+                    client.set(key, value)
+                else:
+                    client.delete(key)
+                return True
+            written = client.register_script(FENCED_WRITE_SCRIPT)(
+                keys=[key, f'{key}:fence'], args=[self.fencing_token, value],
+            )
+        except redis.RedisError as error:
+            logger.warning(f'Could not save retention checkpoint of {policy.model}: {error}')
+            return True
+        if not written:
+            self.stale = True
+            logger.warning(f'Stale fencing token {self.fencing_token}, retention of {policy.model} stopped')
+        return bool(written)
@@ -0,0 +1,180 @@
+import json
+import logging
+import random
+import time
+import traceback
+from typing import Dict, Optional, Type
+
+import redis
+from celery import Task
+from celery.exceptions import Ignore, Retry, SoftTimeLimitExceeded
+from django.db import OperationalError, InterfaceError
+from prometheus_client import Counter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+
+from common.locks import get_lock_redis
+
+logger = logging.getLogger(__name__)
+
+TASK_RETRIES = Counter(
+    'celery_task_retries_total',
+    'Task retries scheduled by the retry policy',
+    ['task', 'exception'],
+)
+TASK_DEAD_LETTERS = Counter(
+    'celery_task_dead_letters_total',
+    'Tasks moved to the dead-letter queue',
+    ['task', 'exception'],
+)
+
+RETRY_STATE_KEY = 'retry:{}'
+
+
+class RetryPolicy:
+    """
+    Retry schedule with decorrelated jitter.
+
+    Each delay is drawn from ``[base_delay, previous_delay * 3]`` and capped by ``max_delay``, so retries
+    of many tasks that failed at the same moment spread out instead of firing together. A task is
+    dead-lettered after ``max_retries`` retries or once ``max_elapsed`` seconds have passed since
+    its first attempt.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        max_elapsed: float = 3600.0,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+
+    def next_delay(self, previous_delay: Optional[float]) -> float:
+        """
+        Delay before the next retry.
+        """
+        upper = max(self.base_delay, (previous_delay or self.base_delay) * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+
+    def exhausted(self, retries: int, elapsed: float) -> bool:
+        """
+        Whether the task should stop retrying.
+        """
+        return retries >= self.max_retries or elapsed >= self.max_elapsed
+
+
+# Infrastructure failures worth retrying by default; other exceptions go to the dead-letter queue at once.
+DEFAULT_RETRY_POLICIES = {
+    OperationalError: RetryPolicy(),
+    InterfaceError: RetryPolicy(),
+    redis.ConnectionError: RetryPolicy(),
+    redis.TimeoutError: RetryPolicy(),
+    RequestsConnectionError: RetryPolicy(),
+    RequestsTimeout: RetryPolicy(),
+}
+
+
+class RetryPolicyTask(Task):
+    """
+    Base class for tasks retried according to per-exception policies.
+
+    ``retry_policies`` maps exception classes to a RetryPolicy (``None`` disables retries for that class),
+    the first ``isinstance`` match wins. Retry state (first attempt time and previous delay) is kept
+    in Redis under the task id, which Celery preserves across retries. A task that exhausts its policy,
+    or fails with an exception without a policy, is stored in the dead-letter queue
+    (common.models.DeadLetterTask) and can be replayed with ``manage.py replay_dead_letters``.
+    """
+    retry_policies: Dict[Type[BaseException], Optional[RetryPolicy]] = DEFAULT_RETRY_POLICIES
+    # the number of retries is limited by the policy, not by Celery
+    max_retries = None
+
+    def __call__(self, *args, **kwargs):
+        try:
+            result = super().__call__(*args, **kwargs)
+        except (Retry, Ignore):
+            raise
+        except Exception as error:
+            if self.request.called_directly:
+                raise
+            self.handle_failure(error, args, kwargs)
+            raise
+        if not self.request.called_directly and self.request.retries:
+            self.clear_retry_state()
+        return result
+
+    def get_retry_policy(self, error: Exception) -> Optional[RetryPolicy]:
+        """
+        Policy for the exception, None if it must not be retried.
+        """
+        for exception_class, policy in self.retry_policies.items():
+            if isinstance(error, exception_class):
+                return policy
+        return None
+
+    def handle_failure(self, error: Exception, args: tuple, kwargs: dict) -> None:
+        """
+        Schedule a retry by the policy (raises Retry) or move the task to the dead-letter queue.
+        """
+        policy = None if isinstance(error, SoftTimeLimitExceeded) else self.get_retry_policy(error)
+        first_attempt, previous_delay = self.load_retry_state()
+        elapsed = time.time() - first_attempt
+
+        if policy is None or policy.exhausted(self.request.retries, elapsed):
+            self.clear_retry_state()
+            self.dead_letter(error, args, kwargs)
+            return
+
+        delay = policy.next_delay(previous_delay)
+        self.save_retry_state(first_attempt, delay, policy.max_elapsed)
+        TASK_RETRIES.labels(self.name, type(error).__name__).inc()
+        raise self.retry(exc=error, countdown=delay)
+
+    def load_retry_state(self) -> tuple:
+        try:
+            state = get_lock_redis().get(RETRY_STATE_KEY.format(self.request.id))
+        except redis.RedisError:
+            state = None
+        if not state:
+            return time.time(), None
+        state = json.loads(state)
+        return state['first_attempt'], state['delay']
+
+    def save_retry_state(self, first_attempt: float, delay: float, ttl: float) -> None:
+        try:
+            get_lock_redis().set(
+                RETRY_STATE_KEY.format(self.request.id),
+                json.dumps({'first_attempt': first_attempt, 'delay': delay}),
+                ex=int(ttl + delay) + 60,
+            )
+        except redis.RedisError as error:
+            logger.warning(f'Could not save retry state of task {self.request.id}: {error}')
+
+    def clear_retry_state(self) -> None:
+        try:
+            get_lock_redis().delete(RETRY_STATE_KEY.format(self.request.id))
+        except redis.RedisError:
+            pass
+
+    def dead_letter(self, error: Exception, args: tuple, kwargs: dict) -> None:
+        """
+        Store the failed task in the dead-letter queue.
+        """
+        from common.models import DeadLetterTask
+
+        TASK_DEAD_LETTERS.labels(self.name, type(error).__name__).inc()
+        try:
+            DeadLetterTask.objects.create(
+                task_name=self.name,
+                task_id=self.request.id,
+                args=json.loads(json.dumps(list(args), default=str)),
+                kwargs=json.loads(json.dumps(kwargs, default=str)),
+                exception=type(error).__name__,
+                error=str(error),
+                traceback=traceback.format_exc(),
+                retries=self.request.retries,
+            )
+        except Exception as dead_letter_error:
+            logger.error(f'Could not dead-letter task {self.name}[{self.request.id}]: {dead_letter_error}')
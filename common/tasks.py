@@ -2,9 +2,16 @@ from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.core.cache import cache
 from django.conf import settings
+import hashlib
+import json
 import time
 from typing import Any, Optional, Dict, List, Tuple
 
+from django.utils.module_loading import import_string
+
+from common.locks import RedisLock, get_lock_redis
+from common.retry import RetryPolicyTask
+
 logger = get_task_logger(__name__)
 
 
@@ -12,26 +19,49 @@ class BaseTask:
     """
     Base task class that provides common functionality for all Celery tasks.
     """
+    # lock lease in seconds, renewed in the background while the task runs
+    lock_timeout = 60
+
     def __init__(self) -> None:
         self.logger = logger
+        self.lock: Optional[RedisLock] = None
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        """
+        Fencing token of the held lock, increases with every acquisition.
+        """
+        return self.lock.fencing_token if self.lock else None
+
+    @property
+    def lock_lost(self) -> bool:
+        """
+        Whether the held lock was lost (lease expired or taken over): the task must stop before its next batch.
+        """
+        return bool(self.lock and self.lock.lost)
 
     def get_lock_key(self, *args: Any, **kwargs: Any) -> str:
         """
-        Generate a unique lock key for the task.
+        Generate a stable lock key for the task from a hash of its arguments.
         """
-        return f"{self.__class__.__name__}:{args}:{kwargs}"
+        digest = hashlib.sha1(json.dumps([args, kwargs], sort_keys=True, default=str).encode()).hexdigest()
+        return f"lock:{self.__class__.__name__}:{digest}"
 
-    def acquire_lock(self, lock_key: str, timeout: int = 60) -> bool:
+    def acquire_lock(self, lock_key: str, timeout: Optional[int] = None) -> bool:
         """
         Try to acquire a lock for the task.
         """
-        return cache.add(lock_key, True, timeout)
+        self.lock = RedisLock(
+            get_lock_redis(), lock_key, ttl=timeout or self.lock_timeout, name=self.__class__.__name__,
+        )
+        return self.lock.acquire()
 
     def release_lock(self, lock_key: str) -> None:
         """
         Release the lock for the task.
         """
-        cache.delete(lock_key)
+        if not self.lock.release():
+            self.logger.warning(f"Task {self.__class__.__name__} lost its lock {lock_key} before release")
 
     def execute_with_lock(self, *args: Any, **kwargs: Any) -> Optional[Any]:
         """
@@ -54,35 +84,35 @@ class BaseTask:
         raise NotImplementedError("Subclasses must implement run()")
 
 
-@shared_task(bind=True, max_retries=3)
-def retry_task(self, task_func, *args, **kwargs):
+@shared_task(bind=True, base=RetryPolicyTask)
+def retry_task(self, func_path: str, *args, **kwargs):
     """
-    Task wrapper that provides retry functionality.
+    Task wrapper that runs an importable function (given by its dotted path) under the retry policy.
     """
-    try:
-        return task_func(*args, **kwargs)
-    except Exception as exc:
-        self.logger.error(f"Task {task_func.__name__} failed: {exc}")
-        self.retry(exc=exc, countdown=2 ** self.request.retries)
+    return import_string(func_path)(*args, **kwargs)
 
 
-@shared_task
-def cleanup_old_data():
+class RetentionTask(BaseTask):
     """
-    Clean up old data from the database.
+    Retention purge, at most one run at a time.
     """
-    from django.utils import timezone
-    from datetime import timedelta
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        from common.retention import RetentionPurger, get_retention_policies
 
-    # Example: Clean up old sessions
-    from django.contrib.sessions.models import Session
-    Session.objects.filter(expire_date__lt=timezone.now()).delete()
+        purger = RetentionPurger.from_settings(fencing_token=self.fencing_token)
+        return purger.purge(get_retention_policies(), should_stop=lambda: self.lock_lost)
 
-    # Example: Clean up old cache keys
-    cache.delete_pattern('*:old_data:*')
+
+@shared_task(bind=True, base=RetryPolicyTask, ignore_result=False)
+def cleanup_old_data(self):
+    """
+    Delete expired sessions, application logs, task results and transactions by the retention policies.
+    Runs in throttled batches and resumes from a checkpoint if it did not finish within RETENTION_MAX_RUNTIME.
+    """
+    return RetentionTask().execute_with_lock()
 
 
-@shared_task
+@shared_task(ignore_result=False)
 def health_check():
     """
     Perform health check of the system.
@@ -1,11 +1,46 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import logging
+import tempfile
+import time
+import brotli
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from asgiref.sync import iscoroutinefunction
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
 from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.response import Response
 from rest_framework.test import APITestCase
+from rest_framework.views import APIView
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import RefreshToken
 from typing import Dict, Any, Optional
 
+from backend_exchanger.celery import app
+from common.access_log import BackgroundRotatingFileHandler, JsonFormatter
+from common.cache_policy import CachePolicy, cache_policy
+from common.compression import choose_encoding
+from common.celery_metrics import queue_wait
+from common.locks import RedisLock
+from common.middleware import (
+    AsyncWhiteNoiseMiddleware, CacheControlMiddleware, CompressionMiddleware, RateLimitMiddleware,
+    RequestLoggingMiddleware, RouteMetricsMiddleware,
+)
+from common.ratelimit import get_rate_limit_redis
+from common.models import DeadLetterTask
+from common.retention import RetentionPolicy, RetentionPurger
+from common.retry import RetryPolicy, RetryPolicyTask
+from common.tasks import BaseTask, RetentionTask, get_lock_redis
+from finance.models import ApplicationLog
+
 User = get_user_model()
 
 
@@ -106,4 +141,507 @@ class BaseAPITestCase(APITestCase):
         """
         Assert that the response indicates resource not found.
         """
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND) 
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND) 
+
+
+class RedisLockTests(TestCase):
+    """
+    Tests for the task lock with fencing tokens and lease renewal.
+    """
+    def setUp(self) -> None:
+        self.redis = get_lock_redis()
+        self.redis.delete('lock:test', 'lock:test:fence')
+
+    def test_fencing_token_increases(self) -> None:
+        first = RedisLock(self.redis, 'lock:test')
+        self.assertTrue(first.acquire())
+        self.assertFalse(RedisLock(self.redis, 'lock:test').acquire())
+        self.assertTrue(first.release())
+
+        second = RedisLock(self.redis, 'lock:test')
+        self.assertTrue(second.acquire())
+        self.assertGreater(second.fencing_token, first.fencing_token)
+        second.release()
+
+    def test_expired_holder_does_not_release_new_lock(self) -> None:
+        first = RedisLock(self.redis, 'lock:test', ttl=0.3)
+        first.acquire()
+        first._stop.set()
+        time.sleep(0.5)
+
+        second = RedisLock(self.redis, 'lock:test')
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.release())
+        self.assertTrue(first.lost)
+        self.assertTrue(self.redis.exists('lock:test'))
+        second.release()
+
+    def test_lease_renewed_while_held(self) -> None:
+        lock = RedisLock(self.redis, 'lock:test', ttl=0.3)
+        lock.acquire()
+        time.sleep(0.7)
+
+        self.assertFalse(lock.lost)
+        self.assertFalse(RedisLock(self.redis, 'lock:test').acquire())
+        self.assertTrue(lock.release())
+
+    def test_lock_key_is_stable(self) -> None:
+        key = BaseTask().get_lock_key(100, mode='fast')
+        self.assertEqual(key, BaseTask().get_lock_key(100, mode='fast'))
+        self.assertNotEqual(key, BaseTask().get_lock_key(200, mode='fast'))
+
+
+@app.task(bind=True, base=RetryPolicyTask, retry_policies={ValueError: RetryPolicy(max_retries=2, base_delay=0.01)})
+def failing_task(self, value, mode=None):
+    raise ValueError(f'bad value {value}')
+
+
+class RetryPolicyTests(TestCase):
+    """
+    Tests for retry policies and the dead-letter queue.
+    """
+    def test_next_delay_is_bounded(self) -> None:
+        policy = RetryPolicy(base_delay=1, max_delay=20)
+        delay = None
+        for _ in range(50):
+            delay = policy.next_delay(delay)
+            self.assertGreaterEqual(delay, 1)
+            self.assertLessEqual(delay, 20)
+
+    def test_policy_exhausted_by_retries_or_elapsed_time(self) -> None:
+        policy = RetryPolicy(max_retries=3, max_elapsed=60)
+        self.assertFalse(policy.exhausted(2, 10))
+        self.assertTrue(policy.exhausted(3, 10))
+        self.assertTrue(policy.exhausted(0, 60))
+
+    def test_exhausted_task_is_dead_lettered(self) -> None:
+        result = failing_task.apply(args=(7,), kwargs={'mode': 'fast'}, throw=False)
+
+        self.assertIsInstance(result.result, ValueError)
+        dead_letter = DeadLetterTask.objects.get()
+        self.assertEqual(dead_letter.task_name, failing_task.name)
+        self.assertEqual(dead_letter.args, [7])
+        self.assertEqual(dead_letter.kwargs, {'mode': 'fast'})
+        self.assertEqual(dead_letter.exception, 'ValueError')
+        self.assertEqual(dead_letter.retries, 2)
+
+    def test_error_without_policy_is_dead_lettered_at_once(self) -> None:
+        with mock.patch.object(failing_task, 'retry_policies', {}):
+            failing_task.apply(args=(7,), throw=False)
+
+        self.assertEqual(DeadLetterTask.objects.get().retries, 0)
+
+    def test_replay_dead_letters(self) -> None:
+        dead_letter = DeadLetterTask.objects.create(
+            task_name=failing_task.name, task_id='1', args=[7], kwargs={}, exception='ValueError', error='bad value',
+        )
+
+        with mock.patch.object(app, 'send_task') as send_task:
+            call_command('replay_dead_letters', task=failing_task.name, stdout=mock.MagicMock())
+
+        send_task.assert_called_once_with(failing_task.name, args=[7], kwargs={})
+        dead_letter.refresh_from_db()
+        self.assertEqual(dead_letter.status, DeadLetterTask.REPLAYED)
+        self.assertIsNotNone(dead_letter.replayed_at)
+
+
+class RetentionTests(TestCase):
+    """
+    Tests for the batched retention purge.
+    """
+    def setUp(self) -> None:
+        self.policy = RetentionPolicy('finance.ApplicationLog', 'created', timedelta(days=30))
+        get_lock_redis().delete(
+            'retention:checkpoint:finance.ApplicationLog', 'retention:checkpoint:finance.ApplicationLog:fence',
+        )
+        logs = ApplicationLog.objects.bulk_create([ApplicationLog(status='pending') for _ in range(7)])
+        self.expired = [log.id for log in logs[:5]]
+        ApplicationLog.objects.filter(id__in=self.expired).update(created=timezone.now() - timedelta(days=31))
+
+    def test_purge_deletes_expired_rows_in_batches(self) -> None:
+        purger = RetentionPurger(batch_size=2, target_load=1, max_runtime=60)
+        with mock.patch.object(purger, 'delete_batch', wraps=purger.delete_batch) as delete_batch:
+            report = purger.purge([self.policy])
+
+        self.assertEqual(delete_batch.call_count, 3)
+        self.assertEqual(report['finance.ApplicationLog']['deleted'], 5)
+        self.assertTrue(report['finance.ApplicationLog']['complete'])
+        self.assertEqual(ApplicationLog.objects.count(), 2)
+        self.assertFalse(ApplicationLog.objects.filter(id__in=self.expired).exists())
+        self.assertIsNone(purger.load_checkpoint(self.policy))
+
+    def test_purge_resumes_from_checkpoint(self) -> None:
+        # the pause after the first batch runs out the time budget
+        purger = RetentionPurger(batch_size=2, target_load=0.0001, max_runtime=0.2)
+        report = purger.purge([self.policy])
+
+        self.assertEqual(report['finance.ApplicationLog']['deleted'], 2)
+        self.assertFalse(report['finance.ApplicationLog']['complete'])
+        self.assertEqual(purger.load_checkpoint(self.policy), self.expired[1])
+
+        report = RetentionPurger(batch_size=2, target_load=1, max_runtime=60).purge([self.policy])
+        self.assertEqual(report['finance.ApplicationLog']['deleted'], 3)
+        self.assertEqual(ApplicationLog.objects.count(), 2)
+
+    def test_purge_stops_when_lock_is_lost(self) -> None:
+        task = RetentionTask()
+        task.lock = mock.Mock(lost=False)
+        purger = RetentionPurger(batch_size=2, target_load=1, max_runtime=60)
+
+        def delete_batch(*args: Any) -> list:
+            task.lock.lost = True
+            return original(*args)
+
+        original = purger.delete_batch
+        with mock.patch.object(purger, 'delete_batch', side_effect=delete_batch):
+            report = purger.purge([self.policy], should_stop=lambda: task.lock_lost)
+
+        self.assertEqual(report['finance.ApplicationLog']['deleted'], 2)
+        self.assertFalse(report['finance.ApplicationLog']['complete'])
+        self.assertEqual(purger.load_checkpoint(self.policy), self.expired[1])
+
+    def test_stale_fencing_token_rejected(self) -> None:
+        current = RetentionPurger(batch_size=2, target_load=1, max_runtime=60, fencing_token=2)
+        self.assertTrue(current.save_checkpoint(self.policy, self.expired[0]))
+
+        stale = RetentionPurger(batch_size=2, target_load=1, max_runtime=60, fencing_token=1)
+        report = stale.purge([self.policy])
+
+        # the expired holder deletes one batch, then its checkpoint write is rejected and it stops
+        self.assertTrue(stale.stale)
+        self.assertEqual(report['finance.ApplicationLog']['deleted'], 2)
+        self.assertFalse(report['finance.ApplicationLog']['complete'])
+        self.assertEqual(current.load_checkpoint(self.policy), self.expired[0])
+
+
+class CeleryMetricsTests(TestCase):
+    """
+    Tests for task metrics collected from Celery signals.
+    """
+    def sample(self, name: str, **labels: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_failed_task_is_counted(self) -> None:
+        labels = {'task': failing_task.name, 'queue': 'default'}
+        failed = self.sample('celery_task_failed_total', exception='ValueError', **labels)
+        retried = self.sample('celery_task_retried_total', **labels)
+        runs = self.sample('celery_task_runtime_seconds_count', state='FAILURE', **labels)
+
+        failing_task.apply(args=(7,), throw=False)
+
+        self.assertEqual(self.sample('celery_task_failed_total', exception='ValueError', **labels), failed + 1)
+        self.assertEqual(self.sample('celery_task_retried_total', **labels), retried + 2)
+        self.assertEqual(self.sample('celery_task_runtime_seconds_count', state='FAILURE', **labels), runs + 1)
+        self.assertEqual(self.sample('celery_tasks_in_flight', queue='default'), 0)
+
+    def test_queue_wait_counts_from_eta(self) -> None:
+        now = time.time()
+        request = mock.Mock(published_at=now - 30, eta=None)
+        self.assertAlmostEqual(queue_wait(request, now), 30)
+
+        request.eta = timezone.now() - timedelta(seconds=10)
+        self.assertAlmostEqual(queue_wait(request, now), 10, places=0)
+
+        self.assertIsNone(queue_wait(mock.Mock(spec=[]), now))
+
+
+class TaskResultPolicyTests(TestCase):
+    """
+    Tests for the task result policy.
+    """
+    def test_results_are_ignored_by_default(self) -> None:
+        from finance.tasks import send_notification, process_payouts
+
+        self.assertTrue(send_notification.ignore_result)
+        self.assertFalse(process_payouts.ignore_result)
+
+    def test_purge_task_results(self) -> None:
+        from django_celery_results.models import TaskResult
+
+        TaskResult.objects.bulk_create([TaskResult(task_id=str(number), status='SUCCESS') for number in range(5)])
+        TaskResult.objects.filter(task_id__in=['0', '1', '2']).update(date_done=timezone.now() - timedelta(days=10))
+
+        call_command('purge_task_results', older_than=7, stdout=mock.MagicMock())
+
+        self.assertEqual(set(TaskResult.objects.values_list('task_id', flat=True)), {'3', '4'})
+
+
+@override_settings(RATE_LIMIT_RULES=[
+    {'name': 'test-transfer', 'pattern': r'^/api/transfer/', 'methods': ['POST'], 'rate': '2/m'},
+    {'name': 'test-read', 'pattern': r'^/api/', 'methods': ['GET'], 'rate': '100/m'},
+])
+class RateLimitTests(TestCase):
+    """
+    Tests for the Redis token bucket rate limiter.
+    """
+    def setUp(self) -> None:
+        self.redis = get_rate_limit_redis()
+        for key in self.redis.scan_iter('ratelimit:test-*'):
+            self.redis.delete(key)
+        self.middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        self.factory = RequestFactory()
+
+    def post(self, ip: str = '10.0.0.1', **extra):
+        return self.middleware(self.factory.post('/api/transfer/', REMOTE_ADDR=ip, **extra))
+
+    def test_bucket_is_exhausted(self) -> None:
+        first, second, third = self.post(), self.post(), self.post()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['RateLimit-Limit'], '2')
+        self.assertEqual(first['RateLimit-Remaining'], '1')
+        self.assertEqual(second['RateLimit-Remaining'], '0')
+        self.assertEqual(third.status_code, 429)
+        self.assertEqual(third['Retry-After'], '30')
+
+        # routes have separate buckets
+        read = self.middleware(self.factory.get('/api/accounts/', REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(read.status_code, 200)
+        self.assertEqual(read['RateLimit-Limit'], '100')
+
+    def test_keyed_on_jwt_user(self) -> None:
+        user = User.objects.create_user(username='limited', password='testpass123')
+        token = str(RefreshToken.for_user(user).access_token)
+
+        self.post('10.0.0.1', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.post('10.0.0.2', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.post('10.0.0.3', HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 429)
+        self.assertEqual(self.post('10.0.0.3').status_code, 200)
+
+    def test_unverified_identity_is_not_trusted(self) -> None:
+        self.post(HTTP_X_FORWARDED_FOR='1.1.1.1', HTTP_AUTHORIZATION='Token aaa')
+        self.post(HTTP_X_FORWARDED_FOR='2.2.2.2', HTTP_AUTHORIZATION='Token bbb')
+        response = self.post(HTTP_X_FORWARDED_FOR='3.3.3.3', HTTP_AUTHORIZATION='Token ccc')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_client_ip_behind_trusted_proxy(self) -> None:
+        # the proxy appends the address it received the request from, the entries before it are spoofable
+        self.post(HTTP_X_FORWARDED_FOR='1.1.1.1, 10.1.1.1')
+        self.post(HTTP_X_FORWARDED_FOR='2.2.2.2, 10.1.1.1')
+        self.assertEqual(self.post(HTTP_X_FORWARDED_FOR='10.1.1.1').status_code, 429)
+        self.assertEqual(self.post(HTTP_X_FORWARDED_FOR='10.1.1.2').status_code, 200)
+
+    def test_blocked_client_rejected_without_redis(self) -> None:
+        self.post(), self.post(), self.post()
+
+        with mock.patch.object(self.middleware.limiter, 'script') as script:
+            response = self.post()
+
+        script.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+
+    def test_unmatched_route_is_not_limited(self) -> None:
+        response = self.middleware(self.factory.get('/health/'))
+        self.assertFalse(response.has_header('RateLimit-Limit'))
+
+
+@override_settings(RATE_LIMIT_RULES=[
+    {'name': 'test-async', 'pattern': r'^/api/transfer/', 'methods': ['POST'], 'rate': '1/m'},
+])
+class AsyncMiddlewareTests(TestCase):
+    """
+    Tests for the middlewares in async mode (ASGI).
+    """
+    def setUp(self) -> None:
+        for key in get_rate_limit_redis().scan_iter('ratelimit:test-async:*'):
+            get_rate_limit_redis().delete(key)
+
+    async def get_response(self, request):
+        return HttpResponse(b'{}' * 1024, content_type='application/json')
+
+    def post(self):
+        return AsyncRequestFactory().post('/api/transfer/', headers={'Accept-Encoding': 'gzip'})
+
+    async def test_hooks_run_in_event_loop(self) -> None:
+        handler = self.get_response
+        middlewares = (CompressionMiddleware, RateLimitMiddleware, RequestLoggingMiddleware, RouteMetricsMiddleware)
+        for middleware in middlewares:
+            handler = middleware(handler)
+        self.assertTrue(iscoroutinefunction(handler.process_template_response))
+        self.assertIs(handler.process_template_response.__self__, handler)
+
+        # MiddlewareMixin would call the hooks through sync_to_async
+        with mock.patch('django.utils.deprecation.sync_to_async', side_effect=AssertionError('thread hop')):
+            first = await handler(self.post())
+            second = await handler(self.post())
+
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(first['RateLimit-Remaining'], '0')
+        self.assertEqual(second.status_code, 429)
+
+    async def test_whitenoise_passes_through_in_async_mode(self) -> None:
+        middleware = AsyncWhiteNoiseMiddleware(self.get_response)
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual((await middleware(self.post())).status_code, 200)
+
+
+@override_settings(ACCESS_LOG_SAMPLE_RATE=0, ACCESS_LOG_SLOW_MS=1000, ACCESS_LOG_ERROR_STATUS=500)
+class AccessLogTests(TestCase):
+    """
+    Tests for the sampled JSON access log.
+    """
+    def get_response(self, request):
+        list(User.objects.all())
+        return HttpResponse(status=self.status)
+
+    def request(self, status_code: int):
+        self.status = status_code
+        middleware = RequestLoggingMiddleware(self.get_response)
+        return middleware(RequestFactory().get('/api/area/'))
+
+    def test_successful_request_is_sampled_out(self) -> None:
+        with mock.patch('common.middleware.access_logger') as access_logger:
+            self.request(200)
+        access_logger.log.assert_not_called()
+
+    def test_error_is_always_logged_with_context(self) -> None:
+        with self.assertLogs('access', level='WARNING') as logs:
+            self.request(503)
+
+        record = logs.records[0]
+        self.assertEqual(record.status, 503)
+        self.assertEqual(record.db_queries, 1)
+        self.assertFalse(record.sampled)
+        self.assertEqual(json.loads(JsonFormatter().format(record))['path'], '/api/area/')
+
+    def test_background_handler_writes_file(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            handler = BackgroundRotatingFileHandler(f'{directory}/access.log')
+            handler.setFormatter(JsonFormatter())
+            handler.handle(logging.makeLogRecord({'name': 'access', 'msg': 'request', 'status': 200}))
+            handler.close()
+
+            with open(f'{directory}/access.log') as log_file:
+                self.assertEqual(json.loads(log_file.read())['status'], 200)
+
+
+class RouteMetricsTests(TestCase):
+    """
+    Tests for per-route latency, DB and Redis histograms.
+    """
+    def sample(self, name: str) -> float:
+        labels = {'route': 'Transaction-transfer-funds', 'method': 'POST'}
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def get_response(self, request):
+        list(User.objects.all())
+        list(User.objects.all())
+        get_lock_redis().get('route-metrics')
+        pipeline = get_lock_redis().pipeline()
+        pipeline.get('route-metrics')
+        pipeline.get('route-metrics')
+        pipeline.execute()
+        return HttpResponse()
+
+    def test_time_is_attributed_to_route(self) -> None:
+        request = RequestFactory().post('/api/user_transaction/transfer_funds/')
+        request.resolver_match = resolve('/api/user_transaction/transfer_funds/')
+        requests = self.sample('http_route_duration_seconds_count')
+        queries = self.sample('http_route_db_queries_sum')
+        commands = self.sample('http_route_redis_commands_sum')
+
+        RouteMetricsMiddleware(self.get_response)(request)
+
+        self.assertEqual(self.sample('http_route_duration_seconds_count'), requests + 1)
+        self.assertEqual(self.sample('http_route_db_queries_sum'), queries + 2)
+        self.assertEqual(self.sample('http_route_redis_commands_sum'), commands + 3)
+
+    def test_outside_of_request_nothing_is_counted(self) -> None:
+        queries = self.sample('http_route_db_queries_sum')
+        list(User.objects.all())
+        self.assertEqual(self.sample('http_route_db_queries_sum'), queries)
+
+
+class PublicView(APIView):
+    authentication_classes = ()
+    permission_classes = ()
+    calls = 0
+
+    @cache_policy(CachePolicy(public=True, max_age=60, stale_while_revalidate=300, vary=(), shared_timeout=60))
+    def get(self, request):
+        PublicView.calls += 1
+        return Response({'calls': PublicView.calls})
+
+
+class CachePolicyTests(TestCase):
+    """
+    Tests for per-view cache policies.
+    """
+    def respond(self, request, response):
+        return CacheControlMiddleware(lambda request: response)(request)
+
+    def test_default_policy(self) -> None:
+        response = self.respond(RequestFactory().get('/api/user_account/'), HttpResponse())
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Authorization', response['Vary'])
+
+        response = self.respond(RequestFactory().post('/api/user_account/'), HttpResponse())
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+    def test_view_headers_are_kept(self) -> None:
+        response = HttpResponse()
+        response['Cache-Control'] = 'max-age=0, no-cache, no-store, must-revalidate, private'
+        response = self.respond(RequestFactory().get('/admin/'), response)
+        self.assertEqual(response['Cache-Control'], 'max-age=0, no-cache, no-store, must-revalidate, private')
+
+    def test_public_view_is_shared(self) -> None:
+        from django.core.cache import cache
+
+        cache.delete(f'response:common.tests.PublicView.get:{hashlib.sha1(b"/rates/").hexdigest()}')
+        PublicView.calls = 0
+        view = PublicView.as_view()
+
+        first = self.respond(RequestFactory().get('/rates/'), view(RequestFactory().get('/rates/')))
+        second = view(RequestFactory().get('/rates/', HTTP_AUTHORIZATION='Bearer other'))
+        second.render()
+
+        self.assertEqual(first['Cache-Control'], 'public, max-age=60, stale-while-revalidate=300')
+        self.assertNotIn('Authorization', first['Vary'])
+        self.assertEqual(second.data, {'calls': 1})
+        self.assertEqual(PublicView.calls, 1)
+
+    def test_shared_cache_requires_public_policy(self) -> None:
+        with self.assertRaises(ValueError):
+            CachePolicy(shared_timeout=60)
+
+
+class CompressionTests(TestCase):
+    """
+    Tests for negotiated brotli / gzip compression.
+    """
+    body = json.dumps([{'id': number, 'amount': '100.00', 'currency': 'RUR'} for number in range(200)]).encode()
+
+    def respond(self, response, accept_encoding: str = 'gzip, deflate, br'):
+        request = RequestFactory().get('/api/user_transaction/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_choose_encoding(self) -> None:
+        self.assertEqual(choose_encoding('gzip, deflate, br'), 'br')
+        self.assertEqual(choose_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(choose_encoding('br;q=0, *'), 'gzip')
+        self.assertIsNone(choose_encoding('identity'))
+
+    def test_brotli_response(self) -> None:
+        response = HttpResponse(self.body, content_type='application/json')
+        response['ETag'] = '"abc"'
+        response = self.respond(response)
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(brotli.decompress(response.content), self.body)
+
+    def test_streaming_response_is_compressed_by_chunk(self) -> None:
+        chunks = [self.body[:1000], self.body[1000:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks), content_type='text/csv'), 'gzip')
+
+        compressed = list(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(compressed), 3)
+        self.assertEqual(gzip.decompress(b''.join(compressed)), self.body)
+
+    def test_small_and_precompressed_bodies_are_skipped(self) -> None:
+        self.assertFalse(self.respond(HttpResponse(b'{}')).has_header('Content-Encoding'))
+        self.assertFalse(self.respond(HttpResponse(self.body, content_type='image/png')).has_header('Content-Encoding'))
@@ -1,6 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 
-from .models import Account, Currency, Transaction, Application
+from .models import Account, Currency, Transaction, Application, WebhookEvent, OutboxMessage
+from .transitions import ApplicationTransitions
 
 
 @admin.register(Account)
@@ -21,4 +23,27 @@ class TransactionAdmin(admin.ModelAdmin):
 @admin.register(Application)
 class ApplicationAdmin(admin.ModelAdmin):
     list_display = ('account', 'currency', 'payment_id', 'amount', 'type', 'status', 'error')
-    readonly_fields = ('payment_id',)
+    list_filter = ('type', 'status')
+    readonly_fields = ('payment_id', 'payout_token')
+    actions = ('approve_withdrawals',)
+
+    @admin.action(description='Одобрить выплату по выбранным заявкам на вывод')
+    def approve_withdrawals(self, request, queryset):
+        ids = queryset.filter(type=Application.WITHDRAWAL).values_list('id', flat=True)
+        with transaction.atomic(), ApplicationTransitions() as transitions:
+            approved_ids = transitions.transition_many(ids, Application.PENDING, Application.APPROVED)
+        self.message_user(request, f'Одобрено заявок: {len(approved_ids)}', messages.SUCCESS)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('payment_id', 'event', 'status', 'attempts', 'next_attempt_at', 'created')
+    list_filter = ('status', 'event')
+    readonly_fields = ('payload',)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'status', 'attempts', 'created', 'sent_at')
+    list_filter = ('status', 'topic')
+    readonly_fields = ('payload',)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import defaultdict
+
+import aiohttp
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from .notifications import (
+    BUFFER_KEY, DUE_KEY, SMS_MESSAGES_SENT, build_message, get_provider, record_coalescing,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AsyncNotificationWorker:
+    """
+    Asyncio-воркер смс-уведомлений.
+    Забирает из Redis сводки, у которых истекло окно объединения, и отправляет их на одном event loop:
+    тысячи одновременных HTTP-запросов вместо одного запроса на процесс Celery.
+    Общее число отправок ограничено concurrency, число одновременных запросов к провайдеру - provider_concurrency.
+    Несколько воркеров могут работать параллельно: сводку забирает тот, чей ZREM ее удалил.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        provider_url: str,
+        concurrency: int,
+        provider_concurrency: int,
+        timeout: float,
+        max_retries: int,
+        retry_backoff: float,
+        batch_size: int,
+        poll_interval: float,
+        buffer_key: str = BUFFER_KEY,
+        due_key: str = DUE_KEY,
+    ) -> None:
+        self.redis_url = redis_url
+        self.provider_url = provider_url
+        self.concurrency = concurrency
+        self.provider_concurrency = provider_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.buffer_key = buffer_key
+        self.due_key = due_key
+        self.stopping = asyncio.Event()
+        self.sent = 0
+
+    @classmethod
+    def from_settings(cls, **overrides) -> 'AsyncNotificationWorker':
+        options = {
+            'redis_url': settings.SMS_REDIS_URL,
+            'provider_url': os.environ.get('SMS_PROVIDER'),
+            'concurrency': settings.SMS_WORKER_CONCURRENCY,
+            'provider_concurrency': settings.SMS_PROVIDER_CONCURRENCY,
+            'timeout': settings.SMS_TIMEOUT,
+            'max_retries': settings.SMS_MAX_RETRIES,
+            'retry_backoff': settings.SMS_RETRY_BACKOFF,
+            'batch_size': settings.SMS_WORKER_BATCH_SIZE,
+            'poll_interval': settings.SMS_WORKER_POLL_INTERVAL,
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    async def run(self, until_empty: bool = False) -> None:
+        """Цикл воркера: until_empty - остановиться, когда очередь сводок опустеет"""
+
+        # блокирующий пул: при нехватке соединений отправка ждет свободное, а не падает
+        self.redis = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+            self.redis_url, max_connections=settings.SMS_WORKER_REDIS_CONNECTIONS,
+        ))
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.provider_slots = defaultdict(lambda: asyncio.Semaphore(self.provider_concurrency))
+        in_flight = set()
+
+        try:
+            while not self.stopping.is_set():
+                digests = await self.claim_due_digests(min(self.batch_size, self.concurrency))
+                if not digests:
+                    if until_empty and not in_flight and not await self.redis.zcard(self.due_key):
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                for digest in digests:
+                    await self.slots.acquire()
+                    task = asyncio.create_task(self.deliver(*json.loads(digest)))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                    task.add_done_callback(lambda _: self.slots.release())
+
+            # при остановке дожидаемся уже начатых отправок
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        finally:
+            await self.session.close()
+            await self.redis.aclose()
+
+    async def claim_due_digests(self, limit: int) -> list:
+        """Захват сводок с истекшим окном объединения"""
+
+        digests = await self.redis.zrangebyscore(self.due_key, 0, time.time(), start=0, num=limit)
+        if not digests:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for digest in digests:
+                pipeline.zrem(self.due_key, digest)
+            removed = await pipeline.execute()
+        return [digest for digest, claimed in zip(digests, removed) if claimed]
+
+    async def take_buffered_notifications(self, receivers_account: str) -> list:
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.lrange(self.buffer_key.format(receivers_account), 0, -1)
+            pipeline.delete(self.buffer_key.format(receivers_account))
+            notifications, _ = await pipeline.execute()
+        return [json.loads(notification) for notification in notifications]
+
+    async def deliver(self, receivers_account: str, phone: str) -> None:
+        """Отправка одной сводки получателю"""
+
+        try:
+            notifications = await self.take_buffered_notifications(receivers_account)
+            if notifications and await self.send_sms(phone, build_message(notifications)):
+                record_coalescing(len(notifications))
+        except Exception as error:
+            logger.error(msg={f'Ошибка отправки сводки по счету {receivers_account}': error})
+
+    async def send_sms(self, phone: str, message: str) -> bool:
+        """Отправка смс с таймаутом и повторами временных ошибок с экспоненциальной задержкой и джиттером"""
+
+        provider = get_provider(self.provider_url)
+
+        async with self.provider_slots[provider]:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+                try:
+                    params = {'phones': phone, 'mes': message}
+                    async with self.session.get(self.provider_url, params=params) as response:
+                        if response.status in RETRYABLE_STATUS_CODES:
+                            continue
+                        if response.status >= 400:
+                            logger.error(msg={'Провайдер отклонил смс': response.status})
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    logger.warning(msg={'Ошибка отправки смс': error})
+                    continue
+
+                SMS_MESSAGES_SENT.labels(provider, 'success').inc()
+                self.sent += 1
+                return True
+
+        SMS_MESSAGES_SENT.labels(provider, 'error').inc()
+        return False
@@ -0,0 +1,37 @@
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from common.exceptions import BadRequest
+from common.ratelimit import get_client_ip
+from .services import aget_exchange_rates, ato_store_webhook, is_webhook_source_allowed
+from .views import RATES_CACHE_POLICY
+
+# Асинхронные версии представлений с I/O для ASGI, подключаются вместо DRF при ASYNC_VIEWS=True.
+# DRF 3.14 не поддерживает async-представления, поэтому это представления Django с теми же ответами:
+# запрос к Redis или БД не занимает поток на время ожидания.
+
+
+@require_safe
+async def get_rates(request):
+    """Получить курсы валют. Курсы читаются из Redis одним MGET, серверный кэш ответа не нужен"""
+
+    response = JsonResponse(await aget_exchange_rates())
+    response.cache_policy = RATES_CACHE_POLICY
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def webhook_handler(request):
+    """Прием вебхука Yookassa во входящую очередь, как UserApplicationViewSet.webhook_handler"""
+
+    if not is_webhook_source_allowed(get_client_ip(request)):
+        return JsonResponse(
+            {'error': 'Уведомление отправлено не с адреса Yookassa', 'code': 'permission_denied'}, status=403,
+        )
+    try:
+        await ato_store_webhook(request.body)
+    except BadRequest as error:
+        return JsonResponse(error.serializer.data, status=error.status_code)
+    return HttpResponse(content_type='application/json')
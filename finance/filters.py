@@ -40,7 +40,7 @@ class AccountFilter(df_filters.FilterSet):
     currency = MultipleFilter(field_name='currency__short_name', lookup_expr='exact', widget=CSVWidget)
     balance_from = df_filters.NumberFilter(field_name='balance', lookup_expr='gte')
     balance_up_to = df_filters.NumberFilter(field_name='balance', lookup_expr='lte')
-    username = df_filters.NumberFilter(field_name='user__username', lookup_expr='lte')
+    username = df_filters.CharFilter(field_name='user__username', lookup_expr='icontains')
 
     class Meta:
         model = Account
@@ -0,0 +1,222 @@
+import time
+import random
+import logging
+from functools import lru_cache
+from typing import Optional
+
+import requests
+from django.conf import settings
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
+from yookassa.domain.response import PaymentResponse, PayoutResponse
+
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+YOOKASSA_REQUEST_LATENCY = Histogram(
+    'yookassa_request_duration_seconds',
+    'Длительность запроса к Yookassa API, включая повторы',
+    ['operation', 'outcome'],
+)
+YOOKASSA_REQUEST_ERRORS = Counter(
+    'yookassa_request_errors_total',
+    'Ошибки запросов к Yookassa API',
+    ['operation', 'reason'],
+)
+YOOKASSA_REQUEST_RETRIES = Counter(
+    'yookassa_request_retries_total',
+    'Повторные попытки запросов к Yookassa API',
+    ['operation'],
+)
+YOOKASSA_CIRCUIT_OPEN = Gauge(
+    'yookassa_circuit_open',
+    'Circuit breaker Yookassa разомкнут (1) или замкнут (0)',
+)
+
+# 202 - Yookassa еще обрабатывает запрос и просит повторить его позже
+RETRYABLE_STATUS_CODES = {202, 429, 500, 502, 503, 504}
+
+
+class PaymentGatewayError(Exception):
+    """Ошибка платежного шлюза"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    """Платежный шлюз недоступен, запрос отклонен без обращения к нему (circuit breaker разомкнут)"""
+
+
+class YookassaClient:
+    """
+    Клиент Yookassa API.
+    Держит пул keep-alive соединений, ограничивает запросы таймаутами, повторяет идемпотентные запросы
+    с экспоненциальной задержкой и джиттером, а при деградации Yookassa размыкает circuit breaker.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        account_id: str,
+        secret_key: str,
+        connect_timeout: float,
+        read_timeout: float,
+        pool_size: int,
+        max_retries: int,
+        retry_backoff: float,
+        breaker: CircuitBreaker,
+    ) -> None:
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        self.session.auth = (account_id or '', secret_key or '')
+        self.session.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def create_payment(self, data: dict, idempotence_key: str, max_retries: Optional[int] = None) -> PaymentResponse:
+        """Создание платежа, max_retries - ограничение повторов для вызова из запроса пользователя"""
+
+        return PaymentResponse(
+            self._request('create_payment', 'POST', '/payments', data, idempotence_key, max_retries=max_retries)
+        )
+
+    def capture_payment(self, payment_id: str, data: dict, idempotence_key: str) -> PaymentResponse:
+        """Подтверждение платежа"""
+
+        return PaymentResponse(
+            self._request('capture_payment', 'POST', f'/payments/{payment_id}/capture', data, idempotence_key)
+        )
+
+    def get_payment(self, payment_id: str) -> PaymentResponse:
+        """Получение платежа"""
+
+        return PaymentResponse(self._request('get_payment', 'GET', f'/payments/{payment_id}'))
+
+    def create_payout(self, data: dict, idempotence_key: str) -> PayoutResponse:
+        """Создание выплаты"""
+
+        return PayoutResponse(self._request('create_payout', 'POST', '/payouts', data, idempotence_key))
+
+    def get_payout(self, payout_id: str) -> PayoutResponse:
+        """Получение выплаты"""
+
+        return PayoutResponse(self._request('get_payout', 'GET', f'/payouts/{payout_id}'))
+
+    def _request(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        data: Optional[dict] = None,
+        idempotence_key: Optional[str] = None,
+        max_retries: Optional[int] = None,
+    ) -> dict:
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as error:
+            YOOKASSA_REQUEST_ERRORS.labels(operation, 'circuit_open').inc()
+            raise PaymentGatewayUnavailable(str(error))
+
+        headers = {'Idempotence-Key': idempotence_key} if idempotence_key else {}
+        # POST без ключа идемпотентности повторять нельзя - Yookassa может выполнить его дважды
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempts = max_retries + 1 if method == 'GET' or idempotence_key else 1
+        started = time.perf_counter()
+        outcome = 'error'
+
+        try:
+            try:
+                response = self._send_with_retries(operation, method, path, data, headers, attempts)
+            except BaseException:
+                # повторы исчерпаны или вызов прерван: любая такая ошибка завершает вызов, иначе пробный вызов
+                # в half-open останется незавершенным и breaker будет отклонять все запросы
+                self.breaker.record_failure()
+                raise
+
+            # ответ получен - Yookassa доступна, даже если запрос отклонен (4xx)
+            self.breaker.record_success()
+            result = self._parse_response(operation, response)
+            outcome = 'success'
+            return result
+        finally:
+            YOOKASSA_REQUEST_LATENCY.labels(operation, outcome).observe(time.perf_counter() - started)
+
+    def _send_with_retries(
+        self, operation: str, method: str, path: str, data: Optional[dict], headers: dict, attempts: int,
+    ) -> requests.Response:
+        """Запрос с повторами временных ошибок, возвращает первый окончательный ответ Yookassa"""
+
+        for attempt in range(attempts):
+            if attempt:
+                YOOKASSA_REQUEST_RETRIES.labels(operation).inc()
+                time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+
+            response, reason, error = self._send(method, path, data, headers)
+            if response is not None:
+                return response
+
+        YOOKASSA_REQUEST_ERRORS.labels(operation, reason).inc()
+        raise error
+
+    def _send(self, method: str, path: str, data: Optional[dict], headers: dict) -> tuple:
+        """Одна попытка запроса: (ответ, None, None) или (None, причина, ошибка), если запрос нужно повторить"""
+
+        try:
+            response = self.session.request(
+                method, self.api_url + path, json=data, headers=headers, timeout=self.timeout,
+            )
+        except requests.Timeout as error:
+            return None, 'timeout', PaymentGatewayError(f'Таймаут запроса к Yookassa: {error}')
+        except requests.RequestException as error:
+            return None, 'connection', PaymentGatewayError(f'Ошибка соединения с Yookassa: {error}')
+
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            return None, str(response.status_code), PaymentGatewayError(
+                f'Yookassa ответила {response.status_code}', response.status_code,
+            )
+        return response, None, None
+
+    @staticmethod
+    def _parse_response(operation: str, response: requests.Response) -> dict:
+        """Тело успешного ответа, отказ Yookassa (4xx) - окончательная ошибка"""
+
+        if response.status_code >= 400:
+            YOOKASSA_REQUEST_ERRORS.labels(operation, str(response.status_code)).inc()
+            raise PaymentGatewayError(f'Yookassa отклонила запрос {operation}: {response.text}', response.status_code)
+        return response.json()
+
+
+def _on_breaker_state_change(name: str, state: str) -> None:
+    logger.warning(msg={f'Circuit breaker {name}': state})
+    YOOKASSA_CIRCUIT_OPEN.set(int(state == CircuitBreaker.OPEN))
+
+
+@lru_cache(maxsize=None)
+def get_yookassa_client() -> YookassaClient:
+    """Клиент Yookassa, один на процесс, чтобы переиспользовать пул соединений"""
+
+    return YookassaClient(
+        api_url=settings.YOOKASSA_API_URL,
+        account_id=settings.YOOKASSA_ACCOUNT_ID,
+        secret_key=settings.YOOKASSA_SECRET_KEY,
+        connect_timeout=settings.YOOKASSA_CONNECT_TIMEOUT,
+        read_timeout=settings.YOOKASSA_READ_TIMEOUT,
+        pool_size=settings.YOOKASSA_POOL_SIZE,
+        max_retries=settings.YOOKASSA_MAX_RETRIES,
+        retry_backoff=settings.YOOKASSA_RETRY_BACKOFF,
+        breaker=CircuitBreaker(
+            'yookassa',
+            failure_threshold=settings.YOOKASSA_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.YOOKASSA_BREAKER_RECOVERY_TIME,
+            on_state_change=_on_breaker_state_change,
+        ),
+    )
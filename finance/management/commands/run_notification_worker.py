@@ -0,0 +1,93 @@
+import json, time, signal, asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+from finance.async_notifications import AsyncNotificationWorker
+from finance.notifications import get_redis, get_sms_session, send_sms, get_provider
+
+# замер не трогает очередь и буферы рабочего воркера
+BENCHMARK_BUFFER_KEY = 'sms:benchmark:buffer:{}'
+BENCHMARK_DUE_KEY = 'sms:benchmark:due'
+
+
+class Command(BaseCommand):
+    help = 'Asyncio-воркер смс-уведомлений (SMS_WORKER_MODE=asyncio)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Максимум одновременных отправок')
+        parser.add_argument(
+            '--benchmark', type=int, metavar='N',
+            help='Замер: отправить N сводок на локальный fake-провайдер и сравнить с 4 блокирующими отправками',
+        )
+        parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа fake-провайдера, сек.')
+
+    def handle(self, *args, **options):
+        overrides = {'concurrency': options['concurrency']} if options['concurrency'] else {}
+        if options['benchmark']:
+            asyncio.run(self.benchmark(options['benchmark'], options['latency'], overrides))
+            return
+        asyncio.run(self.serve(overrides))
+
+    async def serve(self, overrides: dict) -> None:
+        worker = AsyncNotificationWorker.from_settings(**overrides)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.stop)
+        self.stdout.write(f'Воркер уведомлений запущен, concurrency={worker.concurrency}')
+        await worker.run()
+
+    async def benchmark(self, count: int, latency: float, overrides: dict) -> None:
+        async def fake_provider(request):
+            await asyncio.sleep(latency)
+            return web.Response(text='OK')
+
+        app = web.Application()
+        app.router.add_get('/send', fake_provider)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        provider_url = f'http://127.0.0.1:{port}/send?login=benchmark'
+
+        redis_client = get_redis()
+        try:
+            pipeline = redis_client.pipeline()
+            for number in range(count):
+                account = f'benchmark-{number}'
+                pipeline.rpush(BENCHMARK_BUFFER_KEY.format(account), json.dumps(
+                    {'sender_name': 'Benchmark', 'amount': '1.00', 'currency': 'RUR'},
+                ))
+                pipeline.zadd(BENCHMARK_DUE_KEY, {json.dumps([account, '+70000000000']): 0})
+            pipeline.execute()
+
+            worker = AsyncNotificationWorker.from_settings(
+                provider_url=provider_url, buffer_key=BENCHMARK_BUFFER_KEY, due_key=BENCHMARK_DUE_KEY,
+                poll_interval=0.01, **overrides,
+            )
+            started = time.perf_counter()
+            await worker.run(until_empty=True)
+            async_duration = time.perf_counter() - started
+
+            # базовая линия: prefork-воркер Celery с --concurrency=4 и блокирующими запросами
+            get_sms_session.cache_clear()
+            provider = get_provider(provider_url)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                await asyncio.gather(*[
+                    loop.run_in_executor(executor, send_sms, '+70000000000', 'benchmark', provider, provider_url)
+                    for _ in range(count)
+                ])
+            blocking_duration = time.perf_counter() - started
+        finally:
+            await runner.cleanup()
+            redis_client.delete(BENCHMARK_DUE_KEY, *redis_client.scan_iter(BENCHMARK_BUFFER_KEY.format('*')))
+
+        self.stdout.write(
+            f'asyncio: {worker.sent} смс за {async_duration:.2f} с ({worker.sent / async_duration:.0f}/с), '
+            f'concurrency={worker.concurrency}\n'
+            f'4 блокирующих воркера: {count} смс за {blocking_duration:.2f} с ({count / blocking_duration:.0f}/с)'
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-19 10:14
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('finance', '0005_application_applicationlog'),
+        ('users', '0006_user_trgm_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='account',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('number', output_field=models.TextField())), name='gin_trgm_ops'), name='account_number_trgm_idx'),
+        ),
+    ]
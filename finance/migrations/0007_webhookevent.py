@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-19 17:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_account_number_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('event', models.CharField(max_length=50, verbose_name='Событие')),
+                ('payment_id', models.UUIDField(db_index=True, verbose_name='Id платежа')),
+                ('payload', models.JSONField(verbose_name='Тело уведомления')),
+                ('status', models.CharField(choices=[('new', 'Ожидает обработки'), ('processed', 'Обработано'), ('failed', 'Ошибка')], default='new', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Количество попыток')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('error', models.CharField(blank=True, max_length=3000, null=True, verbose_name='Ошибка')),
+            ],
+            options={
+                'verbose_name': 'Уведомление Yookassa',
+                'verbose_name_plural': 'Уведомления Yookassa',
+                'indexes': [models.Index(condition=models.Q(('status', 'new')), fields=['next_attempt_at'], name='webhookevent_new_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0007_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(condition=models.Q(('status__in', ('pending', 'waiting_for_capture'))), fields=['id'], name='application_open_idx'),
+        ),
+    ]
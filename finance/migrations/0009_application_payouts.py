@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-19 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0008_application_open_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='payout_token',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Токен реквизитов для выплаты'),
+        ),
+        migrations.AlterField(
+            model_name='application',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В обработке'), ('waiting_for_capture', 'К зачислению'), ('approved', 'Одобрено к выплате'), ('processing', 'Выплачивается'), ('cancelled', 'Отменено'), ('completed', 'Выполнено'), ('error', 'Ошибка')], max_length=20, verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='applicationlog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В обработке'), ('waiting_for_capture', 'К зачислению'), ('approved', 'Одобрено к выплате'), ('processing', 'Выплачивается'), ('cancelled', 'Отменено'), ('completed', 'Выполнено'), ('error', 'Ошибка')], max_length=20, verbose_name='Статус'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_application_payouts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('topic', models.CharField(max_length=100, verbose_name='Тема')),
+                ('payload', models.JSONField(verbose_name='Тело сообщения')),
+                ('status', models.CharField(choices=[('new', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='new', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Количество попыток')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Время отправки')),
+                ('error', models.CharField(blank=True, max_length=3000, null=True, verbose_name='Ошибка')),
+            ],
+            options={
+                'verbose_name': 'Исходящее сообщение',
+                'verbose_name_plural': 'Исходящие сообщения',
+                'indexes': [models.Index(condition=models.Q(('status', 'new')), fields=['id'], name='outboxmessage_new_idx')],
+            },
+        ),
+    ]
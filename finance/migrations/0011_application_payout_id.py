@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0010_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='payout_id',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Id выплаты'),
+        ),
+    ]
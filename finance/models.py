@@ -1,5 +1,8 @@
 import uuid
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import Cast, Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import RegexValidator, MinLengthValidator, MinValueValidator
 from decimal import Decimal
 
@@ -44,6 +47,13 @@ class Account(AbstarctBaseModel):
     class Meta:
         verbose_name = 'Счет'
         verbose_name_plural = 'Счета'
+        indexes = [
+            # триграммный индекс под поиск по части номера счета
+            GinIndex(
+                OpClass(Upper(Cast('number', output_field=models.TextField())), name='gin_trgm_ops'),
+                name='account_number_trgm_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'{self.id} | {self.number} | {self.balance} | {self.сurrency.symbol}'
@@ -109,6 +119,8 @@ class Application(AbstarctBaseModel):
 
     PENDING = 'pending'
     WAITING_FOR_CAPTURE = 'waiting_for_capture'
+    APPROVED = 'approved'
+    PROCESSING = 'processing'
     CANCELLED = 'cancelled'
     COMPLETED = 'completed'
     ERROR = 'error'
@@ -116,6 +128,8 @@ class Application(AbstarctBaseModel):
     STATUS = (
         (PENDING, 'В обработке'),
         (WAITING_FOR_CAPTURE, 'К зачислению'),
+        (APPROVED, 'Одобрено к выплате'),
+        (PROCESSING, 'Выплачивается'),
         (CANCELLED, 'Отменено'),
         (COMPLETED, 'Выполнено'),
         (ERROR, 'Ошибка'),
@@ -131,13 +145,25 @@ class Application(AbstarctBaseModel):
         default=0,
         validators=[MinValueValidator(0)],
     )
-    payment_type = models.CharField(verbose_name='Тип платежа', choices=TYPE, max_length=20)
+    type = models.CharField(verbose_name='Тип платежа', choices=PAYMENT_TYPE, max_length=20)
     status = models.CharField(verbose_name='Статус', choices=STATUS, max_length=20)
     error = models.CharField(verbose_name='Ошибка', max_length=3000, blank=True, null=True)
+    payout_token = models.CharField(verbose_name='Токен реквизитов для выплаты', max_length=255, blank=True, null=True)
+    payout_id = models.CharField(verbose_name='Id выплаты', max_length=64, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # частичный индекс под keyset-обход незавершенных заявок при сверке с Yookassa
+            models.Index(
+                fields=('id',),
+                condition=models.Q(status__in=('pending', 'waiting_for_capture')),
+                name='application_open_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'{self.id} | account: {self.amount} | currency: {self.currency} | payment_id: {self.payment_id} | ' \
-               f'amount: {self.amount} | payment_type: {self.payment_type} | status: {self.status} | error: {self.error}'
+               f'amount: {self.amount} | type: {self.type} | status: {self.status} | error: {self.error}'
 
 
 class ApplicationLog(AbstarctBaseModel):
@@ -149,3 +175,68 @@ class ApplicationLog(AbstarctBaseModel):
     def __str__(self) -> str:
         return f'{self.id} | application_id: {self.application.id} | created_at: {self.created} | updated_at: ' \
                f'{self.last_updated} | status: {self.status}'
+
+
+class WebhookEvent(AbstarctBaseModel):
+    """Входящее уведомление Yookassa (inbox), обрабатывается асинхронно"""
+
+    NEW = 'new'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+
+    STATUS = (
+        (NEW, 'Ожидает обработки'),
+        (PROCESSED, 'Обработано'),
+        (FAILED, 'Ошибка'),
+    )
+
+    event = models.CharField(verbose_name='Событие', max_length=50)
+    payment_id = models.UUIDField(verbose_name='Id платежа', db_index=True)
+    payload = models.JSONField(verbose_name='Тело уведомления')
+    status = models.CharField(verbose_name='Статус', choices=STATUS, max_length=20, default=NEW)
+    attempts = models.PositiveSmallIntegerField(verbose_name='Количество попыток', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка', default=timezone.now)
+    error = models.CharField(verbose_name='Ошибка', max_length=3000, blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Уведомление Yookassa'
+        verbose_name_plural = 'Уведомления Yookassa'
+        indexes = [
+            models.Index(fields=('next_attempt_at',), condition=models.Q(status='new'), name='webhookevent_new_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.id} | event: {self.event} | payment_id: {self.payment_id} | status: {self.status} | ' \
+               f'attempts: {self.attempts}'
+
+
+class OutboxMessage(AbstarctBaseModel):
+    """Исходящее сообщение (outbox), пишется в одной транзакции с изменениями и отправляется релеем"""
+
+    NEW = 'new'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS = (
+        (NEW, 'Ожидает отправки'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка'),
+    )
+
+    topic = models.CharField(verbose_name='Тема', max_length=100)
+    payload = models.JSONField(verbose_name='Тело сообщения')
+    status = models.CharField(verbose_name='Статус', choices=STATUS, max_length=20, default=NEW)
+    attempts = models.PositiveSmallIntegerField(verbose_name='Количество попыток', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка', default=timezone.now)
+    sent_at = models.DateTimeField(verbose_name='Время отправки', blank=True, null=True)
+    error = models.CharField(verbose_name='Ошибка', max_length=3000, blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Исходящее сообщение'
+        verbose_name_plural = 'Исходящие сообщения'
+        indexes = [
+            models.Index(fields=('id',), condition=models.Q(status='new'), name='outboxmessage_new_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.id} | topic: {self.topic} | status: {self.status} | attempts: {self.attempts}'
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import redis
+import requests
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+SMS_NOTIFICATIONS_BUFFERED = Counter(
+    'sms_notifications_buffered_total',
+    'Уведомления о переводах, поставленные в буфер',
+)
+SMS_MESSAGES_SENT = Counter(
+    'sms_messages_sent_total',
+    'Отправленные смс',
+    ['provider', 'outcome'],
+)
+SMS_DIGEST_SIZE = Histogram(
+    'sms_digest_notifications',
+    'Количество уведомлений, объединенных в одно смс (коэффициент объединения)',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+SMS_MESSAGES_SAVED = Counter(
+    'sms_messages_saved_total',
+    'Смс, которые не пришлось отправлять благодаря объединению уведомлений',
+)
+SMS_COST_SAVED = Counter(
+    'sms_cost_saved_total',
+    'Сэкономленная стоимость смс, руб.',
+)
+
+BUFFER_KEY = 'sms:buffer:{}'
+# уже принятые в буфер уведомления: повторная доставка того же сообщения outbox не дублирует перевод в смс
+NOTIFICATION_KEY = 'sms:notification:{}'
+# получатели, по которым отправка сводки уже запланирована задачей Celery
+SCHEDULED_KEY = 'sms:scheduled:{}'
+RATE_KEY = 'sms:rate:{}:{}'
+# сводки к отправке для asyncio-воркера: [счет, телефон] -> время отправки
+DUE_KEY = 'sms:due'
+
+# возвращает длину буфера после добавления или 0, если уведомление с этим id уже было принято
+BUFFER_SCRIPT = """
+if ARGV[3] ~= '' and not redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[2]) then
+    return 0
+end
+local buffered = redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return buffered
+"""
+
+
+@lru_cache(maxsize=None)
+def get_redis() -> redis.StrictRedis:
+    """Подключение к Redis для буфера уведомлений, одно на процесс"""
+
+    return redis.StrictRedis.from_url(settings.SMS_REDIS_URL)
+
+
+@lru_cache(maxsize=None)
+def get_sms_session() -> requests.Session:
+    """HTTP-сессия к смс-провайдеру с пулом keep-alive соединений, одна на процесс"""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SMS_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_provider(url: str = None) -> str:
+    return urlsplit(url or os.environ.get('SMS_PROVIDER') or '').netloc
+
+
+def get_buffer_ttl() -> int:
+    # буфер и отметки не должны пережить потерянную задачу отправки
+    return max(settings.SMS_COALESCE_WINDOW * 10, 600)
+
+
+def buffer_transfer_notification(
+    receivers_account: str, sender_name: str, amount: Decimal, currency: str, notification_id=None,
+) -> bool:
+    """
+    Постановка уведомления о переводе в буфер получателя.
+    Уведомление с уже принятым notification_id (повторная доставка сообщения outbox) пропускается.
+    Возвращает True для первого уведомления в буфере, остальные уведомления за окно уйдут в том же смс.
+    """
+
+    notification = json.dumps({'sender_name': sender_name, 'amount': str(amount), 'currency': currency})
+    buffered = get_redis().eval(
+        BUFFER_SCRIPT, 2,
+        BUFFER_KEY.format(receivers_account), NOTIFICATION_KEY.format(notification_id),
+        notification, get_buffer_ttl(), '' if notification_id is None else str(notification_id),
+    )
+    if not buffered:
+        return False
+    SMS_NOTIFICATIONS_BUFFERED.inc()
+    return buffered == 1
+
+
+def schedule_digest(receivers_account: str, phone: str) -> bool:
+    """
+    Планирование отправки сводки через SMS_COALESCE_WINDOW секунд:
+    отложенной задачей Celery или записью в очередь asyncio-воркера (SMS_WORKER_MODE).
+    Идемпотентно: пока сводка получателю не отправлена, повторный вызов ничего не планирует.
+    Возвращает True, если отправка запланирована этим вызовом
+    """
+
+    if settings.SMS_WORKER_MODE == 'asyncio':
+        return bool(get_redis().zadd(
+            DUE_KEY, {json.dumps([receivers_account, phone]): time.time() + settings.SMS_COALESCE_WINDOW}, nx=True,
+        ))
+
+    from .tasks import send_notification
+
+    scheduled_key = SCHEDULED_KEY.format(receivers_account)
+    if not get_redis().set(scheduled_key, 1, nx=True, ex=get_buffer_ttl()):
+        return False
+    try:
+        send_notification.apply_async((receivers_account, phone), countdown=settings.SMS_COALESCE_WINDOW)
+    except Exception:
+        # задача не поставлена: следующий вызов должен запланировать ее заново
+        get_redis().delete(scheduled_key)
+        raise
+    return True
+
+
+def take_buffered_notifications(receivers_account: str) -> list:
+    """Атомарное извлечение всех уведомлений из буфера получателя"""
+
+    pipeline = get_redis().pipeline(transaction=True)
+    pipeline.lrange(BUFFER_KEY.format(receivers_account), 0, -1)
+    # уведомления после извлечения планируют новую отправку
+    pipeline.delete(BUFFER_KEY.format(receivers_account), SCHEDULED_KEY.format(receivers_account))
+    notifications, _ = pipeline.execute()
+    return [json.loads(notification) for notification in notifications]
+
+
+def acquire_rate_limit(provider: str) -> bool:
+    """Ограничение частоты запросов к провайдеру: не более SMS_RATE_LIMIT смс в секунду на все воркеры"""
+
+    key = RATE_KEY.format(provider, int(time.time()))
+    pipeline = get_redis().pipeline()
+    pipeline.incr(key)
+    pipeline.expire(key, 2)
+    sent, _ = pipeline.execute()
+    return sent <= settings.SMS_RATE_LIMIT
+
+
+def build_message(notifications: list) -> str:
+    """Текст смс: одиночный перевод с именем отправителя или сводка по всем переводам за окно"""
+
+    if len(notifications) == 1:
+        notification = notifications[0]
+        return f"Зачислен перевод на сумму {notification['amount']}{notification['currency']} " \
+               f"от {notification['sender_name']}"
+
+    totals = defaultdict(Decimal)
+    for notification in notifications:
+        totals[notification['currency']] += Decimal(notification['amount'])
+    total = ', '.join(f'{amount}{currency}' for currency, amount in totals.items())
+    return f"Зачислено переводов: {len(notifications)}, на общую сумму {total}"
+
+
+def send_sms(phone: str, message: str, provider: str, url: str = None) -> bool:
+    """Отправка смс через пул соединений, url провайдера по умолчанию - из SMS_PROVIDER"""
+
+    try:
+        response = get_sms_session().get(
+            url or os.environ.get('SMS_PROVIDER'),
+            params={'phones': phone, 'mes': message},
+            timeout=settings.SMS_TIMEOUT,
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as error:
+        logger.error(msg={'Ошибка отправки смс': error})
+        SMS_MESSAGES_SENT.labels(provider, 'error').inc()
+        return False
+
+    SMS_MESSAGES_SENT.labels(provider, 'success').inc()
+    return True
+
+
+def record_coalescing(notifications_count: int) -> None:
+    """Метрики объединения: размер сводки и сэкономленные смс"""
+
+    SMS_DIGEST_SIZE.observe(notifications_count)
+    SMS_MESSAGES_SAVED.inc(notifications_count - 1)
+    SMS_COST_SAVED.inc((notifications_count - 1) * settings.SMS_MESSAGE_COST)
@@ -0,0 +1,120 @@
+import json
+import random
+import logging
+from datetime import timedelta
+from typing import Callable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from prometheus_client import Counter
+
+from .models import OutboxMessage
+from .notifications import buffer_transfer_notification, schedule_digest, get_redis
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MESSAGES_RELAYED = Counter(
+    'outbox_messages_relayed_total',
+    'Сообщения outbox, переданные релеем',
+    ['topic', 'outcome'],
+)
+
+TRANSFER_RECEIVED = 'transfer_received'
+
+# обработчики тем: сообщения без своего обработчика публикуются в Redis Stream outbox:<тема>
+HANDLERS = {}
+
+
+def handler(topic: str) -> Callable:
+    """Регистрация обработчика сообщений темы"""
+
+    def register(func: Callable) -> Callable:
+        HANDLERS[topic] = func
+        return func
+
+    return register
+
+
+def publish(topic: str, payload: dict) -> OutboxMessage:
+    """
+    Запись сообщения в outbox.
+    Вызывается внутри транзакции, изменения которой описывает сообщение: при откате сообщение не сохранится,
+    а запрос не зависит от доступности брокера.
+    """
+
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def publish_to_stream(message: OutboxMessage) -> None:
+    """Публикация сообщения в Redis Stream темы"""
+
+    get_redis().xadd(
+        f'outbox:{message.topic}',
+        {'id': message.id, 'payload': json.dumps(message.payload)},
+        maxlen=settings.OUTBOX_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+@handler(TRANSFER_RECEIVED)
+def dispatch_transfer_notification(message: OutboxMessage) -> None:
+    """
+    Уведомление о входящем переводе уходит в буфер смс получателя.
+    При повторной доставке сообщения уведомление не дублируется, а отправка планируется, если ее не успели поставить
+    """
+
+    payload = message.payload
+    buffer_transfer_notification(
+        payload['receivers_account'], payload['sender_name'], payload['amount'], payload['currency'],
+        notification_id=message.id,
+    )
+    schedule_digest(payload['receivers_account'], payload['phone'])
+
+
+def postpone_message(message: OutboxMessage, error: Exception) -> None:
+    """Перенос сообщения на повторную передачу с экспоненциальной задержкой и джиттером"""
+
+    attempts = message.attempts + 1
+    delay = min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_DELAY)
+    OutboxMessage.objects.filter(id=message.id).update(
+        attempts=F('attempts') + 1,
+        status=OutboxMessage.FAILED if attempts >= settings.OUTBOX_MAX_ATTEMPTS else OutboxMessage.NEW,
+        next_attempt_at=timezone.now() + timedelta(seconds=random.uniform(delay / 2, delay)),
+        error=str(error)[:3000],
+    )
+
+
+def relay_outbox_messages(batch_size: int) -> int:
+    """
+    Передача пачки сообщений из outbox.
+    Строки, заблокированные параллельным релеем, пропускаются (SKIP LOCKED), поэтому релеев может быть несколько.
+    Доставка не реже одного раза: если релей упадет после отправки, сообщение будет отправлено повторно.
+    Сообщение, которое не удалось передать, откладывается с экспоненциальной задержкой, чтобы недоступный
+    обработчик не разбирал одни и те же сообщения на каждом проходе релея.
+    Возвращает количество успешно переданных сообщений.
+    """
+
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxMessage.NEW, next_attempt_at__lte=timezone.now())
+            .order_by('id')[:batch_size]
+        )
+
+        sent_ids = []
+        for message in messages:
+            try:
+                HANDLERS.get(message.topic, publish_to_stream)(message)
+            except Exception as error:
+                logger.error(msg={f'Ошибка передачи сообщения outbox {message.id}': error})
+                OUTBOX_MESSAGES_RELAYED.labels(message.topic, 'error').inc()
+                postpone_message(message, error)
+                continue
+            OUTBOX_MESSAGES_RELAYED.labels(message.topic, 'success').inc()
+            sent_ids.append(message.id)
+
+        OutboxMessage.objects.filter(id__in=sent_ids).update(status=OutboxMessage.SENT, sent_at=timezone.now())
+
+    return len(sent_ids)
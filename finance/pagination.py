@@ -13,4 +13,16 @@ class AccountPagination(PageNumberPagination):
 
     page_size = 2
     page_size_query_param = 'page_size'
-    max_page_size = 50
\ No newline at end of file
+    max_page_size = 50
+
+
+class AccountSearchPagination(PageNumberPagination):
+    """
+    Пагинация результатов поиска счетов.
+    По номеру страницы, а не по курсору: курсор DRF строится по первому полю сортировки,
+    а неуникальный ранг похожести пропускал бы или повторял счета с равным рангом
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
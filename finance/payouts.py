@@ -0,0 +1,271 @@
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Case, When, Value, CharField, DecimalField
+from django.utils import timezone
+from prometheus_client import Counter, Histogram
+
+from .gateway import PaymentGatewayError, PaymentGatewayUnavailable, get_yookassa_client
+from .models import Account, Application
+from .transitions import ApplicationTransitions
+
+logger = logging.getLogger(__name__)
+
+PAYOUT_BATCH_DURATION = Histogram(
+    'payout_batch_duration_seconds',
+    'Длительность обработки пачки выплат',
+    ['batch_size'],
+)
+PAYOUTS = Counter(
+    'payouts_total',
+    'Выплаты по результату обработки',
+    ['outcome'],
+)
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+RETRY = 'retry'
+
+APPLICATION_FIELDS = ('id', 'account_id', 'amount', 'payout_token', 'payout_id', 'last_updated')
+
+
+def batch_size_label(size: int) -> str:
+    """Диапазон размера пачки для метки метрики, чтобы не плодить метки на каждый размер"""
+
+    for bound in (10, 100, 1000):
+        if size <= bound:
+            return f'<={bound}'
+    return '>1000'
+
+
+def reserve_funds(totals: dict) -> set:
+    """
+    Резервирование средств под пачку выплат одним UPDATE.
+    Списание проходит только по счетам, где баланса хватает на всю сумму, возвращаются id этих счетов.
+    """
+
+    if not totals:
+        return set()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {Account._meta.db_table} AS account SET balance = account.balance - reserve.amount '
+            f'FROM (SELECT unnest(%s::bigint[]) AS account_id, unnest(%s::numeric[]) AS amount) AS reserve '
+            f'WHERE account.id = reserve.account_id AND account.balance >= reserve.amount '
+            f'RETURNING account.id',
+            [list(totals.keys()), list(totals.values())],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def claim_payout_batch(batch_size: int) -> list:
+    """
+    Сбор пачки одобренных заявок на вывод.
+    Пачка отправляется, когда набралось batch_size заявок или самая старая ждет дольше PAYOUT_MAX_WAIT.
+    Заявки переводятся в processing, средства по ним резервируются одним UPDATE на пачку,
+    заявки по счетам с недостаточным балансом переводятся в ошибку.
+    """
+
+    candidates = list(
+        Application.objects.filter(type=Application.WITHDRAWAL, status=Application.APPROVED)
+        .order_by('id')
+        .values(*APPLICATION_FIELDS)[:batch_size]
+    )
+    if not candidates:
+        return []
+    oldest = min(candidate['last_updated'] for candidate in candidates)
+    if len(candidates) < batch_size and oldest > timezone.now() - timedelta(seconds=settings.PAYOUT_MAX_WAIT):
+        return []
+
+    with transaction.atomic(), ApplicationTransitions() as transitions:
+        claimed_ids = set(transitions.transition_many(
+            [candidate['id'] for candidate in candidates], Application.APPROVED, Application.PROCESSING,
+        ))
+        claimed = [candidate for candidate in candidates if candidate['id'] in claimed_ids]
+
+        totals = defaultdict(Decimal)
+        for application in claimed:
+            totals[application['account_id']] += application['amount']
+        reserved_accounts = reserve_funds(totals)
+
+        rejected_ids = [
+            application['id'] for application in claimed if application['account_id'] not in reserved_accounts
+        ]
+        if rejected_ids:
+            transitions.transition_many(rejected_ids, Application.PROCESSING, Application.ERROR)
+            Application.objects.filter(id__in=rejected_ids).update(error='Недостаточно средств на счете')
+            PAYOUTS.labels('insufficient_funds').inc(len(rejected_ids))
+
+    return [application for application in claimed if application['account_id'] in reserved_accounts]
+
+
+def collect_unfinished_payouts(limit: int) -> list:
+    """
+    Заявки, зависшие в processing после временной ошибки провайдера или в ожидании результата выплаты.
+    Выплаты, созданные у провайдера, опрашиваются по id. Заявки без ответа провайдера отправляются повторно
+    с тем же ключом идемпотентности, поэтому выплата не будет создана дважды; такие заявки старше
+    PAYOUT_RESUBMIT_WINDOW (срок жизни ключа у провайдера) оставляются для ручной сверки.
+    """
+
+    now = timezone.now()
+    return list(
+        Application.objects.filter(
+            Q(payout_id__isnull=False) | Q(last_updated__gte=now - timedelta(seconds=settings.PAYOUT_RESUBMIT_WINDOW)),
+            type=Application.WITHDRAWAL,
+            status=Application.PROCESSING,
+            last_updated__lt=now - timedelta(seconds=settings.PAYOUT_RESUBMIT_AFTER),
+        )
+        .order_by('id')
+        .values(*APPLICATION_FIELDS)[:limit]
+    )
+
+
+def submit_payout(application: dict) -> tuple:
+    """
+    Отправка выплаты провайдеру или опрос уже созданной выплаты, возвращает (результат, текст ошибки, id выплаты).
+    Выполняется в пуле потоков, поэтому к базе не обращается.
+    """
+
+    if application['payout_id']:
+        return poll_payout(application)
+
+    try:
+        payout = get_yookassa_client().create_payout(
+            {
+                "amount": {
+                    "value": str(application['amount']),
+                    "currency": "RUB",
+                },
+                "payout_token": application['payout_token'],
+                "description": f"Выплата по заявке {application['id']}",
+                "metadata": {"application_id": application['id']},
+            },
+            f"payout-{application['id']}",
+        )
+    except PaymentGatewayUnavailable as error:
+        return RETRY, str(error), None
+    except PaymentGatewayError as error:
+        # отказ провайдера в создании выплаты (4xx) окончательный, остальные ошибки временные
+        if error.status_code and 400 <= error.status_code < 500:
+            return FAILED, str(error), None
+        return RETRY, str(error), None
+    return get_payout_result(payout)
+
+
+def poll_payout(application: dict) -> tuple:
+    """
+    Опрос уже созданной выплаты. Любая ошибка опроса, в том числе 4xx, временная: выплата у провайдера
+    существует и может еще завершиться, поэтому заявка остается в processing до следующего опроса
+    """
+
+    try:
+        payout = get_yookassa_client().get_payout(application['payout_id'])
+    except PaymentGatewayError as error:
+        return RETRY, str(error), application['payout_id']
+    return get_payout_result(payout)
+
+
+def get_payout_result(payout) -> tuple:
+    if payout.status == 'succeeded':
+        return SUCCEEDED, None, payout.id
+    if payout.status == 'canceled':
+        return FAILED, 'Выплата отменена провайдером', payout.id
+    # выплата создана, но еще не завершена: дальше она опрашивается по id, а не отправляется повторно
+    return RETRY, None, payout.id
+
+
+def group_payout_results(applications: list, results: list) -> tuple:
+    """Id заявок по результату, тексты ошибок и новые id выплат по id заявки"""
+
+    ids_by_outcome = defaultdict(list)
+    errors = {}
+    payout_ids = {}
+    for application, (outcome, error, payout_id) in zip(applications, results):
+        ids_by_outcome[outcome].append(application['id'])
+        if error:
+            errors[application['id']] = error[:3000]
+        if payout_id and payout_id != application['payout_id']:
+            payout_ids[application['id']] = payout_id
+    return ids_by_outcome, errors, payout_ids
+
+
+def apply_payout_results(applications: list, results: list) -> dict:
+    """
+    Применение результатов выплат одной транзакцией.
+    Успешные заявки завершаются, отклоненные переводятся в ошибку с возвратом средств на счет,
+    заявки с временной ошибкой остаются в processing и будут отправлены повторно или опрошены - без повторной
+    обработки всей пачки. Id выплат, созданных провайдером, сохраняются в заявках.
+    """
+
+    ids_by_outcome, errors, payout_ids = group_payout_results(applications, results)
+    applications_by_id = {application['id']: application for application in applications}
+    with transaction.atomic(), ApplicationTransitions() as transitions:
+        if payout_ids:
+            Application.objects.filter(id__in=payout_ids.keys()).update(
+                payout_id=Case(
+                    *[When(id=application_id, then=Value(value)) for application_id, value in payout_ids.items()],
+                    output_field=CharField(),
+                ),
+            )
+        transitions.transition_many(ids_by_outcome[SUCCEEDED], Application.PROCESSING, Application.COMPLETED)
+        failed_ids = transitions.transition_many(ids_by_outcome[FAILED], Application.PROCESSING, Application.ERROR)
+
+        if failed_ids:
+            refunds = defaultdict(Decimal)
+            for application_id in failed_ids:
+                application = applications_by_id[application_id]
+                refunds[application['account_id']] += application['amount']
+            Account.objects.filter(id__in=refunds.keys()).update(
+                balance=F('balance') + Case(
+                    *[When(id=account_id, then=Value(amount)) for account_id, amount in refunds.items()],
+                    output_field=DecimalField(max_digits=11, decimal_places=2),
+                ),
+            )
+
+        failed_errors = {application_id: errors[application_id] for application_id in failed_ids}
+        if failed_errors:
+            Application.objects.filter(id__in=failed_errors.keys()).update(
+                error=Case(
+                    *[When(id=application_id, then=Value(error)) for application_id, error in failed_errors.items()],
+                    output_field=CharField(),
+                ),
+            )
+
+    stats = {outcome: len(ids_by_outcome[outcome]) for outcome in (SUCCEEDED, FAILED, RETRY)}
+    for outcome, count in stats.items():
+        PAYOUTS.labels(outcome).inc(count)
+    return stats
+
+
+def process_payouts(batch_size: int) -> dict:
+    """
+    Обработка пачки выплат: сбор одобренных заявок и резервирование средств, отправка выплат провайдеру
+    с ограниченной параллельностью и применение результатов. Пропускная способность замеряется на каждую пачку.
+    """
+
+    started = time.perf_counter()
+    applications = claim_payout_batch(batch_size)
+    applications += collect_unfinished_payouts(batch_size - len(applications))
+    if not applications:
+        return {'batch_size': 0}
+
+    with ThreadPoolExecutor(max_workers=settings.PAYOUT_CONCURRENCY) as executor:
+        results = list(executor.map(submit_payout, applications))
+
+    stats = apply_payout_results(applications, results)
+    duration = time.perf_counter() - started
+    PAYOUT_BATCH_DURATION.labels(batch_size_label(len(applications))).observe(duration)
+
+    stats.update({
+        'batch_size': len(applications),
+        'duration': round(duration, 3),
+        'per_second': round(len(applications) / duration, 1),
+    })
+    logger.info(msg={'Пачка выплат обработана': stats})
+    return stats
@@ -46,6 +46,12 @@ class CalculateAmountsSerializer(serializers.Serializer):
             raise ValidationError('На счете недостаточно средств для выполнения операции')
 
 
+class AccountSearchSerializer(serializers.Serializer):
+    """Поиск счетов по части логина, телефона или номера счета"""
+
+    q = serializers.CharField(required=True, min_length=3, max_length=255)
+
+
 class UpdateBalanceSerializer(serializers.ModelSerializer):
     """Изменить баланс пользователя через личный кабинет Администратора"""
 
@@ -58,7 +64,12 @@ class CreateApplicationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Application
-        fields = ('amount', 'type')
+        fields = ('amount', 'type', 'payout_token')
+
+    def validate(self, data):
+        if data.get('type') == Application.WITHDRAWAL and not data.get('payout_token'):
+            raise ValidationError('Для вывода средств необходимо указать токен реквизитов для выплаты')
+        return data
 
 class ApplicationSerializer(serializers.ModelSerializer):
     """Заявка на вывод средств"""
@@ -1,19 +1,42 @@
-import redis, os, uuid, json, logging
+import redis, os, json, random, logging, ipaddress
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Optional
 from _decimal import Decimal
-from requests import RequestException
-from django.db.models import F
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import F, Case, When, Value, DecimalField, QuerySet, TextField
+from django.db.models.functions import Cast, Greatest
 from rest_framework.exceptions import ValidationError
 from rest_framework.request import Request
 from rest_framework.serializers import Serializer
-from yookassa import Payment, Configuration
 from yookassa.domain.notification import WebhookNotification
 
-from .models import Account, Transaction, Currency, Application, ApplicationLog
-from .tasks import send_notification
+from .gateway import PaymentGatewayError, PaymentGatewayUnavailable, get_yookassa_client
+from .models import Account, Transaction, Currency, Application, WebhookEvent
+from .outbox import TRANSFER_RECEIVED, publish
+from .transitions import ApplicationTransitions
+from common.aio import per_event_loop
 from common.exceptions import BadRequest
+from users.models import User
 
 logger = logging.getLogger('__name__')
 
+OPEN_APPLICATION_STATUSES = (Application.PENDING, Application.WAITING_FOR_CAPTURE)
+
+# статусы платежа в Yookassa, по которым заявка закрывается при сверке
+RECONCILED_STATUSES = {
+    'succeeded': Application.COMPLETED,
+    'canceled': Application.CANCELLED,
+}
+
+# валюты, курсы которых задача update_exchange_rates сохраняет в Redis
+RATES_CURRENCIES = ['USD', 'EUR', 'CNY']
+
 
 def calculate_new_amounts(debit_currency: str, credit_currency: str, debit_amount: Decimal) -> Decimal:
     """Рассчет суммы к зачислению при переводе средств"""
@@ -73,8 +96,8 @@ def send_funds(serializer: Serializer, request: Request) -> None:
         debit_description = 'перевод средств другому пользователю'
         credit_description = 'зачисление средств от другого пользователя'
 
-    sender = Account.objects.get(number=senders_account)
-    receiver = Account.objects.get(number=receivers_account)
+    sender = Account.objects.select_related('user').get(number=senders_account)
+    receiver = Account.objects.select_related('user').get(number=receivers_account)
 
     batch = [
         Transaction(
@@ -94,25 +117,36 @@ def send_funds(serializer: Serializer, request: Request) -> None:
     ]
     Transaction.objects.bulk_create(batch)
 
-    if receiver_type == 'counterparty':
-        send_notification.delay(senders_account, receivers_account, currency_to_receive)
+    # уведомление отправит релей outbox после фиксации транзакции перевода.
+    # Все данные для смс собираются здесь, чтобы воркеры уведомлений не обращались к базе
+    if receiver_type == 'counterparty' and receiver.user.sms_notification and receiver.user.phone:
+        publish(TRANSFER_RECEIVED, {
+            'receivers_account': str(receivers_account),
+            'phone': receiver.user.phone,
+            'sender_name': f'{sender.user.first_name}{sender.user.last_name}',
+            'amount': str(amount_to_receive),
+            'currency': currency_to_receive,
+        })
 
 
 def create_application(serializer: Serializer, request: Request) -> dict:
-    """Создание завяки на ввод средств"""
-
-    # задаем учетку
-    Configuration.account_id = os.environ.get('YOOKASSA_ACCOUNT_ID')
-    Configuration.secret_key = os.environ.get('YOOKASSA_SECRET_KEY')
+    """Создание завяки на ввод или вывод средств"""
 
     # создаем сущность заявки
     currency = Currency.objects.get(short_name='RUR')
     account_id = Account.objects.filter(сurrency_id=currency.id, user=request.user).values_list('id', flat=True)[0]
     application = serializer.save(currency=currency, status=Application.PENDING, account_id=account_id)
 
+    # заявка на вывод ждет одобрения, после чего выплата уходит пачкой (finance.payouts)
+    if application.type == Application.WITHDRAWAL:
+        return {
+            'application_id': application.id,
+            'status': application.status,
+        }
+
     # создаем заявку на оплату на внешнем сервисе
     try:
-        payment = Payment.create(
+        payment = get_yookassa_client().create_payment(
             {
                 "amount": {
                     "value": str(serializer.validated_data.get('amount')),
@@ -127,47 +161,144 @@ def create_application(serializer: Serializer, request: Request) -> dict:
                 },
                 "description": f"Заявка на поплнение счета {application.id}",
             },
-            str(uuid.uuid4()),
+            f'create-{application.id}',
+            # пользователь ждет ответа, поэтому без долгой серии повторов
+            max_retries=settings.YOOKASSA_VIEW_MAX_RETRIES,
         )
-    except RequestException as error:
+    except PaymentGatewayError as error:
         logger.error(msg={'Ошибка на стороне Yookassa при создании платежа': error})
+        with transaction.atomic(), ApplicationTransitions() as transitions:
+            transitions.transition(application.id, Application.PENDING, Application.ERROR)
+            Application.objects.filter(id=application.id).update(error=str(error)[:3000])
         raise BadRequest('Ошибка на стороне Yookassa при создании платежа', error)
 
-    application.payment_id = payment.payment_method.id
-    application.save()
+    application.payment_id = payment.id
+    application.save(update_fields=('payment_id', 'last_updated'))
 
     return {
         'confirmation_url': payment.confirmation.confirmation_url,
-        'payment_id': payment.payment_method.id
+        'payment_id': payment.id
     }
 
 
-def to_handle_webhook(request: Request) -> None:
-    """Обработка вебхука"""
-
-    Configuration.account_id = os.environ.get('YOOKASSA_ACCOUNT_ID')
-    Configuration.secret_key = os.environ.get('YOOKASSA_SECRET_KEY')
-
-    # получаем джейсон
-    event_json = json.loads(request.body)
+def parse_webhook(body: bytes) -> tuple:
+    """Разбор тела вебхука Yookassa: исходный json и объект уведомления"""
 
     try:
+        event_json = json.loads(body)
         notification_object = WebhookNotification(event_json)
     except Exception as error:  # здесь райзим validation error
         logger.error(msg={'Не удалось получить данный из джейсон при обработке webhook от Yookassa': error})
         raise BadRequest('Не удалось получить данный из джейсон при обработке webhook от Yookassa', error)
+    return event_json, notification_object
+
+
+def is_webhook_source_allowed(ip: str) -> bool:
+    """Вебхук пришел с адреса Yookassa из WEBHOOK_ALLOWED_IPS"""
+
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network.strip()) for network in settings.WEBHOOK_ALLOWED_IPS)
+
+
+def to_store_webhook(request: Request) -> None:
+    """Прием вебхука: уведомление сохраняется во входящую очередь (inbox) без обращений к Yookassa"""
+
+    event_json, notification_object = parse_webhook(request.body)
+    WebhookEvent.objects.create(
+        event=notification_object.event,
+        payment_id=notification_object.object.id,
+        payload=event_json,
+    )
+
+
+async def ato_store_webhook(body: bytes) -> None:
+    """Асинхронный прием вебхука для ASGI"""
+
+    event_json, notification_object = parse_webhook(body)
+    await WebhookEvent.objects.acreate(
+        event=notification_object.event,
+        payment_id=notification_object.object.id,
+        payload=event_json,
+    )
+
+
+def claim_webhook_events(batch_size: int) -> list:
+    """
+    Захват пачки необработанных уведомлений.
+    Строки, заблокированные параллельным обработчиком, пропускаются (SKIP LOCKED), у захваченных
+    next_attempt_at сдвигается на время аренды, чтобы упавший обработчик не держал их бесконечно.
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=WebhookEvent.NEW, next_attempt_at__lte=now)
+            .only('id', 'payment_id', 'attempts')
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+            next_attempt_at=now + timedelta(seconds=settings.WEBHOOK_LEASE_TIME),
+        )
+    return events
+
+
+def postpone_webhook_events(events: list, error: Exception) -> None:
+    """Перенос уведомлений на повторную обработку с экспоненциальной задержкой и джиттером"""
+
+    attempts = max(event.attempts for event in events) + 1
+    delay = min(settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX_DELAY)
+    WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+        attempts=attempts,
+        status=WebhookEvent.FAILED if attempts >= settings.WEBHOOK_MAX_ATTEMPTS else WebhookEvent.NEW,
+        next_attempt_at=timezone.now() + timedelta(seconds=random.uniform(delay / 2, delay)),
+        error=str(error)[:3000],
+    )
+
+
+def handle_webhook_events(batch_size: int) -> int:
+    """
+    Обработка пачки уведомлений из inbox.
+    Уведомления группируются по payment_id, и каждый платеж обрабатывается один раз на пачку.
+    """
+
+    events = claim_webhook_events(batch_size)
+
+    grouped_events = defaultdict(list)
+    for event in events:
+        grouped_events[event.payment_id].append(event)
+
+    processed_ids = []
+    for payment_id, payment_events in grouped_events.items():
+        try:
+            capture_payment(str(payment_id))
+        except Exception as error:
+            logger.error(msg={f'Ошибка при обработке уведомлений по платежу {payment_id}': error})
+            postpone_webhook_events(payment_events, error)
+        else:
+            processed_ids.extend(event.id for event in payment_events)
+
+    WebhookEvent.objects.filter(id__in=processed_ids).update(status=WebhookEvent.PROCESSED, error=None)
+
+    return len(events)
 
-    # получаем payment_id
-    payment_id = notification_object.object.id
+
+def capture_payment(payment_id: str) -> None:
+    """Подтверждение платежа в Yookassa и зачисление средств по заявке"""
+
+    client = get_yookassa_client()
 
     # проверяем есть ла такой платеж в базе
-    if not Application.objects.filter(payment_id=payment_id, status=Application.PENDING).exists():
+    application = Application.objects.filter(payment_id=payment_id, status=Application.PENDING).first()
+    if application is None:
         return
 
-    application = Application.objects.get(payment_id=payment_id)
-    # подтверждаем платеж
+    # подтверждаем платеж, ключ идемпотентности постоянный, чтобы повторная попытка не создала второй запрос
     try:
-        Payment.capture(
+        client.capture_payment(
             payment_id,
             {
                 "amount": {
@@ -175,34 +306,185 @@ def to_handle_webhook(request: Request) -> None:
                     "currency": "RUB",
                 },
             },
-            str(uuid.uuid4()),
+            f'capture-{payment_id}',
         )
-    except RequestException as error:
+    except PaymentGatewayError as error:
         logger.error(msg={f'Ошибка на стороне Yookassa при подтверждении платежа {payment_id}': error})
         raise BadRequest(f'Ошибка на стороне Yookassa при подтверждении платежа {payment_id}', error)
 
     # проверяем статус платежа get запросом
     try:
-        payment = Payment.find_one(payment_id)
-    except RequestException as error:
+        payment = client.get_payment(payment_id)
+    except PaymentGatewayError as error:
         logger.error(msg={f'Ошибка на стороне Yookassa при проверка статуса платежа {payment_id}': error})
         raise BadRequest(f'Ошибка на стороне Yookassa при проверка статуса платежа {payment_id}', error)
-    # если все ок  - обновляем статус, вносим запись в историю операций и пополняем баланс
-    if payment.status == 'succeeded':
-        # если все ок - обновляем статус, вносим запись в историю операций и пополняем баланс
-        Application.objects.filter(payment_id=payment_id).update(status=Application.COMPLETED)
-        ApplicationLog.objects.create(application=application, status=Application.COMPLETED)
-        Account.objects.filter(number=application.account.number).update(balance=F('balance') + application.amount)
 
-    else:
+    if payment.status != 'succeeded':
         raise BadRequest(f'Ошибка на стороне Yookassa. Платежа {payment_id} не переведен в статус succeeded', None)
 
+    # если все ок - обновляем статус, вносим запись в историю операций и пополняем баланс.
+    # Статус меняется условным UPDATE, поэтому параллельная обработка того же платежа не зачислит средства дважды
+    with transaction.atomic(), ApplicationTransitions() as transitions:
+        if not transitions.transition(application.id, Application.PENDING, Application.COMPLETED):
+            return
+        Account.objects.filter(id=application.account_id).update(balance=F('balance') + application.amount)
+
+
+def fetch_payment_status(application: dict) -> Optional[str]:
+    """
+    Статус платежа по заявке в Yookassa. Платеж, ожидающий подтверждения, подтверждается.
+    Выполняется в пуле потоков, поэтому к базе не обращается.
+    """
+
+    payment_id = str(application['payment_id'])
+    client = get_yookassa_client()
+    try:
+        payment = client.get_payment(payment_id)
+        if payment.status == 'waiting_for_capture':
+            payment = client.capture_payment(
+                payment_id,
+                {
+                    "amount": {
+                        "value": str(application['amount']),
+                        "currency": "RUB",
+                    },
+                },
+                f'capture-{payment_id}',
+            )
+    except PaymentGatewayUnavailable:
+        raise
+    except PaymentGatewayError as error:
+        logger.error(msg={f'Ошибка на стороне Yookassa при сверке платежа {payment_id}': error})
+        return None
+
+    return payment.status
+
+
+def apply_reconciled_statuses(applications: list, provider_statuses: list) -> int:
+    """
+    Применение статусов Yookassa к пачке заявок в одной транзакции:
+    по одному условному UPDATE на целевой статус, один bulk_create записей истории и одно обновление балансов.
+    Заявки, которые уже перевел обработчик вебхуков, условный UPDATE не затронет.
+    """
+
+    applications_by_target = defaultdict(dict)
+    for application, provider_status in zip(applications, provider_statuses):
+        if provider_status in RECONCILED_STATUSES:
+            applications_by_target[RECONCILED_STATUSES[provider_status]][application['id']] = application
+    if not applications_by_target:
+        return 0
+
+    updated = 0
+    credits = defaultdict(Decimal)
+    with transaction.atomic(), ApplicationTransitions() as transitions:
+        for target, target_applications in applications_by_target.items():
+            ids = transitions.transition_many(target_applications.keys(), OPEN_APPLICATION_STATUSES, target)
+            updated += len(ids)
+            if target == Application.COMPLETED:
+                for application_id in ids:
+                    credits[target_applications[application_id]['account_id']] += (
+                        target_applications[application_id]['amount']
+                    )
+
+        if credits:
+            Account.objects.filter(id__in=credits.keys()).update(
+                balance=F('balance') + Case(
+                    *[When(id=account_id, then=Value(amount)) for account_id, amount in credits.items()],
+                    output_field=DecimalField(max_digits=11, decimal_places=2),
+                ),
+            )
+
+    return updated
+
+
+def reconcile_stale_applications(batch_size: int, should_stop: Callable[[], bool] = lambda: False) -> dict:
+    """
+    Сверка зависших заявок (pending / waiting_for_capture) с Yookassa.
+    Заявки читаются keyset-пагинацией по id, статусы платежей запрашиваются параллельно
+    в ограниченном пуле потоков, результаты применяются одной транзакцией на пачку.
+    Проверенные заявки, которые остались открытыми, откладываются на RECONCILE_STALE_AFTER: прерванная сверка
+    продолжается со следующих заявок, а не начинается заново с тех же.
+    should_stop проверяется после каждой пачки, например, чтобы остановиться при потере блокировки задачи.
+    """
+
+    stale_before = timezone.now() - timedelta(seconds=settings.RECONCILE_STALE_AFTER)
+    stats = {'checked': 0, 'updated': 0}
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=settings.RECONCILE_CONCURRENCY) as executor:
+        while True:
+            applications = list(
+                Application.objects.filter(
+                    id__gt=last_id,
+                    status__in=OPEN_APPLICATION_STATUSES,
+                    payment_id__isnull=False,
+                    last_updated__lt=stale_before,
+                )
+                .order_by('id')
+                .values('id', 'payment_id', 'amount', 'account_id')[:batch_size]
+            )
+            if not applications:
+                break
+
+            provider_statuses = list(executor.map(fetch_payment_status, applications))
+            stats['checked'] += len(applications)
+            stats['updated'] += apply_reconciled_statuses(applications, provider_statuses)
+            Application.objects.filter(
+                id__in=[application['id'] for application in applications],
+                status__in=OPEN_APPLICATION_STATUSES,
+            ).update(last_updated=timezone.now())
+
+            if len(applications) < batch_size or should_stop():
+                break
+            last_id = applications[-1]['id']
+
+    logger.info(msg={'Сверка заявок с Yookassa': stats})
+    return stats
+
+
+def search_accounts(query: str) -> QuerySet:
+    """
+    Поиск счетов по части логина, телефона пользователя или номера счета для личного кабинета Администратора.
+    Отбор идет по триграммным индексам, счета ранжируются по наибольшей похожести любого из полей.
+    """
+
+    matched_ids = Account.objects.filter(
+        user__in=User.objects.filter(username__icontains=query).values('id'),
+    ).values('id').union(
+        Account.objects.filter(user__in=User.objects.filter(phone__icontains=query).values('id')).values('id'),
+        Account.objects.filter(number__icontains=query).values('id'),
+    )
+
+    return Account.objects.filter(id__in=matched_ids).select_related('user').annotate(
+        rank=Greatest(
+            TrigramSimilarity('user__username', query),
+            TrigramSimilarity('user__phone', query),
+            TrigramSimilarity(Cast('number', output_field=TextField()), query),
+        ),
+    )
+
 
 def get_exchange_rates() -> dict:
     """Получение курсов валют из Redis"""
 
     redis_instance = redis.StrictRedis(host=os.environ.get('REDIS_HOST'), port=os.environ.get('REDIS_PORT'), db=0)
     rates = {}
-    for currency in ['USD', 'EUR', 'CNY']:
+    for currency in RATES_CURRENCIES:
         rates[currency] = redis_instance.get(currency)
     return rates
+
+
+@per_event_loop
+def get_async_rates_redis() -> aioredis.Redis:
+    """Клиент redis.asyncio к хранилищу курсов, один на event loop"""
+
+    return aioredis.from_url(settings.RATES_REDIS_URL)
+
+
+async def aget_exchange_rates() -> dict:
+    """Асинхронное получение курсов валют из Redis одним запросом MGET"""
+
+    values = await get_async_rates_redis().mget(RATES_CURRENCIES)
+    return {
+        currency: value.decode() if value is not None else None for currency, value in zip(RATES_CURRENCIES, values)
+    }
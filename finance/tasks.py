@@ -1,41 +1,59 @@
 import os, requests, redis, json, logging
-from django.shortcuts import get_object_or_404
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 
-from .celery import app
-from users.models import User
+from backend_exchanger.celery import app
+from common.retry import DEFAULT_RETRY_POLICIES, RetryPolicy, RetryPolicyTask
+from common.tasks import BaseTask
 from users.services import advanced_get_request
 
 logger = logging.getLogger('__name__')
 
+# курсы обновляются раз в сутки: ошибки источника курсов (в том числе HTTP 5xx) повторяем дольше и реже.
+# Политика выбирается по первому совпадению, поэтому RequestException идет раньше ConnectionError / Timeout из общих
+EXCHANGE_RATES_RETRY_POLICIES = {
+    requests.RequestException: RetryPolicy(
+        max_retries=10,
+        base_delay=float(os.getenv('CELERY_TASK_RETRY_TIME', 30)),
+        max_delay=1800,
+        max_elapsed=6 * 3600,
+    ),
+    **DEFAULT_RETRY_POLICIES,
+}
+
 
 @app.task(
     bind=True,
+    base=RetryPolicyTask,
     soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300),
-    default_retry_delay=os.getenv('CELERY_TASK_RETRY_TIME', 30),
-    queue='send_notification'
 )
-def send_notification(self, senders_account, receivers_account, amount_to_receive, currency_to_receive):
-    """Отправка пользователю смс уведомления о входящем платеже"""
+def send_notification(self, receivers_account, phone):
+    """
+    Отправка пользователю одного смс по всем входящим переводам, накопленным за окно объединения.
+    Уведомления в буфере самодостаточны (имя отправителя, сумма, валюта), поэтому задача не обращается к базе
+    """
+
+    from .notifications import (
+        get_provider, acquire_rate_limit, take_buffered_notifications, build_message, send_sms, record_coalescing,
+    )
+
+    provider = get_provider()
+    if not acquire_rate_limit(provider):
+        # уведомления остаются в буфере, новые переводы попадут в это же смс
+        raise self.retry(countdown=1)
 
-    sender = get_object_or_404(User, account=senders_account)
-    receiver = get_object_or_404(User, account=receivers_account)
+    notifications = take_buffered_notifications(receivers_account)
+    if not notifications:
+        return
 
-    if receiver.sms_notification:
-        if not receiver.phone:
-            raise ObjectDoesNotExist
-        message = f"Зачислен перевод на сумму {amount_to_receive}{currency_to_receive} от {sender.first_name}{sender.last_name}"
-        url = f"{os.environ.get('SMS_PROVIDER')}&phones={receiver.phone}&mes={message}"
-        response = advanced_get_request(url, 3)
-        if response['error']:
-            return response
+    if send_sms(phone, build_message(notifications), provider):
+        record_coalescing(len(notifications))
 
 
 @app.task(
     bind=True,
+    base=RetryPolicyTask,
     soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300),
-    default_retry_delay=os.getenv('CELERY_TASK_RETRY_TIME', 30),
-    queue='update_exchange_rates'
+    retry_policies=EXCHANGE_RATES_RETRY_POLICIES,
 )
 def update_exchange_rates(self):
     """Обновление курсов валют"""
@@ -43,10 +61,81 @@ def update_exchange_rates(self):
     response = advanced_get_request(os.environ.get('CURRENCY_COURSES_URL'), 3)
 
     if response['error']:
-        return response
+        # повтор по политике, после ее исчерпания задача попадет в dead-letter queue
+        raise response['error_message']
 
     redis_instance = redis.StrictRedis(host=os.environ.get('REDIS_HOST'), port=os.environ.get('REDIS_PORT'), db=0)
     rates = json.loads(response['response'].text)
 
     for currency in ['USD', 'EUR', 'CNY']:
         redis_instance.set(currency, round(rates['Valute'][currency]['Value'], 2))
+
+
+# задачи ниже запускает beat по расписанию: они не повторяются и не попадают в dead-letter queue,
+# ошибку подхватит следующий запуск, а повторы накладывались бы на него
+@app.task(
+    bind=True,
+    soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300)
+)
+def process_webhook_events(self):
+    """Обработка входящих уведомлений Yookassa из inbox пачками"""
+
+    from .services import handle_webhook_events
+
+    for _ in range(settings.WEBHOOK_MAX_BATCHES):
+        if handle_webhook_events(settings.WEBHOOK_BATCH_SIZE) < settings.WEBHOOK_BATCH_SIZE:
+            break
+
+
+@app.task(
+    bind=True,
+    soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300)
+)
+def relay_outbox(self):
+    """Передача сообщений outbox пачками"""
+
+    from .outbox import relay_outbox_messages
+
+    for _ in range(settings.OUTBOX_MAX_BATCHES):
+        if relay_outbox_messages(settings.OUTBOX_BATCH_SIZE) < settings.OUTBOX_BATCH_SIZE:
+            break
+
+
+class ReconcileApplicationsTask(BaseTask):
+    """Сверка зависших заявок с Yookassa, не более одного запуска одновременно"""
+
+    def run(self, batch_size):
+        from .services import reconcile_stale_applications
+
+        return reconcile_stale_applications(batch_size, should_stop=lambda: self.lock_lost)
+
+
+@app.task(
+    bind=True,
+    soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300),
+    ignore_result=False,
+)
+def reconcile_applications(self):
+    """Сверка заявок, зависших в статусах pending / waiting_for_capture (например, после потерянного вебхука)"""
+
+    return ReconcileApplicationsTask().execute_with_lock(settings.RECONCILE_BATCH_SIZE)
+
+
+class ProcessPayoutsTask(BaseTask):
+    """Обработка выплат, не более одного запуска одновременно"""
+
+    def run(self, batch_size):
+        from .payouts import process_payouts
+
+        return process_payouts(batch_size)
+
+
+@app.task(
+    bind=True,
+    soft_time_limit=os.getenv('CELERY_TASK_TIMEOUT', 300),
+    ignore_result=False,
+)
+def process_payouts(self):
+    """Отправка пачки одобренных выплат по заявкам на вывод"""
+
+    return ProcessPayoutsTask().execute_with_lock(settings.PAYOUT_BATCH_SIZE)
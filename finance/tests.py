@@ -1,13 +1,156 @@
+import io, os, json, asyncio, threading, uuid
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from celery.exceptions import Retry
+from django.core.management import call_command
+from django.db import transaction
 from django.db.models import Q
+from django.test import AsyncRequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from rest_framework import status
 
-from finance.models import Account, Transaction
+from common.models import DeadLetterTask
+from common.retention import RetentionPurger, get_retention_policies
+from finance import async_views
+from finance.async_notifications import AsyncNotificationWorker
+from finance.gateway import PaymentGatewayError, PaymentGatewayUnavailable, get_yookassa_client
+from finance.models import Account, Transaction, Application, ApplicationLog, WebhookEvent, OutboxMessage
+from finance.notifications import buffer_transfer_notification, schedule_digest, get_redis
+from finance.outbox import TRANSFER_RECEIVED, publish
 from finance.serializers import AccountSerializer, TransactionSerializer
+from finance.services import get_async_rates_redis
+from finance.views import RATES_CACHE_POLICY
+from finance.tasks import (
+    process_webhook_events, reconcile_applications, process_payouts, send_notification, relay_outbox,
+    update_exchange_rates, EXCHANGE_RATES_RETRY_POLICIES,
+)
+from finance.transitions import ApplicationTransitions, InvalidTransition
 from users.models import User, UserAdditionalInfo
 
 
+class FakeYookassaServer:
+    """Локальный fake-сервер Yookassa API для тестов"""
+
+    def __init__(self):
+        self.requests = []
+        self.status_code = 200
+        self.payment_status = 'succeeded'
+        self.payout_status = 'succeeded'
+        self.rejected_payouts = set()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                fake.requests.append((self.command, self.path, body))
+                parts = self.path.split('/')
+                status_code = fake.status_code
+                if self.path == '/payouts':
+                    if body['metadata']['application_id'] in fake.rejected_payouts:
+                        status_code = 400
+                    payload = json.dumps({
+                        'id': str(uuid.uuid4()),
+                        'status': fake.payout_status,
+                        'amount': body['amount'],
+                    }).encode()
+                elif self.path.startswith('/payouts/'):
+                    payload = json.dumps({
+                        'id': parts[2],
+                        'status': fake.payout_status,
+                        'amount': {'value': '30.00', 'currency': 'RUB'},
+                    }).encode()
+                else:
+                    payload = json.dumps({
+                        'id': parts[2] if len(parts) > 2 else str(uuid.uuid4()),
+                        'status': 'succeeded' if self.path.endswith('/capture') else fake.payment_status,
+                        'paid': True,
+                        'amount': {'value': '30.00', 'currency': 'RUB'},
+                        'confirmation': {'type': 'redirect', 'confirmation_url': f'{fake.url}/confirm'},
+                    }).encode()
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = override_settings(
+            YOOKASSA_API_URL=self.url,
+            YOOKASSA_ACCOUNT_ID='123456',
+            YOOKASSA_SECRET_KEY='test_secret',
+            YOOKASSA_RETRY_BACKOFF=0,
+        )
+        self.settings.enable()
+        get_yookassa_client.cache_clear()
+        return self
+
+    def __exit__(self, *args):
+        get_yookassa_client.cache_clear()
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeSmsProvider:
+    """Локальный fake-сервер смс-провайдера для тестов"""
+
+    def __init__(self):
+        self.messages = []
+        self.failures = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if fake.failures:
+                    fake.failures -= 1
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                fake.messages.append(parse_qs(urlsplit(self.path).query))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/send?login=test'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.environ = mock.patch.dict(os.environ, {'SMS_PROVIDER': self.url})
+        self.environ.start()
+        return self
+
+    def __exit__(self, *args):
+        self.environ.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class FinanceTests(APITestCase):
 
     def setUp(self):
@@ -129,6 +272,28 @@ class FinanceTests(APITestCase):
         self.assertEqual(senders_old_balance - 100, senders_new_balance)
         self.assertEqual(receivers_old_balance + 100, receivers_new_balance)
 
+    def test_transfer_funds_counterparty_notification(self):
+        """Уведомление о переводе пишется в outbox со всеми данными для смс"""
+
+        User.objects.filter(id=self.user_2.id).update(sms_notification=True)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + str(self.user_1_token))
+        receivers_account = Account.objects.get(user=self.user_2, сurrency_id='1')
+
+        data = {
+            "senders_account": Account.objects.get(user=self.user_1, сurrency_id='1').number,
+            "amount_to_send": "100",
+            "receivers_account": receivers_account.number,
+            "amount_to_receive": "100",
+            "receiver_type": "counterparty",
+        }
+
+        response = self.client.post(reverse('Transaction-transfer-funds'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.payload['receivers_account'], str(receivers_account.number))
+        self.assertEqual(message.payload['phone'], '+79999999998')
+        self.assertEqual(message.payload['sender_name'], 'ИванИванов')
+
     def test_get_rates(self):
         """Получение курсов валют"""
 
@@ -174,6 +339,725 @@ class FinanceTests(APITestCase):
             "amount": "30",
             "type": "refill"
         }
-        response = self.client.post('/api/v1/finance/user_application/', data, format='json')
+        with FakeYookassaServer():
+            response = self.client.post('/api/v1/finance/user_application/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue('confirmation_url' in response.json())
+
+    def test_admin_account_search(self):
+        """Поиск счетов по части логина в личном кабинете Администратора"""
+
+        admin = User.objects.create_user(username='admin@mail.ru', password='qwerty123456', is_staff=True)
+        admin_token = Token.objects.create(user=admin)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + str(admin_token))
+
+        response = self.client.get(reverse('Administrator-search'), {'q': 'user1@mail', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(all(account['username'] == 'user1@mail.ru' for account in response.data['results']))
+        self.assertIsNotNone(response.data['next'])
+
+    def test_admin_account_search_forbidden_for_user(self):
+        """Поиск счетов недоступен обычному пользователю"""
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + str(self.user_1_token))
+        response = self.client.get(reverse('Administrator-search'), {'q': 'user1@mail'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_admin_accounts_forbidden_for_user(self):
+        """Список счетов и изменение баланса недоступны обычному пользователю"""
+
+        account = Account.objects.get(user=self.user_2, сurrency_id='1')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + str(self.user_1_token))
+
+        response = self.client.get(reverse('Administrator-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.patch(reverse('Administrator-detail', args=(account.id,)), {'balance': 1000000})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, 0)
+
+
+@override_settings(WEBHOOK_ALLOWED_IPS=['127.0.0.1'])
+class WebhookInboxTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1@mail.ru', password='qwerty123456')
+        self.account = Account.objects.get(user=self.user, сurrency_id='1')
+        self.application = Application.objects.create(
+            account=self.account,
+            currency_id=1,
+            payment_id=uuid.uuid4(),
+            amount=30,
+            type=Application.REFILL,
+            status=Application.PENDING,
+        )
+
+    def post_webhook(self, **extra):
+        data = {
+            'type': 'notification',
+            'event': 'payment.waiting_for_capture',
+            'object': {
+                'id': str(self.application.payment_id),
+                'status': 'waiting_for_capture',
+                'paid': True,
+                'amount': {'value': '30.00', 'currency': 'RUB'},
+            },
+        }
+        return self.client.post(reverse('Application-webhook-handler'), data, format='json', **extra)
+
+    def test_webhook_is_stored_without_provider_calls(self):
+        """Вебхук сохраняется в inbox и подтверждается без обращений к Yookassa"""
+
+        with FakeYookassaServer() as yookassa:
+            response = self.post_webhook()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(yookassa.requests, [])
+        self.assertTrue(WebhookEvent.objects.filter(payment_id=self.application.payment_id).exists())
+        self.application.refresh_from_db()
+        self.assertEqual(self.application.status, Application.PENDING)
+
+    @override_settings(WEBHOOK_ALLOWED_IPS=['185.71.76.0/27'])
+    def test_webhook_from_unknown_address_rejected(self):
+        """Уведомление не с адреса Yookassa отклоняется и не попадает в inbox"""
+
+        response = self.post_webhook(REMOTE_ADDR='10.0.0.1')
+        allowed = self.post_webhook(REMOTE_ADDR='185.71.76.5')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(allowed.status_code, status.HTTP_200_OK)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_webhook_events_processed_once_per_payment(self):
+        """Повторные уведомления по одному платежу обрабатываются одним подтверждением"""
+
+        self.post_webhook()
+        self.post_webhook()
+
+        with FakeYookassaServer() as yookassa:
+            process_webhook_events()
+
+        self.assertEqual([method for method, _, _ in yookassa.requests], ['POST', 'GET'])
+        self.application.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual(self.application.status, Application.COMPLETED)
+        self.assertEqual(self.account.balance, 30)
+        self.assertEqual(ApplicationLog.objects.filter(application=self.application).count(), 1)
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.PROCESSED).count(), 2)
+
+    def test_webhook_event_retried_with_backoff(self):
+        """При ошибке Yookassa уведомление откладывается на повторную обработку"""
+
+        self.post_webhook()
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 500
+            process_webhook_events()
+
+        event = WebhookEvent.objects.get(payment_id=self.application.payment_id)
+        self.assertEqual(event.status, WebhookEvent.NEW)
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.next_attempt_at, event.created)
+        self.application.refresh_from_db()
+        self.assertEqual(self.application.status, Application.PENDING)
+
+    def test_processed_events_purged(self):
+        """Обработанные уведомления удаляются по сроку хранения, необработанные и ошибочные остаются"""
+
+        old = timezone.now() - timedelta(days=31)
+        events = WebhookEvent.objects.bulk_create([
+            WebhookEvent(event='payment.succeeded', payment_id=self.application.payment_id, payload={}, status=status)
+            for status in (WebhookEvent.PROCESSED, WebhookEvent.NEW, WebhookEvent.FAILED)
+        ])
+        WebhookEvent.objects.update(created=old)
+        recent = WebhookEvent.objects.create(
+            event='payment.succeeded',
+            payment_id=self.application.payment_id,
+            payload={},
+            status=WebhookEvent.PROCESSED,
+        )
+
+        policies = [policy for policy in get_retention_policies() if policy.model == 'finance.WebhookEvent']
+        RetentionPurger(batch_size=10, target_load=1, max_runtime=60).purge(policies)
+
+        self.assertEqual(
+            set(WebhookEvent.objects.values_list('id', flat=True)), {events[1].id, events[2].id, recent.id},
+        )
+
+
+class AsyncViewsTests(APITestCase):
+
+    async def test_get_rates(self):
+        """Курсы читаются из Redis через redis.asyncio, политика кэширования та же, что у DRF-версии"""
+
+        await get_async_rates_redis().mset({'USD': '92.5', 'EUR': '100.1'})
+        await get_async_rates_redis().delete('CNY')
+
+        response = await async_views.get_rates(AsyncRequestFactory().get('/api/v1/finance/user_transaction/get_rates/'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {'USD': '92.5', 'EUR': '100.1', 'CNY': None})
+        self.assertIs(response.cache_policy, RATES_CACHE_POLICY)
+
+    @override_settings(WEBHOOK_ALLOWED_IPS=['127.0.0.1'])
+    async def test_webhook_handler(self):
+        """Вебхук сохраняется во входящую очередь, некорректное тело отклоняется"""
+
+        payment_id = uuid.uuid4()
+        data = {
+            'type': 'notification',
+            'event': 'payment.waiting_for_capture',
+            'object': {
+                'id': str(payment_id),
+                'status': 'waiting_for_capture',
+                'paid': True,
+                'amount': {'value': '30.00', 'currency': 'RUB'},
+            },
+        }
+        url = reverse('Application-webhook-handler')
+
+        response = await async_views.webhook_handler(
+            AsyncRequestFactory().post(url, json.dumps(data), content_type='application/json'),
+        )
+        invalid = await async_views.webhook_handler(
+            AsyncRequestFactory().post(url, 'not json', content_type='application/json'),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(await WebhookEvent.objects.filter(payment_id=payment_id).aexists())
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class YookassaClientTests(APITestCase):
+
+    def test_idempotent_request_retried(self):
+        """Запрос с ключом идемпотентности повторяется при ответе 5xx"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 503
+            with self.assertRaises(PaymentGatewayError):
+                get_yookassa_client().capture_payment(str(uuid.uuid4()), {}, 'capture-key')
+
+        self.assertEqual(len(yookassa.requests), 4)
+        self.assertTrue(all(method == 'POST' for method, _, _ in yookassa.requests))
+
+    def test_client_error_not_retried(self):
+        """Отказ Yookassa (4xx) не повторяется и не размыкает circuit breaker"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 400
+            with self.assertRaises(PaymentGatewayError):
+                get_yookassa_client().get_payment(str(uuid.uuid4()))
+            self.assertEqual(get_yookassa_client().breaker.state, 'closed')
+
+        self.assertEqual(len(yookassa.requests), 1)
+
+    @override_settings(YOOKASSA_MAX_RETRIES=0, YOOKASSA_BREAKER_FAILURE_THRESHOLD=2)
+    def test_circuit_breaker_fails_fast(self):
+        """После серии ошибок запросы отклоняются без обращения к Yookassa"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 500
+            client = get_yookassa_client()
+            for _ in range(2):
+                with self.assertRaises(PaymentGatewayError):
+                    client.get_payment(str(uuid.uuid4()))
+            with self.assertRaises(PaymentGatewayUnavailable):
+                client.get_payment(str(uuid.uuid4()))
+
+        self.assertEqual(len(yookassa.requests), 2)
+
+    def test_payment_from_view_not_retried(self):
+        """Создание платежа из запроса пользователя выполняется без повторов"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 503
+            with self.assertRaises(PaymentGatewayError):
+                get_yookassa_client().create_payment({}, 'create-key', max_retries=0)
+
+        self.assertEqual(len(yookassa.requests), 1)
+
+    @override_settings(YOOKASSA_BREAKER_FAILURE_THRESHOLD=1, YOOKASSA_BREAKER_RECOVERY_TIME=0)
+    def test_unexpected_error_recorded_as_failure(self):
+        """Непредвиденная ошибка запроса учитывается breaker и не оставляет пробный вызов незавершенным"""
+
+        with FakeYookassaServer() as yookassa:
+            client = get_yookassa_client()
+            with mock.patch.object(client.session, 'request', side_effect=RuntimeError('unexpected')):
+                with self.assertRaises(RuntimeError):
+                    client.get_payment(str(uuid.uuid4()))
+                self.assertEqual(client.breaker.state, 'open')
+                with self.assertRaises(RuntimeError):
+                    client.get_payment(str(uuid.uuid4()))
+
+            client.get_payment(str(uuid.uuid4()))
+            self.assertEqual(client.breaker.state, 'closed')
+
+        self.assertEqual(len(yookassa.requests), 1)
+
+
+class ReconcileApplicationsTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1@mail.ru', password='qwerty123456')
+        self.account = Account.objects.get(user=self.user, сurrency_id='1')
+        Application.objects.bulk_create([
+            Application(
+                account=self.account,
+                currency_id=1,
+                payment_id=uuid.uuid4(),
+                amount=30,
+                type=Application.REFILL,
+                status=status,
+            )
+            for status in (Application.PENDING, Application.PENDING, Application.WAITING_FOR_CAPTURE)
+        ])
+        Application.objects.update(last_updated=timezone.now() - timedelta(hours=1))
+
+    @override_settings(RECONCILE_BATCH_SIZE=2)
+    def test_stale_applications_completed(self):
+        """Зависшие заявки закрываются по статусу Yookassa, средства зачисляются одним обновлением на пачку"""
+
+        with FakeYookassaServer() as yookassa:
+            stats = reconcile_applications()
+
+        self.assertEqual(stats, {'checked': 3, 'updated': 3})
+        self.assertEqual(len(yookassa.requests), 3)
+        self.assertFalse(Application.objects.exclude(status=Application.COMPLETED).exists())
+        self.assertEqual(ApplicationLog.objects.filter(status=Application.COMPLETED).count(), 3)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 90)
+
+    def test_waiting_for_capture_payment_captured(self):
+        """Платеж, ожидающий подтверждения, подтверждается при сверке"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.payment_status = 'waiting_for_capture'
+            reconcile_applications()
+
+        self.assertEqual([method for method, _, _ in yookassa.requests].count('POST'), 3)
+        self.assertFalse(Application.objects.exclude(status=Application.COMPLETED).exists())
+
+    def test_fresh_and_unpaid_applications_untouched(self):
+        """Свежие и еще не оплаченные заявки не меняются"""
+
+        Application.objects.filter(status=Application.WAITING_FOR_CAPTURE).update(last_updated=timezone.now())
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.payment_status = 'pending'
+            stats = reconcile_applications()
+
+        self.assertEqual(stats, {'checked': 2, 'updated': 0})
+        self.assertEqual(Application.objects.filter(status=Application.COMPLETED).count(), 0)
+
+    @override_settings(RECONCILE_BATCH_SIZE=2)
+    def test_open_applications_postponed(self):
+        """Проверенные, но еще не оплаченные заявки откладываются, следующая сверка начинает с остальных"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.payment_status = 'pending'
+            # первая сверка прерывается на второй пачке
+            with mock.patch('finance.services.fetch_payment_status', side_effect=['pending', 'pending', KeyError]):
+                with self.assertRaises(KeyError):
+                    reconcile_applications()
+            stats = reconcile_applications()
+
+        self.assertEqual(stats, {'checked': 1, 'updated': 0})
+        self.assertEqual(len(yookassa.requests), 1)
+
+
+class ApplicationTransitionsTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1@mail.ru', password='qwerty123456')
+        account = Account.objects.get(user=self.user, сurrency_id='1')
+        self.applications = Application.objects.bulk_create([
+            Application(account=account, currency_id=1, amount=30, type=Application.REFILL, status=status)
+            for status in (Application.PENDING, Application.WAITING_FOR_CAPTURE, Application.COMPLETED)
+        ])
+
+    def test_only_expected_statuses_transitioned(self):
+        """Условный UPDATE переводит только заявки в ожидаемом статусе, история пишется при выходе из блока"""
+
+        ids = [application.id for application in self.applications]
+        with ApplicationTransitions() as transitions:
+            updated_ids = transitions.transition_many(
+                ids, (Application.PENDING, Application.WAITING_FOR_CAPTURE), Application.CANCELLED,
+            )
+            self.assertFalse(ApplicationLog.objects.exists())
+
+        self.assertEqual(sorted(updated_ids), ids[:2])
+        self.assertEqual(Application.objects.filter(status=Application.CANCELLED).count(), 2)
+        self.assertEqual(ApplicationLog.objects.filter(status=Application.CANCELLED).count(), 2)
+
+    def test_invalid_transition_rejected(self):
+        """Переход из завершенного статуса запрещен"""
+
+        with self.assertRaises(InvalidTransition):
+            ApplicationTransitions().transition(self.applications[2].id, Application.COMPLETED, Application.PENDING)
+
+
+class PayoutEngineTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1@mail.ru', password='qwerty123456')
+        self.account = Account.objects.get(user=self.user, сurrency_id='1')
+        self.account.balance = 100
+        self.account.save()
+        self.applications = Application.objects.bulk_create([
+            Application(
+                account=self.account,
+                currency_id=1,
+                amount=30,
+                type=Application.WITHDRAWAL,
+                status=Application.APPROVED,
+                payout_token='test_payout_token',
+            )
+            for _ in range(3)
+        ])
+
+    @override_settings(PAYOUT_BATCH_SIZE=3)
+    def test_full_batch_paid_out(self):
+        """Полная пачка отправляется сразу, средства резервируются одним обновлением на счет"""
+
+        with FakeYookassaServer() as yookassa:
+            stats = process_payouts()
+
+        self.assertEqual(stats['succeeded'], 3)
+        self.assertEqual(len(yookassa.requests), 3)
+        self.assertFalse(Application.objects.exclude(status=Application.COMPLETED).exists())
+        self.assertEqual(ApplicationLog.objects.filter(status=Application.PROCESSING).count(), 3)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 10)
+
+    @override_settings(PAYOUT_BATCH_SIZE=10, PAYOUT_MAX_WAIT=300)
+    def test_partial_batch_waits(self):
+        """Неполная пачка ждет, пока самая старая заявка не прождет PAYOUT_MAX_WAIT"""
+
+        with FakeYookassaServer() as yookassa:
+            process_payouts()
+            self.assertEqual(yookassa.requests, [])
+
+            Application.objects.update(last_updated=timezone.now() - timedelta(minutes=10))
+            stats = process_payouts()
+
+        self.assertEqual(stats['batch_size'], 3)
+
+    @override_settings(PAYOUT_BATCH_SIZE=3)
+    def test_insufficient_funds_rejected(self):
+        """Если баланса не хватает на всю пачку по счету, заявки счета переводятся в ошибку без выплаты"""
+
+        Account.objects.filter(id=self.account.id).update(balance=50)
+
+        with FakeYookassaServer() as yookassa:
+            process_payouts()
+
+        self.assertEqual(yookassa.requests, [])
+        self.assertEqual(Application.objects.filter(status=Application.ERROR).count(), 3)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 50)
+
+    @override_settings(PAYOUT_BATCH_SIZE=3, PAYOUT_RESUBMIT_AFTER=0)
+    def test_failed_payouts_refunded_and_pending_polled(self):
+        """Отклоненная выплата возвращает средства, незавершенная выплата опрашивается по id, а не создается заново"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.rejected_payouts = {self.applications[0].id}
+            yookassa.payout_status = 'pending'
+            stats = process_payouts()
+
+            self.assertEqual((stats['failed'], stats['retry']), (1, 2))
+            self.assertEqual(Application.objects.get(id=self.applications[0].id).status, Application.ERROR)
+            self.account.refresh_from_db()
+            self.assertEqual(self.account.balance, 40)
+
+            processing = Application.objects.filter(status=Application.PROCESSING)
+            payout_ids = set(processing.values_list('payout_id', flat=True))
+            self.assertEqual(len(payout_ids), 2)
+
+            yookassa.payout_status = 'succeeded'
+            stats = process_payouts()
+
+        self.assertEqual(stats['succeeded'], 2)
+        self.assertEqual(
+            {(method, path) for method, path, _ in yookassa.requests[3:]},
+            {('GET', f'/payouts/{payout_id}') for payout_id in payout_ids},
+        )
+        self.assertEqual(Application.objects.filter(status=Application.COMPLETED).count(), 2)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 40)
+
+    @override_settings(PAYOUT_BATCH_SIZE=3, PAYOUT_RESUBMIT_AFTER=0)
+    def test_failed_poll_keeps_payout_pending(self):
+        """Ошибка опроса созданной выплаты, даже 4xx, не отменяет ее и не возвращает средства"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.payout_status = 'pending'
+            process_payouts()
+            payout_ids = set(Application.objects.values_list('payout_id', flat=True))
+
+            yookassa.status_code = 404
+            stats = process_payouts()
+            self.assertEqual((stats['failed'], stats['retry']), (0, 3))
+            self.assertEqual(Application.objects.filter(status=Application.PROCESSING).count(), 3)
+            self.assertEqual(set(Application.objects.values_list('payout_id', flat=True)), payout_ids)
+            self.account.refresh_from_db()
+            self.assertEqual(self.account.balance, 10)
+
+            yookassa.status_code = 200
+            yookassa.payout_status = 'succeeded'
+            stats = process_payouts()
+
+        self.assertEqual(stats['succeeded'], 3)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 10)
+
+    @override_settings(PAYOUT_BATCH_SIZE=3, PAYOUT_RESUBMIT_AFTER=0)
+    def test_unanswered_payouts_resubmitted(self):
+        """Выплата без ответа провайдера отправляется повторно с тем же ключом идемпотентности"""
+
+        with FakeYookassaServer() as yookassa:
+            yookassa.status_code = 503
+            stats = process_payouts()
+            self.assertEqual(stats['retry'], 3)
+
+            yookassa.status_code = 200
+            yookassa.requests = []
+            stats = process_payouts()
+
+        self.assertEqual(stats['succeeded'], 3)
+        self.assertEqual({method for method, _, _ in yookassa.requests}, {'POST'})
+
+
+def clear_redis_keys(*patterns):
+    """Удаление только ключей уведомлений: база Redis общая с другими данными"""
+
+    client = get_redis()
+    for pattern in patterns:
+        for key in client.scan_iter(pattern):
+            client.delete(key)
+
+
+class ExchangeRatesTaskTests(APITestCase):
+
+    def test_connection_error_uses_rates_policy(self):
+        """Обрыв соединения с источником курсов повторяется по политике курсов, а не по общей"""
+
+        policy = update_exchange_rates.get_retry_policy(requests.ConnectionError())
+        self.assertIs(policy, EXCHANGE_RATES_RETRY_POLICIES[requests.RequestException])
+        self.assertEqual(policy.max_retries, 10)
+
+
+class SmsNotificationTests(APITestCase):
+
+    def setUp(self):
+        self.receivers_account = str(uuid.uuid4())
+        self.phone = '+79999999998'
+        clear_redis_keys('sms:*')
+
+    def test_notifications_coalesced_into_digest(self):
+        """Переводы за окно объединения уходят получателю одним смс со сводкой, без обращений к базе"""
+
+        scheduled = [
+            buffer_transfer_notification(self.receivers_account, 'ИванИванов', Decimal(amount), 'RUR')
+            for amount in ('100.00', '50.50', '10.00')
+        ]
+        self.assertEqual(scheduled, [True, False, False])
+
+        with FakeSmsProvider() as provider, self.assertNumQueries(0):
+            send_notification(self.receivers_account, self.phone)
+
+        self.assertEqual(len(provider.messages), 1)
+        self.assertEqual(provider.messages[0]['phones'], [self.phone])
+        self.assertEqual(provider.messages[0]['mes'], ['Зачислено переводов: 3, на общую сумму 160.50RUR'])
+        self.assertTrue(buffer_transfer_notification(self.receivers_account, 'ИванИванов', Decimal(1), 'RUR'))
+
+    def test_single_notification_names_sender(self):
+        """Одиночный перевод отправляется с именем отправителя"""
+
+        buffer_transfer_notification(self.receivers_account, 'ИванИванов', Decimal('100.00'), 'RUR')
+
+        with FakeSmsProvider() as provider:
+            send_notification(self.receivers_account, self.phone)
+
+        self.assertEqual(provider.messages[0]['mes'], ['Зачислен перевод на сумму 100.00RUR от ИванИванов'])
+
+    @override_settings(SMS_RATE_LIMIT=0)
+    def test_rate_limited_notifications_stay_buffered(self):
+        """При превышении лимита провайдера смс не отправляется, уведомления остаются в буфере"""
+
+        buffer_transfer_notification(self.receivers_account, 'ИванИванов', Decimal('100.00'), 'RUR')
+
+        with FakeSmsProvider() as provider, self.assertRaises(Retry):
+            send_notification.apply(args=(self.receivers_account, self.phone), throw=True)
+
+        self.assertEqual(provider.messages, [])
+        self.assertFalse(buffer_transfer_notification(self.receivers_account, 'ИванИванов', Decimal(1), 'RUR'))
+
+
+@override_settings(SMS_WORKER_MODE='asyncio', SMS_COALESCE_WINDOW=0, SMS_RETRY_BACKOFF=0)
+class AsyncNotificationWorkerTests(APITestCase):
+
+    def setUp(self):
+        clear_redis_keys('sms:*')
+
+    def run_worker(self):
+        worker = AsyncNotificationWorker.from_settings(poll_interval=0.01)
+        asyncio.run(worker.run(until_empty=True))
+        return worker
+
+    def test_due_digests_sent(self):
+        """Воркер отправляет по одной сводке на получателя"""
+
+        for account, amount in (('account-1', '10.00'), ('account-1', '20.00'), ('account-2', '5.00')):
+            if buffer_transfer_notification(account, 'ИванИванов', Decimal(amount), 'RUR'):
+                schedule_digest(account, f'+7999999999{account[-1]}')
+
+        with FakeSmsProvider() as provider:
+            worker = self.run_worker()
+
+        self.assertEqual(worker.sent, 2)
+        messages = {message['phones'][0]: message['mes'][0] for message in provider.messages}
+        self.assertEqual(messages, {
+            '+79999999991': 'Зачислено переводов: 2, на общую сумму 30.00RUR',
+            '+79999999992': 'Зачислен перевод на сумму 5.00RUR от ИванИванов',
+        })
+
+    def test_transient_provider_error_retried(self):
+        """Временная ошибка провайдера повторяется"""
+
+        buffer_transfer_notification('account-1', 'ИванИванов', Decimal('10.00'), 'RUR')
+        schedule_digest('account-1', '+79999999991')
+
+        with FakeSmsProvider() as provider:
+            provider.failures = 2
+            worker = self.run_worker()
+
+        self.assertEqual(worker.sent, 1)
+        self.assertEqual(len(provider.messages), 1)
+
+    def test_benchmark_does_not_touch_worker_queue(self):
+        """Замер отправляет на свой fake-провайдер по своим ключам и не забирает сводки рабочего воркера"""
+
+        buffer_transfer_notification('account-1', 'ИванИванов', Decimal('10.00'), 'RUR')
+        schedule_digest('account-1', '+79999999991')
+
+        with FakeSmsProvider() as provider:
+            call_command('run_notification_worker', benchmark=3, latency=0, stdout=io.StringIO())
+
+        self.assertEqual(provider.messages, [])
+        self.assertEqual(get_redis().zcard('sms:due'), 1)
+        self.assertEqual(get_redis().llen('sms:buffer:account-1'), 1)
+        self.assertEqual(list(get_redis().scan_iter('sms:benchmark:*')), [])
+
+
+class OutboxTests(APITestCase):
+
+    def setUp(self):
+        clear_redis_keys('sms:*', 'outbox:*')
+        self.payload = {
+            'receivers_account': str(uuid.uuid4()),
+            'phone': '+79999999998',
+            'sender_name': 'ИванИванов',
+            'amount': '100.00',
+            'currency': 'RUR',
+        }
+
+    def test_message_discarded_on_rollback(self):
+        """Сообщение пишется в транзакции перевода и не сохраняется при ее откате"""
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            publish(TRANSFER_RECEIVED, self.payload)
+            raise ValueError
+
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_messages_relayed_once(self):
+        """Релей передает сообщения обработчикам темы или в Redis Stream и помечает их отправленными"""
+
+        publish(TRANSFER_RECEIVED, self.payload)
+        publish(TRANSFER_RECEIVED, self.payload)
+        publish('application_completed', {'application_id': 1})
+
+        with mock.patch.object(send_notification, 'apply_async') as apply_async:
+            relay_outbox()
+            relay_outbox()
+
+        apply_async.assert_called_once_with(
+            (self.payload['receivers_account'], self.payload['phone']), countdown=60,
+        )
+        self.assertEqual(get_redis().xlen('outbox:application_completed'), 1)
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.SENT).count(), 3)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=0)
+    def test_failed_message_retried(self):
+        """Сообщение, которое не удалось передать, остается в outbox до исчерпания попыток"""
+
+        message = publish(TRANSFER_RECEIVED, self.payload)
+
+        with mock.patch.object(send_notification, 'apply_async', side_effect=ConnectionError('broker is down')):
+            relay_outbox()
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), (OutboxMessage.NEW, 1))
+
+            relay_outbox()
+
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.FAILED, 2))
+
+    def test_failed_message_postponed(self):
+        """Сообщение, которое не удалось передать, откладывается и не разбирается релеем до следующей попытки"""
+
+        message = publish(TRANSFER_RECEIVED, self.payload)
+
+        with mock.patch.object(send_notification, 'apply_async', side_effect=ConnectionError('broker is down')):
+            relay_outbox()
+        with mock.patch.object(send_notification, 'apply_async') as apply_async:
+            relay_outbox()
+
+        apply_async.assert_not_called()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.NEW, 1))
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+    def test_sent_messages_purged(self):
+        """Отправленные сообщения удаляются по сроку хранения, неотправленные остаются"""
+
+        old = timezone.now() - timedelta(days=8)
+        sent = publish(TRANSFER_RECEIVED, self.payload)
+        failed = publish(TRANSFER_RECEIVED, self.payload)
+        OutboxMessage.objects.filter(id=sent.id).update(status=OutboxMessage.SENT, sent_at=old)
+        OutboxMessage.objects.filter(id=failed.id).update(status=OutboxMessage.FAILED, created=old)
+        recent = publish(TRANSFER_RECEIVED, self.payload)
+        OutboxMessage.objects.filter(id=recent.id).update(status=OutboxMessage.SENT, sent_at=timezone.now())
+
+        policies = [policy for policy in get_retention_policies() if policy.model == 'finance.OutboxMessage']
+        RetentionPurger(batch_size=10, target_load=1, max_runtime=60).purge(policies)
+
+        self.assertEqual(set(OutboxMessage.objects.values_list('id', flat=True)), {failed.id, recent.id})
+
+    def test_periodic_relay_not_retried(self):
+        """Ошибка периодического релея не повторяется и не попадает в dead-letter queue"""
+
+        with mock.patch('finance.outbox.relay_outbox_messages', side_effect=ConnectionError('db is down')):
+            result = relay_outbox.apply()
+
+        self.assertIsInstance(result.result, ConnectionError)
+        self.assertFalse(DeadLetterTask.objects.exists())
+
+    @override_settings(OUTBOX_RETRY_DELAY=0)
+    def test_redelivered_message_not_duplicated(self):
+        """Повторная доставка сообщения не дублирует уведомление в буфере и планирует отправку, если она не удалась"""
+
+        publish(TRANSFER_RECEIVED, self.payload)
+
+        with mock.patch.object(send_notification, 'apply_async', side_effect=ConnectionError('broker is down')):
+            relay_outbox()
+        with mock.patch.object(send_notification, 'apply_async') as apply_async:
+            relay_outbox()
+
+        apply_async.assert_called_once_with(
+            (self.payload['receivers_account'], self.payload['phone']), countdown=60,
+        )
+        self.assertEqual(get_redis().llen(f'sms:buffer:{self.payload["receivers_account"]}'), 1)
@@ -0,0 +1,107 @@
+from typing import Iterable, Union
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Application, ApplicationLog
+
+# допустимые переходы статусов заявки: текущий статус -> статусы, в которые заявку можно перевести
+ALLOWED_TRANSITIONS = {
+    Application.PENDING: {
+        Application.WAITING_FOR_CAPTURE,
+        Application.APPROVED,
+        Application.COMPLETED,
+        Application.CANCELLED,
+        Application.ERROR,
+    },
+    Application.WAITING_FOR_CAPTURE: {
+        Application.COMPLETED,
+        Application.CANCELLED,
+        Application.ERROR,
+    },
+    Application.APPROVED: {
+        Application.PROCESSING,
+        Application.CANCELLED,
+    },
+    Application.PROCESSING: {
+        Application.COMPLETED,
+        Application.ERROR,
+    },
+    Application.ERROR: {
+        Application.PENDING,
+        Application.CANCELLED,
+    },
+    Application.COMPLETED: set(),
+    Application.CANCELLED: set(),
+}
+
+
+class InvalidTransition(Exception):
+    """Недопустимый переход статуса заявки"""
+
+
+def check_transition(expected: Iterable[str], target: str) -> None:
+    """Проверка, что из каждого ожидаемого статуса допустим переход в целевой"""
+
+    for status in expected:
+        if target not in ALLOWED_TRANSITIONS[status]:
+            raise InvalidTransition(f'Переход заявки из статуса {status} в {target} недопустим')
+
+
+class ApplicationTransitions:
+    """
+    Смена статусов заявок.
+    Переход применяется условным UPDATE ... WHERE status = <ожидаемый> без предварительного чтения:
+    если заявку уже перевел другой обработчик, UPDATE не затронет строку, и переход не будет применен.
+    Записи истории (ApplicationLog) копятся в буфере и пишутся одним bulk_create в flush()
+    или при выходе из блока with.
+    """
+
+    def __init__(self, log_batch_size: int = 5000) -> None:
+        self.log_batch_size = log_batch_size
+        self.pending_logs = []
+
+    def __enter__(self) -> 'ApplicationTransitions':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def transition(self, application_id: int, expected: Union[str, Iterable[str]], target: str) -> bool:
+        """Перевод одной заявки, возвращает True, если переход применен"""
+
+        return bool(self.transition_many([application_id], expected, target))
+
+    def transition_many(self, application_ids: Iterable[int], expected: Union[str, Iterable[str]], target: str) -> list:
+        """
+        Перевод пачки заявок одним UPDATE ... RETURNING id.
+        Возвращает id заявок, которые действительно были переведены.
+        """
+
+        expected = [expected] if isinstance(expected, str) else list(expected)
+        check_transition(expected, target)
+
+        application_ids = list(application_ids)
+        if not application_ids:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Application._meta.db_table} SET status = %s, last_updated = %s '
+                f'WHERE id = ANY(%s) AND status = ANY(%s) RETURNING id',
+                [target, timezone.now(), application_ids, expected],
+            )
+            updated_ids = [row[0] for row in cursor.fetchall()]
+
+        self.pending_logs.extend(
+            ApplicationLog(application_id=application_id, status=target) for application_id in updated_ids
+        )
+        return updated_ids
+
+    def flush(self) -> int:
+        """Запись накопленной истории переходов одним bulk_create"""
+
+        logs, self.pending_logs = self.pending_logs, []
+        ApplicationLog.objects.bulk_create(logs, batch_size=self.log_batch_size)
+        return len(logs)
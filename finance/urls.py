@@ -1,12 +1,21 @@
+from django.conf import settings
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register('user_account', views.UserAccountListViewSet, basename='Accounts')
 router.register('user_transaction', views.UserTransactionsViewSet, basename='Transaction')
-router.register('admin_account', views.AdminTransactionsViewSet, basename='Administrator')
+router.register('admin_account', views.AdminAccountsViewSet, basename='Administrator')
 router.register('admin_transaction', views.AdminTransactionsViewSet, basename='Transaction')
 router.register('user_application', views.UserApplicationViewSet, basename='Application')
 
 urlpatterns = router.urls
+
+if settings.ASYNC_VIEWS:
+    # под ASGI эти адреса обслуживают async-представления, имена маршрутов те же, что у DRF
+    urlpatterns = [
+        path('user_transaction/get_rates/', async_views.get_rates, name='Transaction-get-rates'),
+        path('user_application/webhook_handler/', async_views.webhook_handler, name='Application-webhook-handler'),
+    ] + urlpatterns
@@ -1,5 +1,6 @@
 from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.filters import OrderingFilter
@@ -10,8 +11,11 @@ from django.utils.decorators import method_decorator
 from django.db.models import Q
 from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 
 from backend_exchanger.swagger_schema import TOKENS_PARAMETER
+from common.cache_policy import CachePolicy, cache_policy
+from common.ratelimit import get_client_ip
 from .serializers import (
     AccountSerializer,
     TransactionSerializer,
@@ -19,11 +23,23 @@ from .serializers import (
     UpdateBalanceSerializer,
     ApplicationSerializer,
     CreateApplicationSerializer,
+    AccountSearchSerializer,
 )
 from .models import Account, Transaction, Application
 from .filters import TranscationFilter, AccountFilter
-from .services import send_funds, create_application, to_handle_webhook, get_exchange_rates
-from .pagination import TranscationPagination, AccountPagination
+from .services import (
+    send_funds, create_application, to_store_webhook, get_exchange_rates, search_accounts, is_webhook_source_allowed,
+)
+from .pagination import TranscationPagination, AccountPagination, AccountSearchPagination
+
+# курсы обновляются раз в сутки, клиентам и CDN разрешено отдавать устаревший ответ, пока он обновляется
+RATES_CACHE_POLICY = CachePolicy(
+    public=True,
+    max_age=settings.RATES_CACHE_MAX_AGE,
+    stale_while_revalidate=settings.RATES_CACHE_MAX_AGE * 5,
+    vary=(),
+    shared_timeout=settings.RATES_CACHE_MAX_AGE,
+)
 
 
 @method_decorator(
@@ -129,11 +145,12 @@ class UserTransactionsViewSet(AdminTransactionsViewSet):
         send_funds(serializer, request)
         return Response()
 
-    @swagger_auto_schema(method='GET', tags=['Transaction'], **TOKENS_PARAMETER)
-    @action(detail=False, methods=['GET'])
+    @swagger_auto_schema(method='GET', tags=['Transaction'])
+    @action(detail=False, methods=['GET'], permission_classes=(AllowAny,))
+    @cache_policy(RATES_CACHE_POLICY)
     def get_rates(self, request):
         """
-        Получить курсы валют
+        Получить курсы валют. Курсы одинаковы для всех, ответ кэшируется на сервере и может кэшироваться CDN
         """
 
         rates = get_exchange_rates()
@@ -172,9 +189,11 @@ class AdminAccountsViewSet(GenericViewSet, ListModelMixin, UpdateModelMixin):
     Сортировка по следующим параметрам:
     - Дата создания
     - Баланс
+
+    search - поиск счетов по части логина, телефона или номера счета с ранжированием по похожести
     """
 
-    permission_classes = (IsAuthenticated,)
+    permission_classes = (IsAdminUser,)
     filter_backends = (OrderingFilter, DjangoFilterBackend,)
     ordering_fields = ['created', 'balance']
     filterset_class = AccountFilter
@@ -188,6 +207,31 @@ class AdminAccountsViewSet(GenericViewSet, ListModelMixin, UpdateModelMixin):
             return AccountSerializer
         elif self.action == 'partial_update':
             return UpdateBalanceSerializer
+        elif self.action == 'search':
+            return AccountSerializer
+
+    @swagger_auto_schema(
+        method='GET',
+        tags=['Administrator'],
+        query_serializer=AccountSearchSerializer,
+        **TOKENS_PARAMETER,
+    )
+    @action(
+        detail=False,
+        methods=['GET'],
+        filter_backends=(),
+        pagination_class=AccountSearchPagination,
+    )
+    def search(self, request):
+        """
+        Поиск счетов по части логина, телефона или номера счета. Результаты отсортированы по рангу похожести,
+        при равном ранге - по id, и разбиты на страницы по номеру
+        """
+
+        serializer = AccountSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        page = self.paginate_queryset(search_accounts(serializer.validated_data['q']).order_by('-rank', '-id'))
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
 
 @method_decorator(
@@ -234,9 +278,20 @@ class UserApplicationViewSet(GenericViewSet, ListModelMixin, CreateModelMixin):
         serializer_class=ApplicationSerializer,
         **TOKENS_PARAMETER,
     )
-    @action(detail=False, methods=['POST'])
+    @action(
+        detail=False,
+        methods=['POST'],
+        permission_classes=(AllowAny,),
+        authentication_classes=(),
+        throttle_classes=(),
+    )
     def webhook_handler(self, request):
-        """Обработка вебхука"""
+        """
+        Прием вебхука Yookassa. Уведомление сохраняется во входящую очередь и сразу подтверждается,
+        подтверждение платежа и зачисление средств выполняет задача process_webhook_events
+        """
 
-        to_handle_webhook(request)
+        if not is_webhook_source_allowed(get_client_ip(request)):
+            raise PermissionDenied('Уведомление отправлено не с адреса Yookassa')
+        to_store_webhook(request)
         return Response()
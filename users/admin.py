@@ -1,11 +1,26 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
 
 from users.models import User, UserAdditionalInfo
+from users.services import search_users
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    search_fields = ['username', ]
+    search_fields = ['username', 'phone']
+    search_help_text = 'Часть логина, телефона или номера счета (от 3 символов)'
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if len(search_term) < 3:
+            return super().get_search_results(request, queryset, search_term)
+        return search_users(queryset, search_term), False
+
+    def get_ordering(self, request):
+        if len(request.GET.get(SEARCH_VAR, '').strip()) >= 3:
+            return ('-search_rank', '-id')
+        return super().get_ordering(request)
 
 
 @admin.register(UserAdditionalInfo)
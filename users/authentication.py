@@ -0,0 +1,148 @@
+import copy
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from prometheus_client import Counter
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+from .revocation import revoked_tokens
+
+USER_CACHE_REQUESTS = Counter(
+    'auth_user_cache_requests_total',
+    'Authenticated user lookups by the level that answered',
+    ['result'],
+)
+
+USER_CACHE_KEY = 'auth:user:{}:{}'
+# версия записи пользователя меняется при каждом сбросе: запрос, прочитавший строку до сброса,
+# сохранит ее под старой версией, которую уже никто не читает
+USER_CACHE_VERSION_KEY = 'auth:user:{}:version'
+
+
+class LocalUserCache:
+    """
+    LRU-кэш пользователей в памяти процесса с коротким TTL.
+    Сброс в других процессах не виден, поэтому TTL ограничивает, сколько процесс может видеть старые данные.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id) -> Optional[User]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user: User) -> None:
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id) -> None:
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+local_user_cache = LocalUserCache(settings.USER_CACHE_LOCAL_SIZE, settings.USER_CACHE_LOCAL_TTL)
+
+
+def get_cached_user(user_id) -> Optional[User]:
+    """
+    Пользователь по id: из памяти процесса, затем из Redis, затем из БД.
+    Возвращается копия, чтобы изменения request.user в одном запросе не попадали в другие
+    """
+
+    # в токене id может быть строкой, в сигналах это pk модели
+    user_id = str(user_id)
+    user = local_user_cache.get(user_id)
+    if user is not None:
+        USER_CACHE_REQUESTS.labels('local').inc()
+        return copy.copy(user)
+
+    # версию нужно прочитать до запроса в БД
+    version = cache.get(USER_CACHE_VERSION_KEY.format(user_id), 0)
+    key = USER_CACHE_KEY.format(user_id, version)
+    user = cache.get(key)
+    if user is not None:
+        USER_CACHE_REQUESTS.labels('redis').inc()
+    else:
+        USER_CACHE_REQUESTS.labels('database').inc()
+        # мимо cacheops: пользователь и так кэшируется здесь, третий уровень кэша не нужен
+        user = User.objects.nocache().filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            return None
+        cache.set(key, user, settings.USER_CACHE_TTL)
+
+    local_user_cache.set(user_id, user)
+    return copy.copy(user)
+
+
+def invalidate_cached_user(user_id) -> None:
+    """
+    Сброс пользователя из кэша сменой версии записи: сразу и еще раз после коммита,
+    чтобы запрос, прочитавший старую строку до коммита, не оставил ее видимой в Redis
+    """
+
+    user_id = str(user_id)
+
+    def delete():
+        local_user_cache.delete(user_id)
+        # версия живет дольше записей: когда она истечет, записей под версией по умолчанию уже не останется
+        cache.set(USER_CACHE_VERSION_KEY.format(user_id), uuid.uuid4().hex, settings.USER_CACHE_TTL * 2)
+
+    delete()
+    transaction.on_commit(delete)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication без запроса пользователя в БД на каждый запрос.
+    Пользователь берется из get_cached_user, кэш сбрасывается при сохранении и удалении пользователя
+    (в том числе при смене пароля и деактивации), см. users.signals.
+    Отозванные токены отклоняются, см. users.revocation
+    """
+
+    def get_validated_token(self, raw_token: bytes):
+        validated_token = super().get_validated_token(raw_token)
+        if revoked_tokens.is_revoked(validated_token[api_settings.JTI_CLAIM]):
+            raise InvalidToken(_('Token is blacklisted'))
+        return validated_token
+
+    def get_user(self, validated_token) -> User:
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
@@ -0,0 +1,260 @@
+import io
+import csv
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from cacheops import invalidate_model, no_invalidation
+from django.db import IntegrityError, transaction
+from prometheus_client import Counter
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from finance.models import Account, Currency
+from .models import User, UserAdditionalInfo
+from .serializers import UserInfoSerializer
+
+IMPORTED_USERS = Counter(
+    'user_import_rows_total',
+    'Rows processed by the bulk user import',
+    ['result'],
+)
+
+FORMATS = ('csv', 'ndjson')
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    Строка импорта без проверки уникальности логина и телефона: она делается одним запросом на пачку
+    """
+
+    password = serializers.CharField(required=False, allow_blank=True)
+
+    class Meta:
+        model = User
+        fields = ('username', 'password', 'first_name', 'last_name', 'middle_name', 'phone', 'sms_notification')
+        extra_kwargs = {
+            'username': {'validators': []},
+            'phone': {'validators': User._meta.get_field('phone').validators},
+        }
+
+
+def get_format(file_name: str) -> str:
+    """Формат файла по расширению: .csv или .ndjson/.jsonl"""
+
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    file_format = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension)
+    if file_format is None:
+        raise ValueError(f'Неизвестный формат файла {file_name}, ожидается csv или ndjson')
+    return file_format
+
+
+def read_rows(stream: IO[bytes], file_format: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Потоковое чтение файла без загрузки в память целиком.
+    Отдает (номер строки, данные, ошибка разбора)
+    """
+
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # пустые ячейки CSV - отсутствующие значения, а не пустые строки
+            yield reader.line_num, {key: value for key, value in row.items() if value not in ('', None)}, None
+        return
+
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f'Некорректный JSON: {error}'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'Строка должна быть JSON-объектом'
+            continue
+        yield number, row, None
+
+
+class ImportReport:
+    """Ход импорта: счетчики строк, первые ошибки и скорость"""
+
+    def __init__(self, max_errors: int) -> None:
+        self.max_errors = max_errors
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.started_at = time.monotonic()
+
+    def error(self, number: int, error) -> None:
+        self.skipped += 1
+        IMPORTED_USERS.labels('skipped').inc()
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': number, 'error': error})
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.created / self.elapsed if self.elapsed else 0
+
+    def as_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'skipped': self.skipped,
+            'elapsed': round(self.elapsed, 1),
+            'rate': round(self.rate, 1),
+            'errors': self.errors,
+        }
+
+
+class UserImporter:
+    """
+    Массовое создание пользователей с дополнительной информацией и счетами во всех валютах.
+    Пароли хешируются в пуле процессов, пока основной процесс проверяет следующую пачку и пишет в БД предыдущую.
+    Пользователи создаются через bulk_create, поэтому сигнал create_accounts не срабатывает:
+    счета создаются здесь же, одним bulk_create на пачку
+    """
+
+    def __init__(self, batch_size: int, workers: int, max_errors: int = 100) -> None:
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_errors = max_errors
+        self.currency_ids = []
+        self.usernames = set()
+        self.phones = set()
+        # один экземпляр сериализатора на импорт: поля строятся один раз, а не на каждую строку
+        self.user_serializer = UserImportSerializer()
+        self.userinfo_serializer = UserInfoSerializer()
+
+    def run(self, rows: Iterable, progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+        report = ImportReport(self.max_errors)
+        self.currency_ids = list(Currency.objects.values_list('id', flat=True))
+
+        # spawn, а не fork: импорт запускается и из потока воркера Celery, fork многопоточного процесса небезопасен
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=django.setup) as pool:
+            pending = None
+            for batch in self.batches(rows, report):
+                passwords = [password or None for _, _, _, password in batch]
+                hashes = pool.map(make_password, passwords, chunksize=max(1, len(batch) // (self.workers * 4)))
+                if pending is not None:
+                    self.insert(*pending, report)
+                    if progress:
+                        progress(report)
+                pending = batch, hashes
+            if pending is not None:
+                self.insert(*pending, report)
+        if progress:
+            progress(report)
+        return report
+
+    def batches(self, rows: Iterable, report: ImportReport) -> Iterator[List[tuple]]:
+        batch = []
+        for number, row, error in rows:
+            report.rows += 1
+            if error:
+                report.error(number, error)
+                continue
+            batch.append((number, row))
+            if len(batch) >= self.batch_size:
+                yield self.validate(batch, report)
+                batch = []
+        if batch:
+            yield self.validate(batch, report)
+
+    def validate(self, batch: List[tuple], report: ImportReport) -> List[tuple]:
+        """
+        Проверка полей строк и уникальности логина и телефона.
+        Отдает (номер строки, пользователь, доп. информация, пароль)
+        """
+
+        valid = []
+        for number, row in batch:
+            errors = {}
+            try:
+                user = dict(self.user_serializer.run_validation(row))
+            except ValidationError as error:
+                errors.update(error.detail)
+            try:
+                userinfo = self.userinfo_serializer.run_validation(row)
+            except ValidationError as error:
+                errors.update(error.detail)
+            if errors:
+                report.error(number, errors)
+                continue
+            password = user.pop('password', None)
+            valid.append((number, User(**user), UserAdditionalInfo(**userinfo), password))
+        return self.check_unique(valid, report)
+
+    def check_unique(self, valid: List[tuple], report: ImportReport) -> List[tuple]:
+        """Уникальность логина и телефона: в файле и одним запросом в БД на пачку"""
+
+        usernames = {user.username for _, user, _, _ in valid}
+        phones = {user.phone for _, user, _, _ in valid if user.phone}
+        taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        taken_phones = set(User.objects.filter(phone__in=phones).values_list('phone', flat=True))
+
+        unique = []
+        for number, user, userinfo, password in valid:
+            if user.username in taken_usernames or user.username in self.usernames:
+                report.error(number, {'username': ['Пользователь с таким логином уже существует']})
+                continue
+            if user.phone and (user.phone in taken_phones or user.phone in self.phones):
+                report.error(number, {'phone': ['Пользователь с таким телефоном уже существует']})
+                continue
+            self.usernames.add(user.username)
+            if user.phone:
+                self.phones.add(user.phone)
+            unique.append((number, user, userinfo, password))
+        return unique
+
+    def insert(self, batch: List[tuple], hashes: Iterable[str], report: ImportReport) -> None:
+        """Пачка пользователей, их доп. информации и счетов в одной транзакции"""
+
+        users = []
+        for (_, user, _, _), password in zip(batch, hashes):
+            user.password = password
+            users.append(user)
+        try:
+            # cacheops сбрасывает кэш на каждый объект bulk_create, вместо этого - один сброс по модели на пачку
+            with transaction.atomic(), no_invalidation:
+                User.objects.bulk_create(users)
+                userinfos = []
+                for user, (_, _, userinfo, _) in zip(users, batch):
+                    userinfo.user = user
+                    userinfos.append(userinfo)
+                UserAdditionalInfo.objects.bulk_create(userinfos)
+                accounts = [
+                    Account(user=user, сurrency_id=currency_id) for user in users for currency_id in self.currency_ids
+                ]
+                Account.objects.bulk_create(accounts, batch_size=self.batch_size)
+        except IntegrityError as error:
+            # логин или телефон заняли параллельной регистрацией после проверки пачки
+            for number, _, _, _ in batch:
+                report.error(number, f'Пачка не сохранена: {error}')
+            return
+
+        invalidate_model(User)
+        invalidate_model(Account)
+        report.created += len(users)
+        IMPORTED_USERS.labels('created').inc(len(users))
+
+
+def import_users(
+    stream: IO[bytes], file_format: str, progress: Optional[Callable[[ImportReport], None]] = None,
+) -> ImportReport:
+    """Импорт пользователей из CSV или NDJSON с настройками из USER_IMPORT_*"""
+
+    importer = UserImporter(settings.USER_IMPORT_BATCH_SIZE, settings.USER_IMPORT_WORKERS)
+    return importer.run(read_rows(stream, file_format), progress)
@@ -0,0 +1,68 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.authentication import CachedJWTAuthentication
+from users.models import User
+from users.revocation import REVOKED_TOKENS_KEY, REVOKED_TOKENS_KEYS, get_revocation_redis, revoked_tokens
+
+
+class NaiveRevocationAuthentication(JWTAuthentication):
+    """Для сравнения: проверка отзыва запросом в Redis на каждый запрос"""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        get_revocation_redis().zscore(REVOKED_TOKENS_KEY, validated_token['jti'])
+        return validated_token
+
+
+class Command(BaseCommand):
+    help = 'Замер накладных расходов аутентификации JWT на запрос: с БД, с кэшем пользователя и проверкой отзыва'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', default=None, help='Пользователь для токена, по умолчанию первый')
+        parser.add_argument('--revoked', type=int, default=100000, help='Отозванных токенов в списке')
+        parser.add_argument('--repeat', type=int, default=5000, help='Запросов на каждый замер')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True)
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('Нет активного пользователя для токена')
+
+        # отозванные токены истекают через минуту и удаляются из Redis при следующей пересборке фильтра
+        expires_at = time.time() + 60
+        pipeline = get_revocation_redis().pipeline(transaction=False)
+        for _ in range(options['revoked']):
+            args = [uuid.uuid4().hex, expires_at]
+            revoked_tokens.revoke_script(keys=REVOKED_TOKENS_KEYS, args=args, client=pipeline)
+        pipeline.execute()
+
+        started = time.perf_counter()
+        revoked_tokens.reload()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'filter of {revoked_tokens.count} revoked tokens built in {elapsed:.2f} s')
+        started = time.perf_counter()
+        revoked_tokens.update()
+        self.stdout.write(f'incremental update in {(time.perf_counter() - started) * 1e3:.2f} ms')
+
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        variants = [
+            ('jwt, user from db', JWTAuthentication()),
+            ('jwt + redis revocation check', NaiveRevocationAuthentication()),
+            ('cached user + bloom filter', CachedJWTAuthentication()),
+        ]
+        self.stdout.write(f'{"variant":<30} {"us/req":>8}')
+        for name, authentication in variants:
+            authentication.authenticate(request)
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                authentication.authenticate(request)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(f'{name:<30} {elapsed * 1e6:>8.0f}')
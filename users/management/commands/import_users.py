@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bulk_import import FORMATS, ImportReport, UserImporter, get_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Массовый импорт пользователей из CSV или NDJSON: пароли хешируются в пуле процессов, '
+        'пользователи, доп. информация и счета создаются пачками'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv или .ndjson')
+        parser.add_argument('--format', choices=FORMATS, default=None, help='Формат, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=settings.USER_IMPORT_BATCH_SIZE, help='Строк в пачке')
+        parser.add_argument('--workers', type=int, default=settings.USER_IMPORT_WORKERS, help='Процессов хеширования')
+
+    def handle(self, *args, **options):
+        try:
+            file_format = options['format'] or get_format(options['path'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        importer = UserImporter(options['batch_size'], options['workers'])
+        with open(options['path'], 'rb') as stream:
+            report = importer.run(read_rows(stream, file_format), self.progress)
+
+        for error in report.errors:
+            self.stderr.write(f'строка {error["line"]}: {error["error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано {report.created} из {report.rows}, пропущено {report.skipped} '
+            f'за {report.elapsed:.1f} с ({report.rate:.0f} пользователей/с)'
+        ))
+
+    def progress(self, report: ImportReport) -> None:
+        self.stdout.write(
+            f'{report.rows} строк, создано {report.created}, пропущено {report.skipped}, '
+            f'{report.rate:.0f} пользователей/с'
+        )
@@ -1,8 +1,10 @@
 from typing import Optional, Any
 
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.validators import RegexValidator, MinLengthValidator
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
 
 from common.models import AbstarctBaseModel
 
@@ -37,6 +39,11 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # триграммные индексы под поиск по части логина и телефона (icontains -> UPPER(...) LIKE '%...%')
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='user_username_trgm_idx'),
+            GinIndex(OpClass(Upper('phone'), name='gin_trgm_ops'), name='user_phone_trgm_idx'),
+        ]
 
     def __str__(self) -> str:
         return f'{self.id} | {self.first_name} | {self.last_name} |' f' {self.username}'
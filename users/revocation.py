@@ -0,0 +1,223 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import Iterable
+
+import redis
+from django.conf import settings
+from prometheus_client import Counter
+from rest_framework_simplejwt.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHECKS = Counter(
+    'auth_revocation_checks_total',
+    'Token revocation checks by the level that answered',
+    ['result'],
+)
+
+# jti отозванных токенов, score - время истечения токена (unix time)
+REVOKED_TOKENS_KEY = 'auth:revoked'
+# те же jti в порядке отзыва, score - номер отзыва: процессы дочитывают фильтр с последнего известного номера
+REVOKED_TOKENS_LOG_KEY = 'auth:revoked:log'
+REVOKED_TOKENS_SEQUENCE_KEY = 'auth:revoked:seq'
+
+# возвращает 1, если токен отозван этим вызовом, и 0, если он уже был в списке
+REVOKE_SCRIPT = """
+if redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1]) == 0 then
+    return 0
+end
+local sequence = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[2], sequence, ARGV[1])
+return 1
+"""
+
+# удаление истекших токенов из обоих множеств, пачками из-за ограничения на число аргументов unpack
+PURGE_EXPIRED_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for start = 1, #expired, 1000 do
+    local batch = {unpack(expired, start, math.min(start + 999, #expired))}
+    redis.call('ZREM', KEYS[1], unpack(batch))
+    redis.call('ZREM', KEYS[2], unpack(batch))
+end
+return #expired
+"""
+
+REVOKED_TOKENS_KEYS = [REVOKED_TOKENS_KEY, REVOKED_TOKENS_LOG_KEY, REVOKED_TOKENS_SEQUENCE_KEY]
+
+
+@lru_cache(maxsize=None)
+def get_revocation_redis() -> redis.StrictRedis:
+    """Клиент Redis для списка отозванных токенов, один на процесс"""
+
+    return redis.StrictRedis.from_url(settings.REVOKED_TOKENS_REDIS_URL, decode_responses=True)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума по jti: отсутствие в фильтре гарантирует, что токен не отозван,
+    присутствие нужно подтвердить в Redis (доля ложных срабатываний - false_positive_rate)
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float) -> None:
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: str) -> Iterable[int]:
+        # двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class RevokedTokens:
+    """
+    Отозванные токены: полный список в Redis, в памяти процесса - фильтр Блума.
+    Раз в refresh_interval секунд фильтр дочитывает новые отзывы из журнала, раз в rebuild_interval
+    (или при переполнении) пересобирается в фоновом потоке, чтобы избавиться от истекших токенов.
+    Почти все действующие токены проверяются без обращения к сети, отзыв в других процессах
+    становится виден не позже чем через refresh_interval
+    """
+
+    def __init__(
+        self, refresh_interval: float, rebuild_interval: float, false_positive_rate: float, min_capacity: int,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.false_positive_rate = false_positive_rate
+        self.min_capacity = min_capacity
+        self.bloom = BloomFilter(min_capacity, false_positive_rate)
+        self.capacity = min_capacity
+        self.count = 0
+        self.sequence = 0
+        self.refreshed_at = None
+        self.rebuilt_at = None
+        self.lock = threading.Lock()
+        client = get_revocation_redis()
+        self.revoke_script = client.register_script(REVOKE_SCRIPT)
+        self.purge_script = client.register_script(PURGE_EXPIRED_SCRIPT)
+
+    def revoke(self, jti: str, expires_at: float) -> bool:
+        """Отзыв токена до момента его истечения. False - токен уже был отозван"""
+
+        revoked = bool(self.revoke_script(keys=REVOKED_TOKENS_KEYS, args=[jti, expires_at]))
+        self.bloom.add(jti)
+        return revoked
+
+    def is_revoked(self, jti: str) -> bool:
+        self.refresh_if_stale()
+        if jti not in self.bloom:
+            REVOCATION_CHECKS.labels('bloom').inc()
+            return False
+
+        try:
+            expires_at = get_revocation_redis().zscore(REVOKED_TOKENS_KEY, jti)
+        except redis.RedisError as error:
+            # фильтр говорит, что токен, скорее всего, отозван: без подтверждения не пропускаем
+            logger.warning(f'Revoked tokens store is unavailable: {error}')
+            REVOCATION_CHECKS.labels('unavailable').inc()
+            return True
+
+        revoked = expires_at is not None and expires_at > time.time()
+        REVOCATION_CHECKS.labels('revoked' if revoked else 'false_positive').inc()
+        return revoked
+
+    def refresh_if_stale(self) -> None:
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < self.refresh_interval:
+            return
+        # фильтр обновляет один поток, остальные пока проверяют по текущему
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.rebuilt_at is None:
+                # без загруженного списка отозванные токены проходили бы, поэтому первая сборка синхронная
+                self.rebuilt_at = now
+                self.apply(*self.load())
+            elif now - self.rebuilt_at >= self.rebuild_interval or self.count > self.capacity:
+                self.rebuilt_at = now
+                threading.Thread(target=self.rebuild, name='revoked-tokens-rebuild', daemon=True).start()
+            else:
+                self.update()
+        except redis.RedisError as error:
+            logger.warning(f'Revoked tokens store is unavailable, keeping the previous filter: {error}')
+        finally:
+            self.refreshed_at = now
+            self.lock.release()
+
+    def update(self) -> None:
+        """Добавление в фильтр отзывов, сделанных после последнего обновления"""
+
+        pipeline = get_revocation_redis().pipeline(transaction=False)
+        pipeline.get(REVOKED_TOKENS_SEQUENCE_KEY)
+        pipeline.zrangebyscore(REVOKED_TOKENS_LOG_KEY, f'({self.sequence}', '+inf', withscores=True)
+        sequence, revoked = pipeline.execute()
+        if int(sequence or 0) < self.sequence:
+            # счетчик начался заново (Redis очищен): журнал нужно перечитать целиком
+            self.apply(*self.load())
+            return
+
+        for jti, jti_sequence in revoked:
+            self.bloom.add(jti)
+            self.sequence = max(self.sequence, int(jti_sequence))
+        self.count += len(revoked)
+
+    def load(self) -> tuple:
+        """Новый фильтр по всему журналу, истекшие токены заодно удаляются из Redis"""
+
+        self.purge_script(keys=REVOKED_TOKENS_KEYS[:2], args=[time.time()])
+        revoked = get_revocation_redis().zrange(REVOKED_TOKENS_LOG_KEY, 0, -1, withscores=True)
+
+        # запас по емкости, чтобы отзывы до следующей пересборки не поднимали долю ложных срабатываний
+        capacity = max(self.min_capacity, len(revoked) * 2)
+        bloom = BloomFilter(capacity, self.false_positive_rate)
+        for jti, _ in revoked:
+            bloom.add(jti)
+        sequence = int(revoked[-1][1]) if revoked else 0
+        return bloom, capacity, len(revoked), sequence
+
+    def apply(self, bloom: BloomFilter, capacity: int, count: int, sequence: int) -> None:
+        self.bloom, self.capacity, self.count, self.sequence = bloom, capacity, count, sequence
+
+    def rebuild(self) -> None:
+        """Пересборка фильтра в фоновом потоке, подменяется под той же блокировкой, что и обновление"""
+
+        try:
+            loaded = self.load()
+        except redis.RedisError as error:
+            logger.warning(f'Revoked tokens store is unavailable, keeping the previous filter: {error}')
+            return
+        with self.lock:
+            self.apply(*loaded)
+
+    def reload(self) -> None:
+        """Синхронная пересборка фильтра"""
+
+        with self.lock:
+            self.apply(*self.load())
+
+
+revoked_tokens = RevokedTokens(
+    settings.REVOKED_TOKENS_REFRESH_INTERVAL,
+    settings.REVOKED_TOKENS_REBUILD_INTERVAL,
+    settings.REVOKED_TOKENS_FALSE_POSITIVE_RATE,
+    settings.REVOKED_TOKENS_MIN_CAPACITY,
+)
+
+
+def revoke_token(token) -> bool:
+    """Отзыв access или refresh токена simplejwt. False - токен уже был отозван"""
+
+    return revoked_tokens.revoke(token[api_settings.JTI_CLAIM], token['exp'])
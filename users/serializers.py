@@ -1,5 +1,12 @@
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
 from .models import User, UserAdditionalInfo
+from .revocation import revoke_token, revoked_tokens
 
 
 class UserInfoSerializer(serializers.ModelSerializer):
@@ -64,3 +71,51 @@ class UpdateUserInfoSerializer(UserSerializer):
         return super(UpdateUserInfoSerializer, self).update(instance, validated_data)
 
 
+def get_refresh_token(raw_token: str) -> RefreshToken:
+    """Проверенный refresh токен, который не был отозван"""
+
+    try:
+        refresh = RefreshToken(raw_token)
+    except TokenError as error:
+        raise InvalidToken(error.args[0])
+    if revoked_tokens.is_revoked(refresh[api_settings.JTI_CLAIM]):
+        raise InvalidToken(_('Token is blacklisted'))
+    return refresh
+
+
+class RevokingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление токенов с отзывом использованного refresh токена при ротации (BLACKLIST_AFTER_ROTATION)
+    без приложения token_blacklist
+    """
+
+    def validate(self, attrs):
+        refresh = get_refresh_token(attrs['refresh'])
+        # отзыв - атомарный захват токена: из параллельных обновлений одним токеном проходит только одно
+        if api_settings.ROTATE_REFRESH_TOKENS and api_settings.BLACKLIST_AFTER_ROTATION and not revoke_token(refresh):
+            raise InvalidToken(_('Token is blacklisted'))
+        return super().validate(attrs)
+
+
+class TokenRevokeSerializer(serializers.Serializer):
+    """Отзыв refresh токена при выходе"""
+
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value: str) -> RefreshToken:
+        return get_refresh_token(value)
+
+
+class UserImportFileSerializer(serializers.Serializer):
+    """Файл массового импорта пользователей"""
+
+    file = serializers.FileField()
+
+    def validate_file(self, value):
+        from .bulk_import import get_format
+
+        try:
+            get_format(value.name)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return value
@@ -1,4 +1,7 @@
 import requests, logging
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import QuerySet
+from django.db.models.functions import Greatest
 from rest_framework.request import Request
 
 from .models import User, UserAdditionalInfo
@@ -16,6 +19,25 @@ def signup_user(self, request: Request) -> None:
     UserAdditionalInfo.objects.create(**userinfo)
 
 
+def search_users(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Поиск пользователей по части логина, телефона или номера счета.
+    Каждое условие отбирается своим триграммным индексом, результаты объединяются через UNION,
+    ранг похожести считается только по найденным строкам.
+    """
+
+    from finance.models import Account
+
+    matched_ids = User.objects.filter(username__icontains=query).values('id').union(
+        User.objects.filter(phone__icontains=query).values('id'),
+        Account.objects.filter(number__icontains=query, user__isnull=False).values('user_id'),
+    )
+
+    return queryset.filter(id__in=matched_ids).annotate(
+        search_rank=Greatest(TrigramSimilarity('username', query), TrigramSimilarity('phone', query)),
+    )
+
+
 def advanced_get_request(url: str, timeout: int) -> dict:
     """Get-запрос, c подключенным логгированием и покрытый исключениями"""
 
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_cached_user(sender, instance, *args, **kwargs):
+    """
+    Сброс пользователя из кэша аутентификации при любом изменении: смене пароля, деактивации, правах.
+    QuerySet.update() сигналов не отправляет, после него нужно вызвать invalidate_cached_user
+    """
+
+    invalidate_cached_user(instance.pk)
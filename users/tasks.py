@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from backend_exchanger.celery import app
+
+
+@app.task(bind=True, ignore_result=False, time_limit=settings.USER_IMPORT_TIME_LIMIT)
+def import_users(self, file_name: str, file_format: str):
+    """
+    Импорт пользователей из загруженного администратором файла.
+    Ход импорта доступен в состоянии задачи PROGRESS, загруженный файл удаляется по завершении
+    """
+
+    from .bulk_import import import_users as run_import
+
+    def progress(report):
+        self.update_state(state='PROGRESS', meta=report.as_dict())
+
+    try:
+        with default_storage.open(file_name, 'rb') as stream:
+            return run_import(stream, file_format, progress).as_dict()
+    finally:
+        default_storage.delete(file_name)
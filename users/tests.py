@@ -1,9 +1,24 @@
+import io
+import json
+import uuid
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from rest_framework import status
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from finance.models import Currency
+from finance.models import Account, Currency
+from .bulk_import import UserImporter, read_rows
+from .authentication import CachedJWTAuthentication, invalidate_cached_user, local_user_cache
 from .models import User, UserAdditionalInfo
+from .revocation import (
+    REVOKED_TOKENS_KEYS, BloomFilter, RevokedTokens, get_revocation_redis, revoke_token, revoked_tokens,
+)
 from .serializers import GetUserInfoSerializer
 
 
@@ -114,3 +129,205 @@ class UsersTests(APITestCase):
 
         response = self.client.patch(f'/api/v1/users/area/{self.user_1.id}/', updated_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached@mail.ru', password='qwerty123456')
+        self.token = AccessToken.for_user(self.user)
+        invalidate_cached_user(self.user.pk)
+
+    def authenticate(self):
+        return CachedJWTAuthentication().get_user(self.token)
+
+    def test_user_is_cached(self):
+        """Пользователь запрашивается из БД один раз, затем из памяти процесса или Redis"""
+
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        local_user_cache.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+        # каждому запросу достается своя копия
+        user.first_name = 'Изменено'
+        self.assertEqual(self.authenticate().first_name, '')
+
+    def test_cache_is_reset_on_deactivation_and_password_change(self):
+        """Деактивация и смена пароля сразу видны аутентификации"""
+
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new-password-123')
+            self.user.save()
+        self.assertTrue(self.authenticate().check_password('new-password-123'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_stale_read_is_not_cached_after_reset(self):
+        """Строка, прочитанная до сброса кэша, не остается в Redis после него"""
+
+        stale = User.objects.get(pk=self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        def read_before_reset(*args, **kwargs):
+            # сброс после коммита приходит между чтением строки и записью в кэш
+            invalidate_cached_user(self.user.pk)
+            return stale
+
+        with mock.patch('django.db.models.QuerySet.first', read_before_reset):
+            self.authenticate()
+        local_user_cache.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class TokenRevocationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='revoked@mail.ru', password='qwerty123456')
+        self.refresh = RefreshToken.for_user(self.user)
+        get_revocation_redis().delete(*REVOKED_TOKENS_KEYS)
+        revoked_tokens.reload()
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_bloom_filter(self):
+        """Фильтр Блума не пропускает добавленные jti и редко срабатывает на остальные"""
+
+        bloom = BloomFilter(1000, 0.01)
+        added = [uuid.uuid4().hex for _ in range(1000)]
+        for jti in added:
+            bloom.add(jti)
+        self.assertTrue(all(jti in bloom for jti in added))
+        false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_valid_token_is_checked_without_redis(self):
+        """Действующий токен проверяется по фильтру в памяти, отозванный отклоняется"""
+
+        access = self.refresh.access_token
+        with mock.patch('users.revocation.get_revocation_redis', side_effect=AssertionError):
+            self.assertEqual(self.authenticate(access)[0], self.user)
+
+        revoke_token(access)
+        with self.assertRaises(InvalidToken):
+            self.authenticate(access)
+
+        # другой процесс узнает об отзыве при загрузке фильтра и при дочитывании журнала
+        other_process = RevokedTokens(0, 600, 0.001, 100)
+        self.assertTrue(other_process.is_revoked(access['jti']))
+        self.assertFalse(other_process.is_revoked(self.refresh.access_token['jti']))
+        revoke_token(self.refresh)
+        self.assertEqual(other_process.count, 1)
+        self.assertTrue(other_process.is_revoked(self.refresh['jti']))
+        self.assertEqual(other_process.count, 2)
+
+    def test_refresh_rotation_and_logout(self):
+        """Использованный при ротации refresh токен отозван, выход отзывает оба токена"""
+
+        response = self.client.post('/api/token/refresh', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post('/api/token/refresh', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        # параллельное обновление, прошедшее проверку до отзыва, тоже отклоняется
+        with mock.patch('users.serializers.revoked_tokens.is_revoked', return_value=False):
+            response = self.client.post('/api/token/refresh', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        response = self.client.post('/api/token/revoke', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post('/api/token/revoke', format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post('/api/token/refresh', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class UserImportTests(APITestCase):
+
+    def setUp(self):
+        Currency.objects.bulk_create([
+            Currency(symbol='₽', code=821, short_name='RUR', full_name='Российский рубль'),
+            Currency(symbol='$', code=840, short_name='USD', full_name='доллар США'),
+        ])
+        self.admin = User.objects.create_user(username='admin@mail.ru', password='qwerty123456', is_staff=True)
+
+    def test_import_users(self):
+        """Пользователи создаются пачками с доп. информацией и счетами, ошибочные строки пропускаются"""
+
+        rows = [
+            {
+                'username': 'import1@mail.ru', 'password': 'qwerty123456',
+                'phone': '+79990000001', 'passport_series': '1234',
+            },
+            {'username': 'import2@mail.ru', 'password': 'qwerty123456', 'first_name': 'Иван'},
+            {'username': 'import3@mail.ru'},
+            {'username': 'admin@mail.ru', 'password': 'qwerty123456'},
+            {'username': 'import1@mail.ru', 'password': 'qwerty123456'},
+            {'username': 'not-an-email', 'password': 'qwerty123456'},
+            {'username': 'import4@mail.ru', 'passport_series': '12ab'},
+        ]
+        lines = [json.dumps(row) for row in rows] + ['{broken']
+        stream = io.BytesIO('\n'.join(lines).encode())
+
+        progress = []
+        report = UserImporter(batch_size=3, workers=1).run(read_rows(stream, 'ndjson'), progress.append)
+
+        self.assertEqual((report.rows, report.created, report.skipped), (8, 3, 5))
+        self.assertEqual(sorted(error['line'] for error in report.errors), [4, 5, 6, 7, 8])
+        self.assertGreater(len(progress), 1)
+
+        imported = User.objects.filter(username__startswith='import')
+        self.assertEqual(imported.count(), 3)
+        self.assertEqual(Account.objects.filter(user__in=imported).count(), 3 * Currency.objects.count())
+        self.assertEqual(UserAdditionalInfo.objects.filter(user__in=imported).count(), 3)
+        self.assertTrue(imported.get(username='import1@mail.ru').check_password('qwerty123456'))
+        self.assertFalse(imported.get(username='import3@mail.ru').has_usable_password())
+        self.assertEqual(UserAdditionalInfo.objects.get(user__username='import1@mail.ru').passport_series, '1234')
+
+    def test_read_csv(self):
+        """Пустые ячейки CSV не передаются в строку"""
+
+        stream = io.BytesIO('username,password,phone\nimport@mail.ru,qwerty123456,\n'.encode())
+        self.assertEqual(
+            list(read_rows(stream, 'csv')),
+            [(2, {'username': 'import@mail.ru', 'password': 'qwerty123456'}, None)],
+        )
+
+    def test_import_endpoint(self):
+        """Файл сохраняется в хранилище и передается задаче, импорт доступен только администратору"""
+
+        upload = SimpleUploadedFile('users.csv', b'username\nimport@mail.ru\n')
+        user = User.objects.create_user(username='user@mail.ru', password='qwerty123456')
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/users/import', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.admin)
+        upload = SimpleUploadedFile('users.xlsx', b'')
+        response = self.client.post('/api/users/import', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = SimpleUploadedFile('users.csv', b'username\nimport@mail.ru\n')
+        with mock.patch('users.views.import_users.delay') as delay:
+            delay.return_value.id = 'task-id'
+            response = self.client.post('/api/users/import', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'task_id': 'task-id'})
+        file_name, file_format = delay.call_args.args
+        self.assertEqual(file_format, 'csv')
+        with default_storage.open(file_name, 'rb') as stream:
+            self.assertEqual(stream.read(), b'username\nimport@mail.ru\n')
+        default_storage.delete(file_name)
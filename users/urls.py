@@ -10,4 +10,8 @@ urlpatterns = router.urls
 
 urlpatterns += [
     path('signup', views.UserSignupView.as_view()),
+    path('token/refresh', views.RevokingTokenRefreshView.as_view()),
+    path('token/revoke', views.TokenRevokeView.as_view()),
+    path('users/import', views.UserImportView.as_view()),
+    path('users/import/<str:task_id>', views.UserImportStatusView.as_view()),
 ]
@@ -1,17 +1,31 @@
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.generics import CreateAPIView, RetrieveUpdateAPIView
 from rest_framework.mixins import RetrieveModelMixin, UpdateModelMixin
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.parsers import MultiPartParser
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenRefreshView
 from drf_yasg.utils import swagger_auto_schema
+from celery.result import AsyncResult
+from django.core.files.storage import default_storage
 from django.utils.decorators import method_decorator
-from typing import Type, Any, Dict
+import uuid
+from typing import Type, Any, Dict, List
 
 from .models import User
-from .serializers import UserSerializer, GetUserInfoSerializer, UpdateUserInfoSerializer
+from .revocation import revoke_token
+from .serializers import (
+    UserSerializer, GetUserInfoSerializer, UpdateUserInfoSerializer, RevokingTokenRefreshSerializer,
+    TokenRevokeSerializer, UserImportFileSerializer,
+)
 from backend_exchanger.swagger_schema import TOKENS_PARAMETER
 from .services import signup_user
+from .bulk_import import get_format
+from .tasks import import_users
 
 
 @method_decorator(name='create', decorator=swagger_auto_schema(tags=['signup']))
@@ -26,6 +40,64 @@ class UserSignupView(CreateAPIView):
         return Response(status=status.HTTP_201_CREATED)
 
 
+@method_decorator(name='post', decorator=swagger_auto_schema(tags=['token']))
+class RevokingTokenRefreshView(TokenRefreshView):
+    """Обновление access токена, использованный refresh токен отзывается при ротации"""
+
+    serializer_class = RevokingTokenRefreshSerializer
+
+
+@method_decorator(name='post', decorator=swagger_auto_schema(tags=['token'], request_body=TokenRevokeSerializer))
+class TokenRevokeView(APIView):
+    """Выход: отзыв текущего access токена и переданного refresh токена до истечения их срока"""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request: Request) -> Response:
+        serializer = TokenRevokeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if isinstance(request.auth, AccessToken):
+            revoke_token(request.auth)
+        if 'refresh' in serializer.validated_data:
+            revoke_token(serializer.validated_data['refresh'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@method_decorator(
+    name='post',
+    decorator=swagger_auto_schema(tags=['Administrator'], request_body=UserImportFileSerializer, **TOKENS_PARAMETER),
+)
+class UserImportView(APIView):
+    """
+    Массовый импорт пользователей из CSV или NDJSON.
+    Файл сохраняется в хранилище и обрабатывается задачей в очереди user_import, в ответе - id задачи
+    """
+
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request: Request) -> Response:
+        serializer = UserImportFileSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        file_format = get_format(upload.name)
+        file_name = default_storage.save(f'user_imports/{uuid.uuid4()}.{file_format}', upload)
+        task = import_users.delay(file_name, file_format)
+        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+
+
+@method_decorator(name='get', decorator=swagger_auto_schema(tags=['Administrator'], **TOKENS_PARAMETER))
+class UserImportStatusView(APIView):
+    """Ход массового импорта: состояние задачи и счетчики строк"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request, task_id: str) -> Response:
+        result = AsyncResult(task_id, app=import_users.app)
+        progress = result.info if isinstance(result.info, dict) else None
+        return Response({'state': result.state, 'progress': progress})
+
+
 @method_decorator(
     name='partial_update',
     decorator=swagger_auto_schema(